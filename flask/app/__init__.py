@@ -10,11 +10,16 @@ from flask_cors import CORS
 from flask_login import LoginManager
 from flask_pymysql import MySQL
 
-from app.pusher import Pusher
+from app.hashing import password_hasher
+from app.pool import ConnectionPool
+from app.pusher import Pusher, PusherDispatcher
+from app.tokens import token_service
 
 db = MySQL()
+db_pool = ConnectionPool()
 login_manager = LoginManager()
 pusher_client = Pusher()
+pusher_dispatcher = PusherDispatcher(pusher_client)
 
 
 def get_config():
@@ -62,15 +67,30 @@ def create_app(test_config=False):
     }
     app.config['pymysql_kwargs'] = pymysql_connect_kwargs
     db.init_app(app)
+    db_pool.init_app(app)
 
     # Configure Flask-login
     login_manager.init_app(app)
 
     # Configure pusher
     pusher_client.init_app(app)
+    pusher_dispatcher.init_app(app)
+
+    # Configure token signing
+    token_service.init_app(app)
+
+    # Configure password hashing
+    password_hasher.init_app(app)
 
     from app import models, tokens, tasks, loaders, repositories
 
+    # Claims access tokens are trusted without loading the person for this long
+    models.Person.configure_session_cache(ttl=int(app.config['ACCESS_TOKEN_REVALIDATE']))
+
+    # Evict entities saved by other processes from the local caches
+    if str(app.config.get('CACHE_INVALIDATION_BUS')).lower() in ('1', 'true', 'yes'):
+        tasks.start_cache_invalidation_subscriber(app)
+
     from . import views
     views.init_app(app)
 
@@ -0,0 +1,121 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Thread-safe, size bounded LRU cache with per entry time-to-live.
+    Keeps hit/miss/eviction counters for `stats`.
+    """
+
+    def __init__(self, maxsize=1024, ttl=60, timer=time.monotonic):
+        if maxsize < 1:
+            raise ValueError('maxsize should be at least 1')
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._timer = timer
+        self._lock = threading.RLock()
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= self._timer():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        expires_at = self._timer() + self.ttl if self.ttl else None
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (value, expires_at)
+            while len(self._data) > self.maxsize:
+                self._remove(next(iter(self._data)))
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._data):
+                self._remove(key)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+    def _remove(self, key):
+        del self._data[key]
+
+
+class ModelCache(LRUCache):
+    """
+    Read-through cache of latest, active rows of one model, keyed by the lookup column and value.
+    Rows are stored as dicts so every lookup materialises its own object.
+    Entries are indexed by entity_id so that a new version of an entity evicts all its lookups.
+    """
+
+    def __init__(self, maxsize=1024, ttl=60, timer=time.monotonic):
+        super().__init__(maxsize=maxsize, ttl=ttl, timer=timer)
+        self._by_entity_id = {}
+
+    def get_row(self, key, value, variant=None):
+        row = self.get((key, str(value), variant))
+        return dict(row) if row is not None else None
+
+    def set_row(self, key, value, row, variant=None):
+        if not row or not row.get('entity_id'):
+            return
+        with self._lock:
+            self.set((key, str(value), variant), dict(row))
+
+    def invalidate(self, entity_id):
+        """Evicts every lookup that returned a version of `entity_id`."""
+        with self._lock:
+            for key in list(self._by_entity_id.get(str(entity_id), ())):
+                self.delete(key)
+
+    def _remove(self, key):
+        row, _ = self._data.pop(key)
+        keys = self._by_entity_id.get(str(row['entity_id']))
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_entity_id[str(row['entity_id'])]
+
+    def set(self, key, value):
+        with self._lock:
+            super().set(key, value)
+            if key in self._data:
+                self._by_entity_id.setdefault(str(value['entity_id']), set()).add(key)
@@ -0,0 +1,140 @@
+import hashlib
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+class HashingBusy(Exception):
+    def __init__(self, message, *errors):
+        Exception.__init__(self, message)
+        self.errors = errors
+
+
+class PasswordHasher:
+    """
+    Hashes and checks passwords in a bounded pool of worker processes so that the CPU heavy
+    key derivation does not hold the GIL of the web process.
+    At most `max_pending` hashes are queued, callers wait up to `timeout` seconds for a slot
+    and get HashingBusy after that. With `workers=0` hashes run in the calling thread.
+
+    The algorithm and cost are werkzeug's: `method` (pbkdf2:<hashlib digest>, e.g. pbkdf2:sha256) and
+    `iterations`. werkzeug 2.0 takes a cost only for pbkdf2, other methods are rejected.
+    `needs_rehash` tells whether a stored hash was made with other parameters.
+    """
+
+    def __init__(self, app=None, **options):
+        self._executor = None
+        self._lock = threading.Lock()
+        self.configure()
+        if app is not None:
+            self.init_app(app, **options)
+
+    def init_app(self, app, **options):
+        sd = options.setdefault
+        conf = app.config
+
+        sd('method', conf.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256'))
+        sd('iterations', conf.get('PASSWORD_HASH_ITERATIONS', 260000))
+        sd('salt_length', conf.get('PASSWORD_HASH_SALT_LENGTH', 16))
+        sd('workers', conf.get('PASSWORD_HASH_WORKERS', os.cpu_count() or 1))
+        sd('max_pending', conf.get('PASSWORD_HASH_MAX_PENDING', 0))
+        sd('timeout', conf.get('PASSWORD_HASH_TIMEOUT', 10))
+
+        self.configure(**options)
+
+        if not hasattr(app, 'extensions'):
+            app.extensions = {}
+        app.extensions['password_hasher'] = self
+
+    def configure(self, method='pbkdf2:sha256', iterations=260000, salt_length=16, workers=0, max_pending=0,
+                  timeout=10):
+        """
+        :param max_pending: hashes queued or running at once, 4 per worker by default
+        """
+        algorithm, _, digest = method.partition(':')
+        if algorithm != 'pbkdf2' or digest not in hashlib.algorithms_guaranteed:
+            raise ValueError(f'Unsupported password hash method {method}, expected pbkdf2:<digest>')
+        workers = int(workers)
+        max_pending = int(max_pending) or 4 * max(workers, 1)
+        slots = threading.BoundedSemaphore(max_pending)
+        # hashes in flight keep the semaphore and executor they started with
+        with self._lock:
+            self.method = method
+            self.iterations = int(iterations)
+            self.salt_length = int(salt_length)
+            self.workers = workers
+            self.max_pending = max_pending
+            self.timeout = float(timeout)
+            self._slots = slots
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    @property
+    def full_method(self):
+        return f'{self.method}:{self.iterations}'
+
+    def hash(self, raw_password):
+        return self._run(generate_password_hash, raw_password, self.full_method, self.salt_length)
+
+    def check(self, password_hash, raw_password):
+        if not password_hash:
+            return False
+        return self._run(check_password_hash, password_hash, raw_password)
+
+    def needs_rehash(self, password_hash):
+        """True if `password_hash` was made with another method, cost or salt length."""
+        if not password_hash or password_hash.count('$') < 2:
+            return True
+        method, salt, _ = password_hash.split('$', 2)
+        return method != self.full_method or len(salt) != self.salt_length
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def _get_executor(self, workers):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=workers)
+            return self._executor
+
+    def _discard_executor(self, executor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False)
+
+    def _run(self, func, *args):
+        with self._lock:
+            slots, workers, timeout, max_pending = self._slots, self.workers, self.timeout, self.max_pending
+        if not slots.acquire(timeout=timeout):
+            raise HashingBusy(f'Password hashing queue is full ({max_pending} pending)')
+        try:
+            if not workers:
+                return func(*args)
+            executor = self._get_executor(workers)
+            try:
+                return executor.submit(func, *args).result()
+            except BrokenProcessPool:
+                # a worker died, the next call starts a new pool
+                self._discard_executor(executor)
+                raise
+        finally:
+            slots.release()
+
+
+password_hasher = PasswordHasher()
+
+
+def hash_password(raw_password):
+    return password_hasher.hash(raw_password)
+
+
+def check_password(password_hash, raw_password):
+    return password_hasher.check(password_hash, raw_password)
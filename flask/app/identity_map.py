@@ -0,0 +1,61 @@
+from flask import g, has_request_context
+
+
+class IdentityMap:
+    """
+    Objects materialised by model lookups, keyed by (table, key, value, variant),
+    so that repeated lookups of the same row return the already loaded object instead of running a SELECT.
+    `None` results are kept too, a save to the table drops every entry of that table.
+    """
+
+    def __init__(self):
+        self._objects = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, table, key, value, variant=None):
+        """
+        Returns a (found, object) tuple.
+        :return: (True, object or None) if the lookup has been made already, (False, None) otherwise
+        """
+        identity = (table, key, str(value), variant)
+        if identity in self._objects:
+            self.hits += 1
+            return True, self._objects[identity]
+        self.misses += 1
+        return False, None
+
+    def add(self, table, key, value, o, variant=None):
+        self._objects[(table, key, str(value), variant)] = o
+        if o is not None and key != 'entity_id' and o.entity_id:
+            self._objects.setdefault((table, 'entity_id', str(o.entity_id), variant), o)
+
+    def invalidate(self, table):
+        self._objects = {identity: o for identity, o in self._objects.items() if identity[0] != table}
+
+    def clear(self):
+        self._objects = {}
+
+
+def current_identity_map():
+    """
+    Returns the identity map of the current Flask request,
+    or of the current Repository block outside of a request, or None.
+    """
+    if has_request_context():
+        if 'identity_map' not in g:
+            g.identity_map = IdentityMap()
+        return g.identity_map
+    from app.transaction import current_transaction
+    transaction = current_transaction()
+    if transaction is None:
+        return None
+    if transaction.identity_map is None:
+        transaction.identity_map = IdentityMap()
+    return transaction.identity_map
+
+
+def invalidate_identity_map(table):
+    identity_map = current_identity_map()
+    if identity_map is not None:
+        identity_map.invalidate(table)
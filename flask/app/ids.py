@@ -0,0 +1,33 @@
+import os
+import time
+
+
+def uuid7_hex():
+    """
+    Returns a UUIDv7 as 32 lower case hex characters: a 48 bit unix timestamp in milliseconds
+    followed by random bits, so ids generated later sort after earlier ones and are inserted
+    at the end of the primary key instead of at random pages.
+    """
+    value = (int(time.time() * 1000) & 0xFFFFFFFFFFFF) << 80
+    value |= int.from_bytes(os.urandom(10), 'big')
+    # version 7 and RFC 4122 variant
+    value = (value & ~(0xF << 76)) | (0x7 << 76)
+    value = (value & ~(0x3 << 62)) | (0x2 << 62)
+    return f'{value:032x}'
+
+
+def encode_id(value):
+    """Hex id to the 16 bytes stored in a BINARY(16) column, other values are returned unchanged."""
+    if isinstance(value, str) and len(value) == 32:
+        try:
+            return bytes.fromhex(value)
+        except ValueError:
+            return value
+    return value
+
+
+def decode_id(value):
+    """16 bytes read from a BINARY(16) column to the hex id used by the models."""
+    if isinstance(value, (bytes, bytearray)) and len(value) == 16:
+        return value.hex()
+    return value
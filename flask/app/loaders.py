@@ -1,25 +1,56 @@
 from app import login_manager
 
 from app.models import Person
-from app.tokens import confirm_access_token
+from app.repositories import PersonRepository
+from app.tokens import token_service
 
 
 @login_manager.request_loader
 def load_user_from_request(request):
-    person = Person()
     entity_id = None
     # try to login using Basic Auth
     api_key = request.headers.get('Authorization')
     if api_key:
         api_key = api_key.replace('Basic ', '', 1)
         try:
-            entity_id = confirm_access_token(api_key)
+            entity_id = token_service.verify_access_token(api_key)
         except TypeError:
             pass
+        if isinstance(entity_id, dict):
+            return load_user_from_claims(entity_id, api_key)
         if entity_id:
-            user = person.get(entity_id, key='entity_id')
+            user = PersonRepository.get_by_id(entity_id)
             if user:
+                if user.access_token == api_key:
+                    # the token has just been verified, is_authenticated reuses the result
+                    Person.verifications += 1
+                    user.set_authenticated(api_key, entity_id == user.entity_id)
                 return user
         return None
     # finally, return None if both methods did not login the user
     return None
+
+
+def load_user_from_claims(claims, access_token):
+    """
+    Builds the user from the verified claims of `access_token`.
+    The person is loaded unless `access_token` is the stored access token checked recently and
+    the person has not been saved since, so deactivated persons and replaced tokens are rejected.
+    """
+    entity_id = claims['sub']
+    if Person.is_session_checked(entity_id, access_token):
+        Person.verifications_saved += 1
+        return Person.from_token_claims(claims, access_token)
+    user = PersonRepository.get_by_id(entity_id)
+    if user is None or user.access_token != access_token or not user.is_authenticated:
+        return None
+    Person.mark_session_checked(entity_id, access_token)
+    return user
+
+
+def authentication_stats():
+    """Access token verifications made and skipped by cached results since the process started."""
+    return {
+        'verifications': Person.verifications,
+        'verifications_saved': Person.verifications_saved,
+    }
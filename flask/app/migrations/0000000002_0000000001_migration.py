@@ -0,0 +1,35 @@
+from lib.base_migration import BaseMigration
+
+revision = "0000000002"
+down_revision = "0000000001"
+
+migration = BaseMigration()
+
+
+def upgrade():
+    # save notifications written in the same transaction as the versioned INSERT, drained by relay.py
+    migration.create_table(
+        'outbox',
+        """
+            `id` bigint NOT NULL AUTO_INCREMENT,
+            `table_name` varchar(64) NOT NULL,
+            `operation` varchar(16) NOT NULL,
+            `entity` MEDIUMTEXT NOT NULL,
+            `api_entity` MEDIUMTEXT NOT NULL,
+            `task_sent` tinyint(1) DEFAULT '0',
+            `pusher_sent` tinyint(1) DEFAULT '0',
+            `attempts` int NOT NULL DEFAULT '0',
+            `last_error` TEXT NULL DEFAULT NULL,
+            `created_on` timestamp NULL DEFAULT CURRENT_TIMESTAMP,
+            `next_attempt_on` timestamp NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (`id`),
+            INDEX pending_ind (`next_attempt_on`, `attempts`)
+        """
+    )
+    migration.update_version_table(version=revision)
+
+
+def downgrade():
+    # write migration here
+    migration.drop_table('outbox')
+    migration.update_version_table(version=down_revision)
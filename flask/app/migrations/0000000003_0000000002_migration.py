@@ -0,0 +1,35 @@
+from lib.base_migration import BaseMigration
+
+revision = "0000000003"
+down_revision = "0000000002"
+
+migration = BaseMigration()
+
+
+def upgrade():
+    # current access token per person, replaced in place on login instead of storing a new person version
+    migration.create_table(
+        'session',
+        """
+            `person_id` varchar(32) NOT NULL,
+            `access_token` varchar(1024) NULL DEFAULT NULL,
+            `expires_in` int(11) NULL DEFAULT NULL,
+            `created_on` timestamp NULL DEFAULT CURRENT_TIMESTAMP,
+            `changed_on` timestamp NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            PRIMARY KEY (`person_id`)
+        """
+    )
+    migration.execute(
+        """
+            INSERT INTO session (person_id, access_token, expires_in)
+            SELECT entity_id, access_token, expires_in FROM person
+            WHERE latest = 1 AND access_token IS NOT NULL;
+        """
+    )
+    migration.update_version_table(version=revision)
+
+
+def downgrade():
+    # write migration here
+    migration.drop_table('session')
+    migration.update_version_table(version=down_revision)
@@ -0,0 +1,29 @@
+from lib.base_migration import BaseMigration
+
+revision = "0000000004"
+down_revision = "0000000003"
+
+migration = BaseMigration()
+
+
+def upgrade():
+    # latest accepted clickwrap agreement per user, see app.models.UserClickwrapStatus
+    migration.create_table(
+        'user_clickwrap_status',
+        """
+            `user_id` varchar(32) NOT NULL,
+            `clickwrap_content_version` varchar(16) NOT NULL,
+            `clickwrap_version` varchar(32) NOT NULL,
+            `clickwrap_content_md5` varchar(32) NOT NULL,
+            `changed_on` timestamp NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            PRIMARY KEY (`user_id`)
+        """
+    )
+    # existing acceptances are copied with `python backfill.py clickwrap-status`
+    migration.update_version_table(version=revision)
+
+
+def downgrade():
+    # write migration here
+    migration.drop_table('user_clickwrap_status')
+    migration.update_version_table(version=down_revision)
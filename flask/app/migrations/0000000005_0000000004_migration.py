@@ -0,0 +1,23 @@
+from lib.base_migration import BaseMigration
+
+revision = "0000000005"
+down_revision = "0000000004"
+
+migration = BaseMigration()
+
+# history tables of the versioned tables, see VersionedModel.__storage__; existing superseded versions are moved
+# by `python backfill.py version-history` when VERSIONED_STORAGE is switched to history
+VERSIONED_TABLES = ('person', 'login_method', 'otp_method', 'recovery_code', 'clickwrap', 'clickwrap_acceptance')
+
+
+def upgrade():
+    for table in VERSIONED_TABLES:
+        migration.execute(f"CREATE TABLE {table}_history LIKE {table};")
+    migration.update_version_table(version=revision)
+
+
+def downgrade():
+    for table in VERSIONED_TABLES:
+        migration.execute(f"INSERT INTO {table} SELECT * FROM {table}_history;")
+        migration.drop_table(f'{table}_history')
+    migration.update_version_table(version=down_revision)
@@ -0,0 +1,60 @@
+from lib.base_migration import BaseMigration
+
+revision = "0000000006"
+down_revision = "0000000005"
+
+migration = BaseMigration()
+
+# tables of models with `__binary_id_columns__`, their ids are stored as BINARY(16) when BINARY_IDS is on
+BINARY_ID_TABLES = ('recovery_code', 'recovery_code_history')
+EMPTY_VERSION = "x'00000000000000000000000000000000'"
+
+
+def upgrade():
+    for table in BINARY_ID_TABLES:
+        migration.execute(
+            f"""
+            ALTER TABLE {table}
+                MODIFY `entity_id` varbinary(32) NOT NULL,
+                MODIFY `version` varbinary(32) NOT NULL,
+                MODIFY `previous_version` varbinary(32) DEFAULT NULL;
+            """
+        )
+        migration.execute(
+            f"UPDATE {table} SET entity_id = UNHEX(entity_id), version = UNHEX(version), "
+            f"previous_version = UNHEX(previous_version);"
+        )
+        migration.execute(
+            f"""
+            ALTER TABLE {table}
+                MODIFY `entity_id` binary(16) NOT NULL,
+                MODIFY `version` binary(16) NOT NULL,
+                MODIFY `previous_version` binary(16) DEFAULT {EMPTY_VERSION};
+            """
+        )
+    migration.update_version_table(version=revision)
+
+
+def downgrade():
+    for table in BINARY_ID_TABLES:
+        migration.execute(
+            f"""
+            ALTER TABLE {table}
+                MODIFY `entity_id` varbinary(32) NOT NULL,
+                MODIFY `version` varbinary(32) NOT NULL,
+                MODIFY `previous_version` varbinary(32) DEFAULT NULL;
+            """
+        )
+        migration.execute(
+            f"UPDATE {table} SET entity_id = LOWER(HEX(entity_id)), version = LOWER(HEX(version)), "
+            f"previous_version = LOWER(HEX(previous_version));"
+        )
+        migration.execute(
+            f"""
+            ALTER TABLE {table}
+                MODIFY `entity_id` varchar(32) NOT NULL,
+                MODIFY `version` varchar(32) NOT NULL,
+                MODIFY `previous_version` varchar(32) DEFAULT '00000000000000000000000000000000';
+            """
+        )
+    migration.update_version_table(version=down_revision)
@@ -0,0 +1,21 @@
+from lib.base_migration import BaseMigration
+
+revision = "0000000007"
+down_revision = "0000000006"
+
+migration = BaseMigration()
+
+# access tokens with claims are longer than 255 characters, same width as `session`.`access_token`
+PERSON_TABLES = ('person', 'person_history')
+
+
+def upgrade():
+    for table in PERSON_TABLES:
+        migration.execute(f"ALTER TABLE {table} MODIFY `access_token` varchar(1024) NULL DEFAULT NULL;")
+    migration.update_version_table(version=revision)
+
+
+def downgrade():
+    for table in PERSON_TABLES:
+        migration.execute(f"ALTER TABLE {table} MODIFY `access_token` varchar(255) NULL DEFAULT NULL;")
+    migration.update_version_table(version=down_revision)
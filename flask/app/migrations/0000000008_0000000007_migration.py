@@ -0,0 +1,17 @@
+from lib.base_migration import BaseMigration
+
+revision = "0000000008"
+down_revision = "0000000007"
+
+migration = BaseMigration()
+
+
+def upgrade():
+    # outbox rows given up by relay.py after max_attempts, kept for inspection and manual requeueing
+    migration.execute("CREATE TABLE outbox_dead_letter LIKE outbox;")
+    migration.update_version_table(version=revision)
+
+
+def downgrade():
+    migration.drop_table('outbox_dead_letter')
+    migration.update_version_table(version=down_revision)
@@ -3,31 +3,69 @@ import json
 import logging
 import sys
 import time
+from contextvars import ContextVar
 from datetime import datetime, date
-from uuid import uuid4, UUID
+from uuid import UUID
 
 import jwt
-from app import db, pusher_client
-from app.tokens import generate_access_token, confirm_access_token, confirm_token, generate_recovery_codes
+import pymysql
+from flask import current_app, has_app_context
+
+from app import db_pool, pusher_dispatcher, outbox
+from app.cache import LRUCache, ModelCache
+from app.hashing import hash_password, check_password
+from app.identity_map import current_identity_map, invalidate_identity_map
+from app.ids import uuid7_hex, encode_id, decode_id
+from app.singleflight import SingleFlight
+from app.tokens import (
+    token_service, generate_access_token, confirm_access_token, confirm_token, generate_recovery_codes
+)
+from app.transaction import current_transaction, commit as commit_connection, track_write, has_pending_writes
 from app.utils import get_random_string
-from flask import current_app
-from werkzeug.security import generate_password_hash, check_password_hash
+
+
+_active_connection = ContextVar('active_connection', default=None)
+
+
+class VersionConflict(Exception):
+    """
+    Raised by an optimistic save when the version being replaced is no longer the latest one.
+    The transaction is rolled back, reloading the entity and saving again may succeed.
+    """
+    retryable = True
+
+    def __init__(self, message, *errors):
+        Exception.__init__(self, message)
+        self.message = message
+        self.errors = errors
 
 
 class ConnectionContext():
+    """
+    Checks a connection out of `db_pool` and returns it on exit.
+    Inside a Transaction its connection is used instead. Nested contexts in the same thread
+    reuse the connection that is already checked out so a save that triggers another save
+    never waits on the pool for a second connection.
+    """
+
     def __init__(self, connection=None):
-        self.app_context = None
         self.connection = connection
+        self._token = None
 
     def __enter__(self):
-        self.app_context = current_app.app_context()
-        self.app_context.__enter__()
         if not self.connection:
-            self.connection = db.connect
+            transaction = current_transaction()
+            self.connection = transaction.connection if transaction else _active_connection.get()
+        if not self.connection:
+            self.connection = db_pool.acquire()
+            self._token = _active_connection.set(self.connection)
         return self.connection
 
     def __exit__(self, exc_type, exc_value, tb):
-        self.app_context.__exit__(exc_type, exc_value, tb)
+        if self._token is not None:
+            _active_connection.reset(self._token)
+            self._token = None
+            db_pool.release(self.connection, discard=isinstance(exc_value, pymysql.OperationalError))
 
 
 def default_for_dumps(o):
@@ -53,6 +91,24 @@ def get_class_from_string(class_name):
     raise TypeError("%s is not a class." % class_name)
 
 
+def _get_model_classes(base=None):
+    for model in (base or VersionedModel).__subclasses__():
+        yield model
+        yield from _get_model_classes(model)
+
+
+def invalidate_cached_entities(table_name, entity_ids):
+    """Evicts entities of `table_name` from the local caches of every model stored in that table."""
+    for model in _get_model_classes():
+        if getattr(model, '__tablename__', None) == table_name and model.has_local_cache():
+            model.invalidate_cache(*entity_ids)
+
+
+def clear_model_caches():
+    for model in _get_model_classes():
+        model.clear_cache()
+
+
 class VersionedModel:
     """
     An Abstract Model Class that follows insert-only approach.
@@ -61,6 +117,19 @@ class VersionedModel:
     """
     __abstract__ = True
     __empty_version__ = '00000000000000000000000000000000'
+    # columns written by save_many, models that leave it empty do not support batched saves
+    __insert_columns__: tuple = ()
+    # opt-in process-wide read-through cache of `get` lookups, see app.cache.ModelCache
+    __cache__ = None
+    # opt-in coalescing of concurrent identical `get` lookups into one query, see app.singleflight.SingleFlight
+    __single_flight__ = None
+    # 'default' or 'optimistic', None uses the VERSIONED_SAVE_MODE config, see save
+    __save_mode__ = None
+    # 'single': all versions in `<table>`, 'history': the current version in `<table>` and superseded
+    # versions moved to `<table>_history`, None uses the VERSIONED_STORAGE config
+    __storage__ = None
+    # id columns stored as BINARY(16) when BINARY_IDS is on, the objects keep hex ids, see app.ids
+    __binary_id_columns__: tuple = ()
 
     entity_id: str
     version: str
@@ -94,12 +163,67 @@ class VersionedModel:
     def _notify_object_save(new_entity, table_name, operation):
         from app.tasks import send_task
         send_task('save-notification', 'handle_object_save', new_entity.get_as_dict(), args=[table_name, operation])
-        pusher_client.trigger(
+        pusher_dispatcher.dispatch(
             table_name,
             operation,
             new_entity.get_for_api()
         )
 
+    @staticmethod
+    def _notify_objects_save(table_name, saves):
+        """Notifies the saves of several objects, `saves` maps the operation to its objects, in one publish batch."""
+        from app.tasks import build_task, send_tasks
+        saves = {operation: new_entities for operation, new_entities in saves.items() if new_entities}
+        send_tasks([
+            build_task(
+                'save-notification',
+                'handle_objects_save',
+                {'objects': [new_entity.get_as_dict() for new_entity in new_entities]},
+                args=[table_name, operation]
+            )
+            for operation, new_entities in saves.items()
+        ])
+        pusher_dispatcher.dispatch_batch([
+            {'channel': table_name, 'name': operation, 'data': new_entity.get_for_api()}
+            for operation, new_entities in saves.items()
+            for new_entity in new_entities
+        ])
+
+    @classmethod
+    def get_insert_sql(cls):
+        columns = ', '.join(cls.__insert_columns__)
+        placeholders = ', '.join(['%s'] * len(cls.__insert_columns__))
+        return f"INSERT INTO {cls.__tablename__} ({columns}) VALUES ({placeholders})"
+
+    def get_insert_values(self):
+        if not self.has_binary_ids():
+            return tuple(getattr(self, column) for column in self.__insert_columns__)
+        return tuple(
+            encode_id(getattr(self, column)) if column in self.__binary_id_columns__ else getattr(self, column)
+            for column in self.__insert_columns__
+        )
+
+    @classmethod
+    def has_binary_ids(cls):
+        if not cls.__binary_id_columns__ or not has_app_context():
+            return False
+        return str(current_app.config.get('BINARY_IDS', False)).lower() in ('1', 'true', 'yes')
+
+    @classmethod
+    def sql_id(cls, value):
+        """The value an id is written to and looked up with in this model's table."""
+        return encode_id(value) if cls.has_binary_ids() else value
+
+    @classmethod
+    def decode_row(cls, row):
+        """Returns the fetched row with its binary ids turned into hex ids, the row itself is not modified."""
+        if row and cls.has_binary_ids():
+            row = dict(row)
+            for column in cls.__binary_id_columns__:
+                if column in row:
+                    row[column] = decode_id(row[column])
+        return row
+
     def update_from(self, other):
         if isinstance(other, self.__class__):
             if other.entity_id:
@@ -112,7 +236,7 @@ class VersionedModel:
     def get_new_from_scratch(self):
         if not self.entity_id:
             self.generate_entity_id()
-        self.version = uuid4().hex
+        self.version = uuid7_hex()
         self.previous_version = self.__empty_version__
         self.active = self.active if self.active is not None else True
         self.latest = True
@@ -121,54 +245,221 @@ class VersionedModel:
     def get_new_from_existing(self):
         properties = self.get_as_dict()
         new_entity = self.__class__(**properties)
-        new_entity.version = uuid4().hex
+        new_entity.version = uuid7_hex()
         new_entity.previous_version = self.version
         return new_entity
 
     def update_previous_records(self, cursor):
-        sql = f"""UPDATE {self.__tablename__} SET latest = false WHERE entity_id = '{self.entity_id}';"""
-        cursor.execute(sql)
+        if self.has_binary_ids():
+            cursor.execute(f"UPDATE {self.__tablename__} SET latest = false WHERE entity_id = %s;",
+                           (self.sql_id(self.entity_id),))
+        else:
+            sql = f"""UPDATE {self.__tablename__} SET latest = false WHERE entity_id = '{self.entity_id}';"""
+            cursor.execute(sql)
+        for sql, args in self.get_archive_statements('entity_id = %s', (self.sql_id(self.entity_id),)):
+            cursor.execute(sql, args)
+
+    @classmethod
+    def get_storage(cls):
+        if cls.__storage__:
+            return cls.__storage__
+        return current_app.config.get('VERSIONED_STORAGE', 'single') if has_app_context() else 'single'
+
+    @classmethod
+    def get_history_table(cls):
+        return f'{cls.__tablename__}_history'
+
+    @classmethod
+    def get_archive_statements(cls, condition, args):
+        """
+        With the history storage, statements moving the superseded versions of the rows matching `condition`
+        to the history table, none otherwise.
+        """
+        if cls.get_storage() != 'history':
+            return []
+        condition = f"{condition} AND latest = false"
+        return [
+            (f"INSERT INTO {cls.get_history_table()} SELECT * FROM {cls.__tablename__} WHERE {condition};", args),
+            (f"DELETE FROM {cls.__tablename__} WHERE {condition};", args),
+        ]
+
+    @classmethod
+    def move_to_history(cls, batch_size=1000, connection=None):
+        """
+        Moves the superseded versions saved before the history storage was turned on to the history table,
+        `batch_size` rows per transaction. Returns the number of rows moved.
+        """
+        if cls.get_storage() != 'history':
+            raise ValueError(f'{cls.__tablename__} does not use the history storage')
+        moved = 0
+        last_key = None
+        with ConnectionContext(connection=connection) as connection:
+            while True:
+                with connection.cursor() as cursor:
+                    after = "AND (entity_id > %s OR (entity_id = %s AND version > %s))" if last_key else ""
+                    args = (last_key[0], last_key[0], last_key[1]) if last_key else ()
+                    cursor.execute(
+                        f"SELECT entity_id, version FROM {cls.__tablename__} WHERE latest = false {after} "
+                        f"ORDER BY entity_id, version LIMIT %s",
+                        args + (batch_size,)
+                    )
+                    keys = [tuple(row) for row in cursor.fetchall()]
+                    if not keys:
+                        break
+                    for sql, args in cls.get_archive_statements('(entity_id, version) IN %s', (tuple(keys),)):
+                        cursor.execute(sql, args)
+                commit_connection(connection)
+                moved += len(keys)
+                last_key = keys[-1]
+        return moved
+
+    def replace_previous_version(self, cursor, new_entity, connection):
+        """
+        Retires the version `new_entity` replaces, only if it is still the latest one, and stores `new_entity`.
+        Raises VersionConflict if another save replaced the version first. Nothing is inserted in that case and
+        inside a transaction the statements of the save, including nested saves, are rolled back to a savepoint
+        so the transaction can retry.
+        The conditional UPDATE and the INSERT are separate statements, plus SAVEPOINT inside a transaction:
+        sending them in one round trip would need multi-statements on every pooled connection, which turns
+        any interpolated query into a stacked query injection.
+        """
+        transaction = current_transaction()
+        savepoint = f'save_{new_entity.version}' if transaction is not None and transaction.owns(connection) else None
+        if savepoint:
+            cursor.execute(f'SAVEPOINT {savepoint}')
+        try:
+            replaced = cursor.execute(
+                f"UPDATE {self.__tablename__} SET latest = false "
+                f"WHERE entity_id = %s AND version = %s AND latest = true",
+                (self.sql_id(new_entity.entity_id), self.sql_id(new_entity.previous_version))
+            )
+            if not replaced:
+                raise VersionConflict(
+                    f'{self.__tablename__} {new_entity.entity_id} version {new_entity.previous_version} '
+                    f'has been replaced by another save'
+                )
+            for sql, args in self.get_archive_statements('entity_id = %s', (self.sql_id(new_entity.entity_id),)):
+                cursor.execute(sql, args)
+            new_entity.create_in_database(cursor)
+        except VersionConflict:
+            if savepoint:
+                cursor.execute(f'ROLLBACK TO SAVEPOINT {savepoint}')
+            else:
+                connection.rollback()
+            raise
+
+    def get_save_mode(self):
+        if self.__save_mode__:
+            return self.__save_mode__
+        return current_app.config.get('VERSIONED_SAVE_MODE', 'default') if has_app_context() else 'default'
 
     def save(self, connection=None, commit=True):
+        """
+        Stores a new version of the object.
+        In the 'optimistic' save mode only the version the object was loaded with is replaced
+        and VersionConflict is raised if it is not the latest version anymore.
+        """
         with self._get_connection(default_connection=connection) as connection:
             with connection.cursor() as cursor:
                 updated = False
                 if self.entity_id and self.version:
                     updated = True
                     new_entity = self.get_new_from_existing()
-                    self.update_previous_records(cursor)
+                    if self.get_save_mode() == 'optimistic':
+                        self.replace_previous_version(cursor, new_entity, connection)
+                    else:
+                        self.update_previous_records(cursor)
+                        new_entity.create_in_database(cursor)
                 if not self.entity_id or not self.version:
                     new_entity = self.get_new_from_scratch()
-                new_entity.create_in_database(cursor)
+                    new_entity.create_in_database(cursor)
+                operation = 'update' if updated else 'create'
+                use_outbox = commit and outbox.is_enabled()
+                if use_outbox:
+                    outbox.enqueue(cursor, self.__tablename__, operation, [new_entity])
+                    self._enqueue_cache_invalidation(cursor, new_entity.entity_id)
+            track_write(connection, self.__tablename__)
+            invalidate_identity_map(self.__tablename__)
+            self.invalidate_cache(new_entity.entity_id)
 
             if commit:
-                connection.commit()
-                if cursor:
-                    cursor.close()
-                operation = 'update' if updated else 'create'
-                self._notify_object_save(new_entity, self.__tablename__, operation)
+                def after_commit():
+                    # evict again in case another thread cached the previous version before the commit
+                    self.invalidate_cache(new_entity.entity_id)
+                    if not use_outbox:
+                        self._publish_cache_invalidation(new_entity.entity_id)
+                        self._notify_object_save(new_entity, self.__tablename__, operation)
+                commit_connection(connection, after_commit)
             return new_entity
 
     @classmethod
-    def fetchone_dict(cls, query, commit=True):
+    def save_many(cls, objects, connection=None, commit=True):
+        """
+        Saves objects of this model in bulk: one UPDATE flips `latest` for every
+        existing entity, one multi-row INSERT stores the new versions and the notifications
+        of all operations are sent in one batch.
+        :param objects: iterable of objects of this model
+        :return: list of the stored versions
+        """
+        if not cls.__insert_columns__:
+            raise NotImplementedError(f'{cls.__name__} does not support save_many')
+        created, updated = [], []
+        for o in objects:
+            if o.entity_id and o.version:
+                updated.append(o.get_new_from_existing())
+            else:
+                created.append(o.get_new_from_scratch())
+        new_entities = created + updated
+        if not new_entities:
+            return []
+
+        with cls._get_connection(default_connection=connection) as connection:
+            with connection.cursor() as cursor:
+                if updated:
+                    entity_ids = (tuple(cls.sql_id(o.entity_id) for o in updated),)
+                    cursor.execute(f"UPDATE {cls.__tablename__} SET latest = false WHERE entity_id IN %s;", entity_ids)
+                    for sql, args in cls.get_archive_statements('entity_id IN %s', entity_ids):
+                        cursor.execute(sql, args)
+                cursor.executemany(cls.get_insert_sql(), [o.get_insert_values() for o in new_entities])
+                use_outbox = commit and outbox.is_enabled()
+                if use_outbox:
+                    if created:
+                        outbox.enqueue(cursor, cls.__tablename__, 'create', created)
+                    if updated:
+                        outbox.enqueue(cursor, cls.__tablename__, 'update', updated)
+                        cls._enqueue_cache_invalidation(cursor, *(o.entity_id for o in updated))
+            track_write(connection, cls.__tablename__)
+            invalidate_identity_map(cls.__tablename__)
+            cls.invalidate_cache(*(o.entity_id for o in updated))
+
+            if commit:
+                def notify():
+                    cls.invalidate_cache(*(o.entity_id for o in updated))
+                    if use_outbox:
+                        return
+                    cls._publish_cache_invalidation(*(o.entity_id for o in updated))
+                    cls._notify_objects_save(cls.__tablename__, {'create': created, 'update': updated})
+                commit_connection(connection, notify)
+            return new_entities
+
+    @classmethod
+    def fetchone_dict(cls, query, commit=True, args=None):
         with cls._get_connection() as connection:
             with connection.cursor() as cursor:
-                cursor.execute(query)
+                cursor.execute(query, args)
                 desc = cursor.description
                 results = cursor.fetchone()
                 if results:
                     results = dict(zip([col[0] for col in desc], results))
             if commit:
-                connection.commit()
-                if cursor:
-                    cursor.close()
+                commit_connection(connection)
             return results
 
     @classmethod
-    def fetchall_dict(cls, query, commit=True):
+    def fetchall_dict(cls, query, commit=True, args=None):
         with cls._get_connection() as connection:
             with connection.cursor() as cursor:
-                cursor.execute(query)
+                cursor.execute(query, args)
                 desc = cursor.description
                 rows = cursor.fetchall()
                 results = []
@@ -176,9 +467,7 @@ class VersionedModel:
                     for row in rows:
                         results.append(dict(zip([col[0] for col in desc], row)))
             if commit:
-                connection.commit()
-                if cursor:
-                    cursor.close()
+                commit_connection(connection)
             return results
 
     def get_as_dict(self):
@@ -202,14 +491,97 @@ class VersionedModel:
 
     @classmethod
     def get(cls, value, key='entity_id'):
+        if key in cls.__binary_id_columns__ and cls.has_binary_ids():
+            query = f"""SELECT * FROM {cls.__tablename__} WHERE {key} = %s AND latest = true AND active = true;"""
+            return cls._fetch_model(query, value, key, args=(cls.sql_id(value),))
         query = f"""SELECT * FROM {cls.__tablename__} WHERE {key} = '{str(value)}' AND latest = true AND active = true;"""
-        model = cls.fetchone_dict(query)
+        return cls._fetch_model(query, value, key)
+
+    @classmethod
+    def invalidate_cache(cls, *entity_ids):
+        if cls.__single_flight__ is not None:
+            cls.__single_flight__.forget()
+        if cls.__cache__ is not None:
+            for entity_id in entity_ids:
+                cls.__cache__.invalidate(entity_id)
+
+    @classmethod
+    def clear_cache(cls):
+        if cls.__single_flight__ is not None:
+            cls.__single_flight__.forget()
+        if cls.__cache__ is not None:
+            cls.__cache__.clear()
+
+    @classmethod
+    def has_local_cache(cls):
+        return cls.__cache__ is not None
+
+    @classmethod
+    def _enqueue_cache_invalidation(cls, cursor, *entity_ids):
+        """Writes the eviction of the entities from the caches of the other app processes to the outbox"""
+        if cls.has_local_cache() and entity_ids:
+            outbox.enqueue_cache_invalidation(cursor, cls.__tablename__, entity_ids)
+
+    @classmethod
+    def _publish_cache_invalidation(cls, *entity_ids):
+        """Evicts the entities from the caches of the other app processes, see app.tasks.CacheInvalidationSubscriber"""
+        if not cls.has_local_cache() or not entity_ids:
+            return
+        from app.tasks import publish_cache_invalidation
+        try:
+            publish_cache_invalidation(cls.__tablename__, entity_ids)
+        except Exception as ex:
+            # the entries still expire after the cache TTL
+            logging.error(f"Could not publish cache invalidation for {cls.__tablename__}: {ex}")
+
+    @classmethod
+    def _fetch_model(cls, query, value, key, variant=None, args=None):
+        """
+        Runs a single row lookup by key and value and returns the object or None.
+        Within a request or a repository block the object already materialised
+        for the same lookup is returned without a query,
+        models with a `__cache__` are served from it when possible and
+        models with a `__single_flight__` share the query with concurrent identical lookups.
+        """
+        identity_map = current_identity_map()
+        if identity_map is not None:
+            found, o = identity_map.get(cls.__tablename__, key, value, variant)
+            if found:
+                return o
+        shared = not has_pending_writes(cls.__tablename__)
+        cache = cls.__cache__ if shared else None
+        model = cache.get_row(key, value, variant) if cache is not None else None
+        if model is None:
+            if shared and cls.__single_flight__ is not None:
+                model = cls.__single_flight__.do((query, args), cls.fetchone_dict, query, args=args)
+            else:
+                model = cls.fetchone_dict(query, args=args)
+            model = cls.decode_row(model)
+            if cache is not None:
+                cache.set_row(key, value, model, variant)
+        o = None
         if model:
             o = cls()
             for k, v in model.items():
                 setattr(o, k, v)
+        if identity_map is not None:
+            identity_map.add(cls.__tablename__, key, value, o, variant)
+        return o
+
+    @classmethod
+    def adopt(cls, o, value, key='entity_id', variant=None):
+        """
+        Registers `o`, loaded for the same lookup by another thread, in the identity map of the current request
+        or transaction and returns the object that identity map holds for the lookup.
+        """
+        identity_map = current_identity_map()
+        if identity_map is None:
             return o
-        return None
+        found, existing = identity_map.get(cls.__tablename__, key, value, variant)
+        if found:
+            return existing
+        identity_map.add(cls.__tablename__, key, value, o, variant)
+        return o
 
     def get_one(self, fields: str, condition: str = ''):
         default_condition = "latest = true AND active = true"
@@ -231,13 +603,13 @@ class VersionedModel:
         :return: list of dictionaries or empty list
         """
         query = f"""SELECT {fields} FROM {self.__tablename__} WHERE {key} = '{str(value)}' AND latest = true AND active = true;"""
-        return self.fetchall_dict(query)
+        return [self.decode_row(row) for row in self.fetchall_dict(query)]
 
     def get_all(self, fields: str, condition: str = ''):
         default_condition = "latest = true AND active = true"
         condition = condition + " AND " + default_condition if condition else default_condition
         query = f"""SELECT {fields} FROM {self.__tablename__} WHERE {condition};"""
-        return self.fetchall_dict(query)
+        return [self.decode_row(row) for row in self.fetchall_dict(query)]
 
     def is_new(self):
         return self.previous_version == self.__empty_version__
@@ -246,6 +618,14 @@ class VersionedModel:
         self.active = False
         self.save()
 
+    @classmethod
+    def delete_many(cls, objects, connection=None, commit=True):
+        """Stores inactive versions of the objects in one batch, see save_many."""
+        objects = list(objects)
+        for o in objects:
+            o.active = False
+        return cls.save_many(objects, connection=connection, commit=commit)
+
 
 class UUIDModel(VersionedModel):
     """
@@ -262,7 +642,7 @@ class UUIDModel(VersionedModel):
         raise NotImplementedError
 
     def generate_entity_id(self):
-        self.entity_id = uuid4().hex
+        self.entity_id = uuid7_hex()
 
 
 class ShortUUIDModel(VersionedModel):
@@ -374,6 +754,11 @@ class LoginMethod(UUIDModel):
 
 class OtpMethod(UUIDModel):
     __tablename__ = 'otp_method'
+    __cache__ = ModelCache(maxsize=4096, ttl=60)
+    __columns__ = (
+        'entity_id', 'version', 'previous_version', 'active', 'latest', 'changed_by_id', 'changed_on',
+        'secret', 'person_id', 'name', 'enabled'
+    )
 
     secret: str
     person_id: str
@@ -403,15 +788,18 @@ class OtpMethod(UUIDModel):
             logging.error(f"Error in SQL:\n {e}")
 
         if self.enabled:
-            for code in generate_recovery_codes(RecoveryCode().__number_of_tokens__):
-                RecoveryCode(otp_method_id=self.entity_id, token=code).save()
+            RecoveryCode.save_many(
+                RecoveryCode(otp_method_id=self.entity_id, token=code)
+                for code in generate_recovery_codes(RecoveryCode.__number_of_tokens__)
+            )
         if not self.enabled:
-            for code in RecoveryCode().get_all('*', condition=f"otp_method_id = '{str(self.entity_id)}'"):
-                RecoveryCode().get(code.get('entity_id'), key='entity_id').delete()
+            RecoveryCode.delete_for_otp_method(self.entity_id)
 
 
 class Person(UUIDModel):
     __tablename__ = 'person'
+    # every request authenticated by token loads its person, concurrent requests of a user share the query
+    __single_flight__ = SingleFlight()
 
     first_name: str
     last_name: str
@@ -427,18 +815,29 @@ class Person(UUIDModel):
     # JOINed fields
     latest_clickwrap_accepted: bool
 
+    # access token verifications made and skipped thanks to the cached result
+    verifications = 0
+    verifications_saved = 0
+    # entity_id -> the stored access token checked recently, used with claims tokens
+    __session_cache__ = LRUCache(maxsize=10000, ttl=60)
+
     def __init__(self, first_name=None, last_name=None, email=None, raw_password=None, password=None, verified=False,
                  verified_on=None, access_token=None, expires_in=None,
                  login_method: dict = None, **kwargs):
         self.first_name = first_name
         self.last_name = last_name
         self.email = email
+        # hashed when the person is stored, see create_in_database
         self.raw_password = raw_password
-        self.password = generate_password_hash(raw_password) if self.raw_password else password
+        self.password = password
         self.verified = verified
         self.verified_on = verified_on
         self.access_token = access_token
         self.expires_in = expires_in
+        # (access_token, is_authenticated) of the last verification
+        self._authentication = None
+        # True for partial persons built from access token claims
+        self._from_claims = False
 
         self.login_method = LoginMethod(**login_method) if login_method else None
         super().__init__(**kwargs)
@@ -459,6 +858,9 @@ class Person(UUIDModel):
 
     def create_in_database(self, cursor):
         self.changed_by_id = self.entity_id if self.is_new() and self.changed_by_id is None else self.changed_by_id
+        if self.raw_password:
+            self.password = hash_password(self.raw_password)
+            self.raw_password = None
         # Create a new instance
         try:
             sql = "INSERT INTO {} (entity_id, version, previous_version, active, latest, changed_by_id, first_name, last_name, email, password, verified, verified_on, access_token, expires_in) " \
@@ -467,7 +869,9 @@ class Person(UUIDModel):
                                  self.latest, self.changed_by_id, self.first_name, self.last_name, self.email,
                                  self.password, self.verified, self.verified_on, self.access_token, self.expires_in))
         except Exception as e:
-            logging.warning(f"Error in SQL: {e}")
+            # the previous version is already retired, the save must fail instead of losing the person
+            logging.error(f"Error in SQL: {e}")
+            raise
 
         if self.login_method:
             self.login_method.person_id = self.entity_id
@@ -476,32 +880,88 @@ class Person(UUIDModel):
     @classmethod
     def get(cls, value, key='entity_id', with_clickwrap_acceptance=False):
         default_condition = f"{cls.__tablename__}.latest = true AND {cls.__tablename__}.active = true"
-        condition = f"{cls.__tablename__}.{key} = '{value}'" + " AND " + default_condition
-        
+        condition = f"{cls.__tablename__}.{key} = %s" + " AND " + default_condition
+
         clickwrap_acceptance_query = ""
+        args = ()
         if with_clickwrap_acceptance:
-            clickwrap_acceptance_query = f""",
-            (CASE WHEN EXISTS (SELECT 1 FROM clickwrap_acceptance n WHERE n.user_id = {cls.__tablename__}.entity_id and n.latest=1 and n.active=1 and 
-                    (n.clickwrap_content_version, n.clickwrap_version, n.clickwrap_content_md5)=(SELECT content_version, version, content_md5 FROM clickwrap WHERE entity_id="{ClickwrapAgreement.PUBLISHED_UUID}" AND latest=1 AND active=1))
-                THEN TRUE ELSE FALSE
-            END) as `latest_clickwrap_accepted`
-            """
+            column, args = cls._clickwrap_acceptance_column()
+            clickwrap_acceptance_query = f",{column}"
 
+        # the current access token lives in the session table, person.access_token holds tokens issued before it
         query = f"""
             SELECT 
-                {cls.__tablename__}.*
+                {cls.__tablename__}.*,
+                COALESCE({Session.__tablename__}.access_token, {cls.__tablename__}.access_token) AS access_token,
+                COALESCE({Session.__tablename__}.expires_in, {cls.__tablename__}.expires_in) AS expires_in
                 {clickwrap_acceptance_query}
             FROM {cls.__tablename__} 
+            LEFT JOIN {Session.__tablename__} ON {Session.__tablename__}.person_id = {cls.__tablename__}.entity_id
             WHERE {condition};
         """
 
-        model = cls.fetchone_dict(query)
-        if model:
-            o = cls()
-            for k, v in model.items():
-                setattr(o, k, v)
-            return o
-        return None
+        return cls._fetch_model(query, value, key, variant=with_clickwrap_acceptance, args=(*args, value))
+
+    @classmethod
+    def _clickwrap_acceptance_column(cls):
+        """
+        Returns the `latest_clickwrap_accepted` select expression and its args.
+        The published agreement is taken from ClickwrapAgreement.get_published_terms, not looked up by the query,
+        and compared with the person's row in UserClickwrapStatus.
+        """
+        terms = ClickwrapAgreement.get_published_terms()
+        if terms is None:
+            return "FALSE AS `latest_clickwrap_accepted`", ()
+        return f"""
+            (CASE WHEN EXISTS (SELECT 1 FROM {UserClickwrapStatus.__tablename__} s WHERE s.user_id = {cls.__tablename__}.entity_id and
+                    s.clickwrap_content_version = %s AND s.clickwrap_version = %s AND s.clickwrap_content_md5 = %s)
+                THEN TRUE ELSE FALSE
+            END) as `latest_clickwrap_accepted`
+            """, terms
+
+    @classmethod
+    def get_login_context(cls, email):
+        """
+        Loads the person with `email` with its access token, latest clickwrap acceptance flag
+        and OTP method in one statement. Both objects are added to the identity map
+        so later lookups in the same request do not query them again.
+        :return: (person, otp_method), (None, None) if there is no such person
+        """
+        otp_table = OtpMethod.__tablename__
+        otp_columns = ', '.join(f"{otp_table}.{column} AS `{otp_table}.{column}`" for column in OtpMethod.__columns__)
+        clickwrap_column, args = cls._clickwrap_acceptance_column()
+        query = f"""
+            SELECT 
+                {cls.__tablename__}.*,
+                COALESCE({Session.__tablename__}.access_token, {cls.__tablename__}.access_token) AS access_token,
+                COALESCE({Session.__tablename__}.expires_in, {cls.__tablename__}.expires_in) AS expires_in,
+                {clickwrap_column},
+                {otp_columns}
+            FROM {cls.__tablename__} 
+            LEFT JOIN {Session.__tablename__} ON {Session.__tablename__}.person_id = {cls.__tablename__}.entity_id
+            LEFT JOIN {otp_table} ON {otp_table}.person_id = {cls.__tablename__}.entity_id
+                AND {otp_table}.latest = true AND {otp_table}.active = true
+            WHERE {cls.__tablename__}.email = %s AND {cls.__tablename__}.latest = true AND {cls.__tablename__}.active = true
+            LIMIT 1;
+        """
+        row = cls.fetchone_dict(query, args=(*args, email))
+        if not row:
+            return None, None
+        prefix = f'{otp_table}.'
+        otp_row = {k[len(prefix):]: row.pop(k) for k in list(row) if k.startswith(prefix)}
+        person = cls()
+        for k, v in row.items():
+            setattr(person, k, v)
+        otp_method = None
+        if otp_row.get('entity_id'):
+            otp_method = OtpMethod()
+            for k, v in otp_row.items():
+                setattr(otp_method, k, v)
+        identity_map = current_identity_map()
+        if identity_map is not None:
+            identity_map.add(cls.__tablename__, 'email', email, person, variant=True)
+            identity_map.add(otp_table, 'person_id', person.entity_id, otp_method)
+        return person, otp_method
 
     def get_name_from_id(self, entity_id):
         person = self.get(entity_id, key='entity_id')
@@ -509,7 +969,73 @@ class Person(UUIDModel):
             return f"{person.first_name} {person.last_name}"
 
     def create_token(self):
-        self.access_token, self.expires_in = generate_access_token(self.entity_id)
+        if token_service.claims:
+            self.access_token, self.expires_in = token_service.generate_claims_token(self.get_token_claims())
+        else:
+            self.access_token, self.expires_in = generate_access_token(self.entity_id)
+
+    def get_token_claims(self):
+        """Fields carried by claims access tokens, enough to serve most requests without loading the person."""
+        return {
+            'sub': self.entity_id,
+            'tv': token_service.token_version,
+            'email': self.email,
+            'first_name': self.first_name,
+            'last_name': self.last_name,
+            'verified': bool(self.verified),
+        }
+
+    @classmethod
+    def from_token_claims(cls, claims, access_token):
+        """
+        Builds a partial person from verified token claims.
+        Use `load_full` before saving it or returning it to the client.
+        """
+        person = cls(
+            entity_id=claims['sub'],
+            email=claims.get('email'),
+            first_name=claims.get('first_name'),
+            last_name=claims.get('last_name'),
+            verified=claims.get('verified', False),
+            access_token=access_token,
+        )
+        person._from_claims = True
+        person.set_authenticated(access_token, True)
+        return person
+
+    def load_full(self):
+        """Returns this person, or its latest stored version if it has been built from token claims."""
+        if not self._from_claims:
+            return self
+        return self.get(self.entity_id, key='entity_id')
+
+    @classmethod
+    def configure_session_cache(cls, ttl):
+        cls.__session_cache__ = LRUCache(maxsize=cls.__session_cache__.maxsize, ttl=ttl)
+
+    @classmethod
+    def is_session_checked(cls, entity_id, access_token):
+        """True if `access_token` is the stored access token of the person checked recently."""
+        return access_token is not None and cls.__session_cache__.get(entity_id) == access_token
+
+    @classmethod
+    def mark_session_checked(cls, entity_id, access_token):
+        cls.__session_cache__.set(entity_id, access_token)
+
+    @classmethod
+    def invalidate_cache(cls, *entity_ids):
+        super().invalidate_cache(*entity_ids)
+        for entity_id in entity_ids:
+            cls.__session_cache__.delete(entity_id)
+
+    @classmethod
+    def clear_cache(cls):
+        super().clear_cache()
+        cls.__session_cache__.clear()
+
+    @classmethod
+    def has_local_cache(cls):
+        return super().has_local_cache() or token_service.claims
 
     def get_reset_token(self, expires=3600):
         return jwt.encode(
@@ -534,7 +1060,7 @@ class Person(UUIDModel):
             return
 
     def is_password_valid(self, raw_password):
-        return check_password_hash(self.password, raw_password)
+        return check_password(self.password, raw_password)
 
     def verify_confirmation_token(self, token):
         email = confirm_token(token)
@@ -550,9 +1076,20 @@ class Person(UUIDModel):
         This property should return True if the user is authenticated,
         i.e. they have provided valid credentials.
         (Only authenticated users will fulfill the criteria of login_required.)
+        The result is cached on the object as long as access_token does not change.
         :return: boolean
         """
-        return confirm_access_token(self.access_token) == self.entity_id
+        if self._authentication is not None and self._authentication[0] == self.access_token:
+            Person.verifications_saved += 1
+            return self._authentication[1]
+        Person.verifications += 1
+        authenticated = confirm_access_token(self.access_token) == self.entity_id
+        self._authentication = (self.access_token, authenticated)
+        return authenticated
+
+    def set_authenticated(self, access_token, authenticated):
+        """Caches the result of a verification of `access_token` made elsewhere, e.g. by the request loader."""
+        self._authentication = (access_token, authenticated)
 
     @property
     def is_active(self):
@@ -585,9 +1122,46 @@ class Person(UUIDModel):
         return self.entity_id
 
 
+class Session:
+    """
+    The current access token of a person. The row is replaced in place on every login
+    instead of storing a new version of the person.
+    """
+    __tablename__ = 'session'
+
+    @classmethod
+    def store(cls, person, connection=None, commit=True):
+        """Stores `person.access_token` and `person.expires_in` with a single upsert."""
+        with ConnectionContext(connection=connection) as connection:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"INSERT INTO {cls.__tablename__} (person_id, access_token, expires_in) VALUES (%s, %s, %s) "
+                    f"ON DUPLICATE KEY UPDATE access_token = VALUES(access_token), expires_in = VALUES(expires_in)",
+                    (person.entity_id, person.access_token, person.expires_in)
+                )
+                use_outbox = commit and outbox.is_enabled()
+                if use_outbox:
+                    Person._enqueue_cache_invalidation(cursor, person.entity_id)
+            # person lookups join the session table
+            track_write(connection, Person.__tablename__)
+            invalidate_identity_map(Person.__tablename__)
+            Person.invalidate_cache(person.entity_id)
+
+            if commit:
+                def after_commit():
+                    Person.invalidate_cache(person.entity_id)
+                    if not use_outbox:
+                        Person._publish_cache_invalidation(person.entity_id)
+                commit_connection(connection, after_commit)
+
+
 class RecoveryCode(UUIDModel):
     __tablename__ = 'recovery_code'
+    __binary_id_columns__ = ('entity_id', 'version', 'previous_version')
     __number_of_tokens__: int = 5
+    __insert_columns__ = (
+        'entity_id', 'version', 'previous_version', 'active', 'latest', 'changed_by_id', 'token', 'otp_method_id'
+    )
 
     token: str
     otp_method_id: str
@@ -603,25 +1177,86 @@ class RecoveryCode(UUIDModel):
     def create_in_database(self, cursor):
         try:
             # Create a new instance
-            sql = "INSERT INTO {} (entity_id, version, previous_version, active, latest, changed_by_id, token, otp_method_id)" \
-                  "VALUES (%s, %s, %s, %s, %s, %s, %s, %s)".format(self.__tablename__)
-            cursor.execute(sql, (self.entity_id, self.version,
-                                 self.previous_version, self.active, self.latest, self.changed_by_id,
-                                 self.token, self.otp_method_id))
+            cursor.execute(self.get_insert_sql(), self.get_insert_values())
         except Exception as e:
             logging.error(f"Error in SQL:\n {e}")
 
     def verify_recovery_code(self, token, otp_method_id):
-        stored_codes = self.get_all('token', condition="otp_method_id = '%s' AND token = '%s'" % (otp_method_id, token))
-        if not stored_codes:
-            return False
-        for code in stored_codes:
-            self.get(code.get('token'), key='token').delete()
-        return True
+        return self.consume(token, otp_method_id)
+
+    @classmethod
+    def get_active(cls, otp_method_id):
+        rows = cls.fetchall_dict(
+            f"SELECT * FROM {cls.__tablename__} WHERE otp_method_id = %s AND latest = true AND active = true;",
+            args=(otp_method_id,)
+        )
+        return [cls(**cls.decode_row(row)) for row in rows]
+
+    @classmethod
+    def delete_for_otp_method(cls, otp_method_id, connection=None, commit=True):
+        """Soft deletes every code of the OTP method with one UPDATE and one multi-row INSERT."""
+        return cls.delete_many(cls.get_active(otp_method_id), connection=connection, commit=commit)
+
+    @classmethod
+    def consume(cls, token, otp_method_id, connection=None, commit=True):
+        """
+        Uses up a code: a single conditional UPDATE retires the active version of the code and its row count
+        tells whether the code was valid, so a code is accepted once even by concurrent requests.
+        The inactive version is then copied from the retired row and its save notification is sent
+        like the one of `save`, through the outbox when it is enabled.
+        """
+        consumed_codes = []
+        with cls._get_connection(default_connection=connection) as connection:
+            with connection.cursor() as cursor:
+                consumed = cursor.execute(
+                    f"UPDATE {cls.__tablename__} SET latest = false "
+                    f"WHERE otp_method_id = %s AND token = %s AND latest = true AND active = true;",
+                    (otp_method_id, token)
+                )
+                use_outbox = commit and outbox.is_enabled()
+                if consumed:
+                    version = cls.sql_id(uuid7_hex())
+                    cursor.execute(
+                        f"""
+                        INSERT INTO {cls.__tablename__} ({', '.join(cls.__insert_columns__)})
+                        SELECT r.entity_id, %s, r.version, false, true, r.changed_by_id, r.token, r.otp_method_id
+                            FROM {cls.__tablename__} r
+                            WHERE r.otp_method_id = %s AND r.token = %s AND r.latest = false AND r.active = true
+                            AND NOT EXISTS (SELECT 1 FROM {cls.__tablename__} n
+                                            WHERE n.entity_id = r.entity_id AND n.previous_version = r.version);
+                        """,
+                        (version, otp_method_id, token)
+                    )
+                    cursor.execute(f"SELECT * FROM {cls.__tablename__} WHERE version = %s;", (version,))
+                    columns = [column[0] for column in cursor.description]
+                    consumed_codes = [cls(**cls.decode_row(dict(zip(columns, row)))) for row in cursor.fetchall()]
+                    for sql, args in cls.get_archive_statements('otp_method_id = %s AND token = %s',
+                                                                (otp_method_id, token)):
+                        cursor.execute(sql, args)
+                    if use_outbox and consumed_codes:
+                        outbox.enqueue(cursor, cls.__tablename__, 'update', consumed_codes)
+                        cls._enqueue_cache_invalidation(cursor, *(code.entity_id for code in consumed_codes))
+            if consumed:
+                track_write(connection, cls.__tablename__)
+                invalidate_identity_map(cls.__tablename__)
+            if commit:
+                def after_commit():
+                    if not consumed_codes:
+                        return
+                    cls.invalidate_cache(*(code.entity_id for code in consumed_codes))
+                    if not use_outbox:
+                        cls._publish_cache_invalidation(*(code.entity_id for code in consumed_codes))
+                        cls._notify_objects_save(cls.__tablename__, {'update': consumed_codes})
+                commit_connection(connection, after_commit)
+            return consumed > 0
 
 
 class ClickwrapAgreement(UUIDModel):
     __tablename__ = "clickwrap"
+    # only the draft and the published agreement are ever looked up
+    __cache__ = ModelCache(maxsize=8, ttl=300)
+    # every client reloads the agreement when it is published
+    __single_flight__ = SingleFlight()
 
     content: str
     content_version: str
@@ -633,6 +1268,9 @@ class ClickwrapAgreement(UUIDModel):
     DRAFT_UUID = str(UUID(int=88888888888888)).replace("-", "")
     PUBLISHED_UUID = str(UUID(int=22222222222222)).replace("-", "")
 
+    # (content_version, version, content_md5) of the published agreement, () if there is none
+    __published_terms__ = LRUCache(maxsize=1, ttl=300)
+
     def __init__(self, content=None, content_version=None, content_md5=None, status=None, **kwargs):
         self.content = content
         self.content_version = content_version
@@ -666,17 +1304,53 @@ class ClickwrapAgreement(UUIDModel):
                     setattr(o, k, v)
                 yield o
 
+    @classmethod
+    def get_published_terms(cls):
+        """
+        Returns (content_version, version, content_md5) of the published agreement or None.
+        Kept process-wide and dropped when the published agreement is saved here or in another process.
+        """
+        cached = not has_pending_writes(cls.__tablename__)
+        terms = cls.__published_terms__.get('published') if cached else None
+        if terms is None:
+            published = cls.get(cls.PUBLISHED_UUID, key='entity_id')
+            terms = (published.content_version, published.version, published.content_md5) if published else ()
+            if cached:
+                cls.__published_terms__.set('published', terms)
+        return terms or None
+
+    @classmethod
+    def invalidate_cache(cls, *entity_ids):
+        super().invalidate_cache(*entity_ids)
+        if cls.PUBLISHED_UUID in entity_ids:
+            cls.__published_terms__.clear()
+            # cached persons were compared with the previous terms
+            Person.clear_cache()
+
+    @classmethod
+    def clear_cache(cls):
+        super().clear_cache()
+        cls.__published_terms__.clear()
+
     @classmethod
     def get_content_version_published(cls, content_version, version=None, content_md5=None):
-        query = f"""
-                SELECT *
-                    FROM {cls.__tablename__} 
-                    WHERE content_version="{content_version}" 
-                    AND entity_id="{cls.PUBLISHED_UUID}"
-                    {f' AND version="{version}"' if version else ''}
-                    {f' AND content_md5="{content_md5}"' if content_md5 else ''}
-                ;"""
-        model = cls.fetchone_dict(query)
+        """
+        Returns a published version, current or superseded, of the agreement matching the arguments.
+        Superseded versions are looked up in the history table as well, whatever the storage setting.
+        """
+        conditions = "content_version = %s AND entity_id = %s"
+        args = (content_version, cls.PUBLISHED_UUID)
+        if version:
+            conditions += " AND version = %s"
+            args += (version,)
+        if content_md5:
+            conditions += " AND content_md5 = %s"
+            args += (content_md5,)
+        query = ' UNION ALL '.join(
+            f"(SELECT * FROM {table} WHERE {conditions} LIMIT 1)"
+            for table in (cls.__tablename__, cls.get_history_table())
+        ) + ';'
+        model = cls.fetchone_dict(query, args=args * 2)
         if model:
             o = cls()
             for k, v in model.items():
@@ -720,12 +1394,91 @@ class ClickwrapAcceptance(UUIDModel):
 
     @classmethod
     def has_user_accepted(cls, user_id, content_version, entity_version, content_md5):
+        """True if the user's latest acceptance, see UserClickwrapStatus, is of the given agreement."""
         query = f"""
                 SELECT COUNT(*) AS accepted 
-                    FROM {cls.__tablename__} 
-                    WHERE clickwrap_content_version="{content_version}" 
-                    AND user_id="{user_id}" 
-                    AND clickwrap_content_md5="{content_md5}" 
-                    AND clickwrap_version="{entity_version}";
+                    FROM {UserClickwrapStatus.__tablename__} 
+                    WHERE user_id = %s
+                    AND clickwrap_content_version = %s
+                    AND clickwrap_version = %s
+                    AND clickwrap_content_md5 = %s
                 ;"""
-        return cls.fetchone_dict(query)['accepted'] > 0
+        return cls.fetchone_dict(query, args=(user_id, content_version, entity_version, content_md5))['accepted'] > 0
+
+
+class UserClickwrapStatus:
+    """
+    The latest clickwrap agreement accepted by each user, one row per user kept up to date on accept,
+    so acceptance checks are a primary key lookup instead of a search through clickwrap_acceptance.
+    """
+    __tablename__ = 'user_clickwrap_status'
+
+    @classmethod
+    def store(cls, acceptance, connection=None, commit=True):
+        """Records `acceptance` as the user's latest with a single upsert."""
+        with ConnectionContext(connection=connection) as connection:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"INSERT INTO {cls.__tablename__} "
+                    f"(user_id, clickwrap_content_version, clickwrap_version, clickwrap_content_md5) "
+                    f"VALUES (%s, %s, %s, %s) "
+                    f"ON DUPLICATE KEY UPDATE clickwrap_content_version = VALUES(clickwrap_content_version), "
+                    f"clickwrap_version = VALUES(clickwrap_version), clickwrap_content_md5 = VALUES(clickwrap_content_md5)",
+                    (acceptance.user_id, acceptance.clickwrap_content_version, acceptance.clickwrap_version,
+                     acceptance.clickwrap_content_md5)
+                )
+                use_outbox = commit and outbox.is_enabled()
+                if use_outbox:
+                    Person._enqueue_cache_invalidation(cursor, acceptance.user_id)
+            # person lookups read the status
+            track_write(connection, Person.__tablename__)
+            invalidate_identity_map(Person.__tablename__)
+            Person.invalidate_cache(acceptance.user_id)
+
+            if commit:
+                def after_commit():
+                    Person.invalidate_cache(acceptance.user_id)
+                    if not use_outbox:
+                        Person._publish_cache_invalidation(acceptance.user_id)
+                commit_connection(connection, after_commit)
+
+    @classmethod
+    def backfill(cls, batch_size=1000, connection=None):
+        """
+        Rebuilds the status of every user from clickwrap_acceptance, `batch_size` users per transaction.
+        Returns the number of users.
+        """
+        users = 0
+        last_user_id = ''
+        with ConnectionContext(connection=connection) as connection:
+            while True:
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        f"SELECT DISTINCT user_id FROM {ClickwrapAcceptance.__tablename__} "
+                        f"WHERE user_id > %s ORDER BY user_id LIMIT %s",
+                        (last_user_id, batch_size)
+                    )
+                    user_ids = [row[0] for row in cursor.fetchall()]
+                    if not user_ids:
+                        break
+                    placeholders = ', '.join(['%s'] * len(user_ids))
+                    cursor.execute(
+                        f"""
+                        INSERT INTO {cls.__tablename__}
+                            (user_id, clickwrap_content_version, clickwrap_version, clickwrap_content_md5)
+                        SELECT a.user_id, a.clickwrap_content_version, a.clickwrap_version, a.clickwrap_content_md5
+                            FROM {ClickwrapAcceptance.__tablename__} a
+                            WHERE a.user_id IN ({placeholders}) AND a.latest = 1 AND a.active = 1
+                            AND a.timestamp = (SELECT MAX(b.timestamp) FROM {ClickwrapAcceptance.__tablename__} b
+                                               WHERE b.user_id = a.user_id AND b.latest = 1 AND b.active = 1)
+                        ON DUPLICATE KEY UPDATE clickwrap_content_version = VALUES(clickwrap_content_version),
+                            clickwrap_version = VALUES(clickwrap_version),
+                            clickwrap_content_md5 = VALUES(clickwrap_content_md5)
+                        """,
+                        user_ids
+                    )
+                commit_connection(connection)
+                users += len(user_ids)
+                last_user_id = user_ids[-1]
+        Person.clear_cache()
+        return users
@@ -0,0 +1,187 @@
+import json
+import logging
+import time
+from itertools import groupby
+
+from flask import current_app, has_app_context
+
+from app import pusher_client
+
+OUTBOX_TABLE = 'outbox'
+DEAD_LETTER_TABLE = 'outbox_dead_letter'
+# operation of rows that evict entities from the caches of the other app processes
+CACHE_INVALIDATION = 'invalidate'
+
+
+def is_enabled():
+    if not has_app_context():
+        return False
+    return str(current_app.config.get('SAVE_NOTIFICATION_OUTBOX')).lower() in ('1', 'true', 'yes')
+
+
+def enqueue(cursor, table_name, operation, entities):
+    """
+    Stores save notifications of `entities` in the outbox using `cursor`,
+    so they are committed or rolled back together with the versioned INSERT.
+    The rows are sent to RabbitMQ and Pusher by OutboxRelay.
+    """
+    sql = f"INSERT INTO {OUTBOX_TABLE} (table_name, operation, entity, api_entity) VALUES (%s, %s, %s, %s)"
+    cursor.executemany(sql, [
+        (
+            table_name,
+            operation,
+            json.dumps(entity.get_as_dict(), default=str),
+            json.dumps(entity.get_for_api(), default=str),
+        )
+        for entity in entities
+    ])
+
+
+def enqueue_cache_invalidation(cursor, table_name, entity_ids):
+    """
+    Stores the eviction of `entity_ids` of `table_name` from the caches of the other app processes,
+    published to the cache invalidation exchange by OutboxRelay once the transaction has committed.
+    """
+    cursor.execute(
+        f"INSERT INTO {OUTBOX_TABLE} (table_name, operation, entity, api_entity, pusher_sent) "
+        f"VALUES (%s, %s, %s, 'null', true)",
+        (table_name, CACHE_INVALIDATION, json.dumps(list(entity_ids)))
+    )
+
+
+class OutboxRelay:
+    """
+    Drains the outbox in batches: publishes save notifications to the 'save-notification' queue
+    and cache invalidations to the cache invalidation exchange, and triggers Pusher events in batches of 10. Sent rows are deleted, failed ones are retried
+    with exponential backoff until `max_attempts` and then moved to the dead letter table.
+    Rows are locked with SKIP LOCKED so several relays can run side by side.
+    """
+
+    def __init__(self, batch_size=100, max_attempts=10, retry_interval=5, poll_interval=1):
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_interval = retry_interval
+        self.poll_interval = poll_interval
+
+    def run(self):
+        self.purge_abandoned()
+        while True:
+            try:
+                sent = self.drain_once()
+            except Exception as ex:
+                logging.exception(f"Outbox relay failed: {ex}")
+                sent = 0
+            if sent < self.batch_size:
+                time.sleep(self.poll_interval)
+
+    def drain_once(self):
+        """
+        Sends one batch of pending rows.
+        :return: number of rows fully sent
+        """
+        from app.models import ConnectionContext
+        with ConnectionContext() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"SELECT id, table_name, operation, entity, api_entity, task_sent, pusher_sent, attempts "
+                    f"FROM {OUTBOX_TABLE} WHERE next_attempt_on <= NOW() AND attempts < %s "
+                    f"ORDER BY id LIMIT %s FOR UPDATE SKIP LOCKED",
+                    (self.max_attempts, self.batch_size)
+                )
+                desc = cursor.description
+                rows = [dict(zip([col[0] for col in desc], row)) for row in cursor.fetchall()]
+                if not rows:
+                    connection.commit()
+                    return 0
+
+                errors = {}
+                self._send_tasks([row for row in rows if not row['task_sent']], errors)
+                self._trigger_pusher([row for row in rows if not row['pusher_sent']], errors)
+
+                sent = [row['id'] for row in rows if row['task_sent'] and row['pusher_sent']]
+                if sent:
+                    cursor.execute(f"DELETE FROM {OUTBOX_TABLE} WHERE id IN %s", (tuple(sent),))
+                for row in rows:
+                    if row['id'] in errors:
+                        cursor.execute(
+                            f"UPDATE {OUTBOX_TABLE} SET task_sent = %s, pusher_sent = %s, attempts = attempts + 1, "
+                            f"last_error = %s, next_attempt_on = NOW() + INTERVAL %s SECOND WHERE id = %s",
+                            (row['task_sent'], row['pusher_sent'], errors[row['id']],
+                             self.retry_interval * 2 ** row['attempts'], row['id'])
+                        )
+                abandoned = [row['id'] for row in rows
+                             if row['id'] in errors and row['attempts'] + 1 >= self.max_attempts]
+                if abandoned:
+                    self._move_to_dead_letter(cursor, "id IN %s", (tuple(abandoned),))
+                    for row_id in abandoned:
+                        logging.error(f"Outbox row {row_id} was not sent after {self.max_attempts} attempts, "
+                                      f"moved to {DEAD_LETTER_TABLE}: {errors[row_id]}")
+            connection.commit()
+            return len(sent)
+
+    def purge_abandoned(self):
+        """
+        Moves rows left with `max_attempts` or more attempts, e.g. after lowering it, to the dead letter table.
+        :return: number of rows moved
+        """
+        from app.models import ConnectionContext
+        with ConnectionContext() as connection:
+            with connection.cursor() as cursor:
+                moved = self._move_to_dead_letter(cursor, "attempts >= %s", (self.max_attempts,))
+            connection.commit()
+        if moved:
+            logging.error(f"Moved {moved} outbox rows with {self.max_attempts} or more attempts to {DEAD_LETTER_TABLE}")
+        return moved
+
+    @staticmethod
+    def _move_to_dead_letter(cursor, condition, args):
+        cursor.execute(f"INSERT INTO {DEAD_LETTER_TABLE} SELECT * FROM {OUTBOX_TABLE} WHERE {condition}", args)
+        return cursor.execute(f"DELETE FROM {OUTBOX_TABLE} WHERE {condition}", args)
+
+    @staticmethod
+    def _send_tasks(rows, errors):
+        """
+        Sends one task per (table, operation) group and one message per cache invalidation,
+        all of the batch in one publish batch.
+        """
+        from app.tasks import build_task, build_cache_invalidation, send_tasks
+        tasks = [
+            build_cache_invalidation(row['table_name'], json.loads(row['entity']))
+            for row in rows if row['operation'] == CACHE_INVALIDATION
+        ]
+        saves = [row for row in rows if row['operation'] != CACHE_INVALIDATION]
+        for (table_name, operation), group in groupby(saves, key=lambda row: (row['table_name'], row['operation'])):
+            group = list(group)
+            if len(group) == 1:
+                task = build_task('save-notification', 'handle_object_save', json.loads(group[0]['entity']),
+                                  args=[table_name, operation])
+            else:
+                task = build_task('save-notification', 'handle_objects_save',
+                                  {'objects': [json.loads(row['entity']) for row in group]},
+                                  args=[table_name, operation])
+            tasks.append(task)
+        try:
+            send_tasks(tasks)
+        except Exception as ex:
+            for row in rows:
+                errors[row['id']] = f"task: {ex}"
+            return
+        for row in rows:
+            row['task_sent'] = True
+
+    @staticmethod
+    def _trigger_pusher(rows, errors):
+        # Pusher accepts up to 10 events per batch call
+        for i in range(0, len(rows), 10):
+            group = rows[i:i + 10]
+            try:
+                pusher_client.trigger_batch([
+                    {'channel': row['table_name'], 'name': row['operation'], 'data': json.loads(row['api_entity'])}
+                    for row in group
+                ])
+            except Exception as ex:
+                for row in group:
+                    errors[row['id']] = f"pusher: {ex}"
+                continue
+            for row in group:
+                row['pusher_sent'] = True
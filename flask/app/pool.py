@@ -0,0 +1,262 @@
+import logging
+import threading
+import time
+from collections import deque
+
+import pymysql
+from pymysql.constants import SERVER_STATUS
+
+
+class PoolTimeout(Exception):
+    def __init__(self, message, *errors):
+        Exception.__init__(self, message)
+        self.message = message
+        self.errors = errors
+
+
+class _PooledConnection:
+    __slots__ = ('connection', 'created_at', 'generation')
+
+    def __init__(self, connection, generation):
+        self.connection = connection
+        self.created_at = time.monotonic()
+        self.generation = generation
+
+
+class ConnectionPool:
+    """
+    Bounded, thread-safe pool of PyMySQL connections.
+    Connections are reused LIFO so the warmest one is handed out first, pinged before reuse
+    and closed once they are older than `recycle` seconds.
+    """
+
+    def __init__(self, app=None, **options):
+        self._cond = threading.Condition()
+        self._idle = deque()
+        self._checked_out = {}
+        self._opening = 0
+        self._generation = 0
+        self._filled = False
+
+        self.connect_kwargs = {}
+        self.min_size = 1
+        self.max_size = 10
+        self.timeout = 30.0
+        self.recycle = 3600
+        self.pre_ping = True
+        self._connect = pymysql.connect
+        self._reset_stats()
+
+        if app is not None:
+            self.init_app(app, **options)
+
+    def init_app(self, app, **options):
+        """Configures the pool from the application config."""
+        sd = options.setdefault
+        conf = app.config
+
+        sd('connect_kwargs', conf.get('pymysql_kwargs') or {})
+        sd('min_size', int(conf.get('MYSQL_POOL_MIN_SIZE', self.min_size)))
+        sd('max_size', int(conf.get('MYSQL_POOL_MAX_SIZE', self.max_size)))
+        sd('timeout', float(conf.get('MYSQL_POOL_TIMEOUT', self.timeout)))
+        sd('recycle', int(conf.get('MYSQL_POOL_RECYCLE', self.recycle)))
+        sd('pre_ping', str(conf.get('MYSQL_POOL_PRE_PING', self.pre_ping)).lower() in ('1', 'true', 'yes'))
+        self.configure(**options)
+
+        if not hasattr(app, 'extensions'):
+            app.extensions = {}
+        app.extensions['mysql_pool'] = self
+
+    def configure(self, connect_kwargs=None, min_size=1, max_size=10, timeout=30.0, recycle=3600, pre_ping=True,
+                  connect=None):
+        """
+        (Re)configures the pool. Idle connections opened with the previous settings are closed,
+        checked out ones are closed when they are released.
+        """
+        if max_size < 1:
+            raise ValueError('max_size should be at least 1')
+        if not 0 <= min_size <= max_size:
+            raise ValueError('min_size should be between 0 and max_size')
+        with self._cond:
+            self.connect_kwargs = dict(connect_kwargs or {})
+            self.min_size = min_size
+            self.max_size = max_size
+            self.timeout = timeout
+            self.recycle = recycle
+            self.pre_ping = pre_ping
+            self._connect = connect or pymysql.connect
+            self._generation += 1
+            self._filled = False
+            stale, self._idle = list(self._idle), deque()
+            self._cond.notify_all()
+        for item in stale:
+            self._close(item)
+
+    @property
+    def size(self):
+        return len(self._idle) + len(self._checked_out) + self._opening
+
+    def acquire(self, timeout=None):
+        """
+        Checks a connection out of the pool.
+        Waits up to `timeout` seconds (pool default if None) for one to be released
+        when the pool is at `max_size`, then raises PoolTimeout.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        with self._cond:
+            while True:
+                if self._idle:
+                    item = self._idle.pop()
+                    break
+                if self.size < self.max_size:
+                    item = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout(f'Could not get a MySQL connection within {timeout} seconds')
+                self._cond.wait(remaining)
+            self._opening += 1
+            waited = time.monotonic() - started
+            self._checkouts += 1
+            self._wait_time_total += waited
+            self._wait_time_max = max(self._wait_time_max, waited)
+            fill = not self._filled
+            self._filled = True
+
+        try:
+            item = self._prepare(item)
+        except BaseException:
+            with self._cond:
+                self._opening -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._opening -= 1
+            self._checked_out[id(item.connection)] = item
+        if fill:
+            self.fill()
+        return item.connection
+
+    def release(self, connection, discard=False):
+        """
+        Returns a connection to the pool. An open transaction is rolled back,
+        broken, expired or `discard`ed connections are closed instead of reused.
+        """
+        with self._cond:
+            item = self._checked_out.pop(id(connection), None)
+        if item is None:
+            self._close_connection(connection)
+            return
+
+        if not discard:
+            discard = self._is_expired(item) or item.generation != self._generation or not connection.open
+        if not discard and connection.server_status & SERVER_STATUS.SERVER_STATUS_IN_TRANS:
+            try:
+                connection.rollback()
+            except pymysql.MySQLError:
+                discard = True
+
+        with self._cond:
+            if not discard:
+                self._idle.append(item)
+            self._cond.notify()
+            if discard:
+                self._discarded += 1
+        if discard:
+            self._close(item)
+
+    def fill(self):
+        """Opens connections until at least `min_size` are held by the pool."""
+        while True:
+            with self._cond:
+                if self.size >= self.min_size:
+                    return
+                self._opening += 1
+                generation = self._generation
+            try:
+                item = self._open(generation)
+            except pymysql.MySQLError as ex:
+                logging.warning(f"Could not pre-open MySQL connection: {ex}")
+                with self._cond:
+                    self._opening -= 1
+                return
+            with self._cond:
+                self._opening -= 1
+                self._idle.appendleft(item)
+                self._cond.notify()
+
+    def dispose(self):
+        """Closes all idle connections."""
+        with self._cond:
+            stale, self._idle = list(self._idle), deque()
+            self._filled = False
+        for item in stale:
+            self._close(item)
+
+    def stats(self):
+        with self._cond:
+            checkouts = self._checkouts
+            return {
+                'size': self.size,
+                'in_use': len(self._checked_out) + self._opening,
+                'idle': len(self._idle),
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'checkouts': checkouts,
+                'connects': self._connects,
+                'recycled': self._recycled,
+                'discarded': self._discarded,
+                'timeouts': self._timeouts,
+                'wait_time_total': self._wait_time_total,
+                'wait_time_max': self._wait_time_max,
+                'wait_time_avg': self._wait_time_total / checkouts if checkouts else 0.0,
+            }
+
+    def _reset_stats(self):
+        self._checkouts = 0
+        self._connects = 0
+        self._recycled = 0
+        self._discarded = 0
+        self._timeouts = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+
+    def _prepare(self, item):
+        if item is not None and self._is_expired(item):
+            with self._cond:
+                self._recycled += 1
+            self._close(item)
+            item = None
+        if item is not None and self.pre_ping:
+            try:
+                item.connection.ping(reconnect=False)
+            except pymysql.MySQLError:
+                with self._cond:
+                    self._discarded += 1
+                self._close(item)
+                item = None
+        if item is None:
+            item = self._open(self._generation)
+        return item
+
+    def _open(self, generation):
+        connection = self._connect(**self.connect_kwargs)
+        with self._cond:
+            self._connects += 1
+        return _PooledConnection(connection, generation)
+
+    def _is_expired(self, item):
+        return bool(self.recycle) and time.monotonic() - item.created_at > self.recycle
+
+    def _close(self, item):
+        self._close_connection(item.connection)
+
+    @staticmethod
+    def _close_connection(connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
@@ -1,3 +1,9 @@
+import atexit
+import logging
+import threading
+import time
+from collections import OrderedDict
+
 from pusher import Pusher as BasePusher
 
 
@@ -32,3 +38,161 @@ class Pusher(BasePusher):
         if not hasattr(app, 'extensions'):
             app.extensions = {}
         app.extensions['pusher'] = self
+
+
+class PusherDispatcher:
+    """
+    Sends Pusher events from a background thread so that web threads never wait for Pusher.
+    Queued events of the same channel, name and entity are coalesced into the latest one.
+    Pending events are flushed with `trigger_batch`, grouped per channel in batches of up to 10,
+    as soon as `flush_size` events are pending or the oldest one waited `flush_interval` seconds.
+    When `max_queue` events are pending new ones are dropped.
+    """
+
+    # Pusher accepts up to 10 events per batch call
+    BATCH_SIZE = 10
+
+    def __init__(self, client, app=None, **options):
+        self.client = client
+        self.flush_size = self.BATCH_SIZE
+        self.flush_interval = 0.05
+        self.max_queue = 10000
+        self._cond = threading.Condition()
+        self._pending = OrderedDict()
+        self._oldest = None
+        self._sequence = 0
+        self._thread = None
+        self.dispatched = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.sent = 0
+        self.failed = 0
+        self.flushes = 0
+        self.flush_time_total = 0.0
+        self.flush_time_max = 0.0
+        self.event_delay_max = 0.0
+        # send what is still queued when the process exits
+        atexit.register(self.flush)
+        if app is not None:
+            self.init_app(app, **options)
+
+    def init_app(self, app, **options):
+        sd = options.setdefault
+        conf = app.config
+
+        sd('flush_size', conf.get('PUSHER_DISPATCHER_FLUSH_SIZE', self.BATCH_SIZE))
+        sd('flush_interval', conf.get('PUSHER_DISPATCHER_FLUSH_INTERVAL', 0.05))
+        sd('max_queue', conf.get('PUSHER_DISPATCHER_MAX_QUEUE', 10000))
+
+        self.flush_size = int(options['flush_size'])
+        self.flush_interval = float(options['flush_interval'])
+        self.max_queue = int(options['max_queue'])
+
+        if not hasattr(app, 'extensions'):
+            app.extensions = {}
+        app.extensions['pusher_dispatcher'] = self
+
+    def dispatch(self, channel, event_name, data):
+        """Queues an event, never blocks."""
+        entity_id = data.get('entity_id') if isinstance(data, dict) else None
+        with self._cond:
+            if entity_id is not None:
+                key = (channel, event_name, entity_id)
+            else:
+                self._sequence += 1
+                key = (channel, event_name, None, self._sequence)
+            if key in self._pending:
+                self.coalesced += 1
+            elif len(self._pending) >= self.max_queue:
+                self.dropped += 1
+                return False
+            self._pending[key] = {'channel': channel, 'name': event_name, 'data': data}
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            self.dispatched += 1
+            self._ensure_thread()
+            self._cond.notify()
+        return True
+
+    def dispatch_batch(self, events):
+        for event in events:
+            self.dispatch(event['channel'], event['name'], event['data'])
+
+    def flush(self):
+        """Sends every pending event from the calling thread."""
+        with self._cond:
+            events, oldest = self._take()
+        self._send(events, oldest)
+
+    @property
+    def queue_depth(self):
+        return len(self._pending)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'queue_depth': len(self._pending),
+                'dispatched': self.dispatched,
+                'coalesced': self.coalesced,
+                'dropped': self.dropped,
+                'sent': self.sent,
+                'failed': self.failed,
+                'flushes': self.flushes,
+                'flush_latency_avg': self.flush_time_total / self.flushes if self.flushes else 0.0,
+                'flush_latency_max': self.flush_time_max,
+                'event_delay_max': self.event_delay_max,
+            }
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='pusher-dispatcher', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._is_due():
+                    self._cond.wait(self._wait_time())
+                events, oldest = self._take()
+            self._send(events, oldest)
+
+    def _is_due(self):
+        if not self._pending:
+            return False
+        return len(self._pending) >= self.flush_size or time.monotonic() - self._oldest >= self.flush_interval
+
+    def _wait_time(self):
+        if not self._pending:
+            return None
+        return max(self._oldest + self.flush_interval - time.monotonic(), 0)
+
+    def _take(self):
+        events = list(self._pending.values())
+        oldest = self._oldest
+        self._pending = OrderedDict()
+        self._oldest = None
+        return events, oldest
+
+    def _send(self, events, oldest):
+        if not events:
+            return
+        started_at = time.monotonic()
+        # stable sort keeps the order of the events within a channel
+        events.sort(key=lambda event: event['channel'])
+        sent = failed = 0
+        for i in range(0, len(events), self.BATCH_SIZE):
+            batch = events[i:i + self.BATCH_SIZE]
+            try:
+                self.client.trigger_batch(batch)
+                sent += len(batch)
+            except Exception as ex:
+                failed += len(batch)
+                logging.error(f"Failed to trigger {len(batch)} Pusher events: {ex}")
+        finished_at = time.monotonic()
+        with self._cond:
+            self.sent += sent
+            self.failed += failed
+            self.flushes += 1
+            self.flush_time_total += finished_at - started_at
+            self.flush_time_max = max(self.flush_time_max, finished_at - started_at)
+            self.event_delay_max = max(self.event_delay_max, finished_at - oldest)
@@ -1,9 +1,13 @@
 import json
 import hashlib
 
-from app.models import Person, LoginMethod, OtpMethod, VersionedModel, RecoveryCode, ClickwrapAcceptance, ClickwrapAgreement
+from app.models import Person, LoginMethod, OtpMethod, VersionedModel, RecoveryCode, ClickwrapAcceptance, ClickwrapAgreement, Session, \
+    UserClickwrapStatus
+from app.hashing import password_hasher, hash_password
+from app.singleflight import single_flight
 from app.tasks import send_task, send_message
 from app.tokens import generate_confirmation_token, generate_recovery_codes
+from app.transaction import Transaction
 from app.utils import urlsafe_base64_encode, force_bytes
 from flask import current_app
 from flask_login import login_user
@@ -24,20 +28,28 @@ class Repository:
     """
 
     def __init__(self):
-        pass
+        self.transaction = None
 
     def __enter__(self):
+        # every model call inside the block shares one connection and one transaction,
+        # a repository opened inside another one joins the outer transaction
+        self.transaction = Transaction().__enter__()
         return self
 
     def __exit__(self, type_, value, traceback):
-        # can test for type and handle different situations
-        self.close()
+        # commit on clean exit, roll back on exception
+        try:
+            self.transaction.__exit__(type_, value, traceback)
+        finally:
+            self.close()
 
     def complete(self):
-        pass
+        """Commits the work done so far and sends the deferred save notifications"""
+        if self.transaction:
+            self.transaction.commit()
 
     def close(self):
-        pass
+        self.transaction = None
 
     @staticmethod
     def get_by_id(uuid: str) -> VersionedModel:
@@ -68,6 +80,22 @@ class Repository:
         return o.get_for_api()
 
 
+class LoginContext:
+    """What the login views need to know about a person, see PersonRepository.get_login_context"""
+
+    def __init__(self, person: Person, otp_method: OtpMethod = None):
+        self.person = person
+        self.otp_method = otp_method
+
+    @property
+    def mfa_enabled(self):
+        return bool(self.otp_method and self.otp_method.enabled)
+
+    @property
+    def latest_clickwrap_accepted(self):
+        return bool(self.person.latest_clickwrap_accepted)
+
+
 class PersonRepository(Repository):
     """
     Person Repository class.
@@ -91,6 +119,10 @@ class PersonRepository(Repository):
         raise RepositoryException(message='Person should have entity_id')
 
     @staticmethod
+    @single_flight(flight=Person.__single_flight__, tables=(Person.__tablename__,),
+                   key=lambda uuid, **kwargs: ('get_by_id', uuid, tuple(sorted(kwargs.items()))),
+                   on_share=lambda person, uuid, **kwargs: Person.adopt(
+                       person, uuid, variant=kwargs.get('with_clickwrap_acceptance', False)))
     def get_by_id(uuid: str, **kwargs) -> Person:
         """Method accepts entity_id and returns Person object"""
         return Person().get(uuid, key='entity_id', **kwargs)
@@ -100,6 +132,17 @@ class PersonRepository(Repository):
         """Method accepts email and returns Person object"""
         return Person().get(email, key='email', **kwargs)
 
+    @staticmethod
+    def get_login_context(email: str) -> LoginContext:
+        """
+        Returns the person with `email`, its MFA enabled and latest clickwrap accepted flags
+        loaded with a single query, or None if there is no such person.
+        """
+        person, otp_method = Person.get_login_context(email)
+        if person is None:
+            return None
+        return LoginContext(person, otp_method)
+
     @staticmethod
     def get_login_method(person: Person, login_method: LoginMethod):
         """
@@ -148,12 +191,25 @@ class PersonRepository(Repository):
         :return: dict
         """
         person.create_token()
-        person.save()
+        if person.entity_id and person.version:
+            Session.store(person)
+        else:
+            person.save()
         login_user(person)
         data = person.get_for_api()
         data.update({'mfa_enabled': self.is_otp_method_enabled(person)})
         return data
 
+    @staticmethod
+    def rehash_password_if_needed(person: Person, raw_password: str):
+        """
+        Stores a new hash of the already verified `raw_password` if the stored one
+        was made with other hashing parameters.
+        """
+        if password_hasher.needs_rehash(person.password):
+            person.password = hash_password(raw_password)
+            person.save()
+
     @staticmethod
     def remove_login_method(person: Person, entity_id: str):
         """
@@ -231,17 +287,14 @@ class OtpMethodRepository(Repository):
         return list({code.get('token') for code in data})
 
     def create_recovery_codes(self, otp_method: OtpMethod):
-        all_tokens = []
         self.delete_recovery_codes(otp_method)
-        for code in generate_recovery_codes(RecoveryCode().__number_of_tokens__):
-            RecoveryCode(otp_method_id=otp_method.entity_id, token=code).save()
-            all_tokens.append(code)
+        all_tokens = list(generate_recovery_codes(RecoveryCode.__number_of_tokens__))
+        RecoveryCode.save_many(RecoveryCode(otp_method_id=otp_method.entity_id, token=code) for code in all_tokens)
         return all_tokens
 
     @staticmethod
     def delete_recovery_codes(otp_method: OtpMethod):
-        for code in RecoveryCode().get_all('*', condition=f"otp_method_id = '{str(otp_method.entity_id)}'"):
-            RecoveryCode().get(code.get('entity_id'), key='entity_id').delete()
+        RecoveryCode.delete_for_otp_method(otp_method.entity_id)
 
     @staticmethod
     def verify_recovery_code(code, otp_method: OtpMethod):
@@ -257,12 +310,20 @@ class ClickwrapRepository(Repository):
     def get_by_id(uuid: str) -> ClickwrapAgreement:
         return ClickwrapAgreement.get(uuid, key='entity_id')
 
+    @single_flight(flight=ClickwrapAgreement.__single_flight__, tables=(ClickwrapAgreement.__tablename__,),
+                   key=lambda self: 'draft',
+                   on_share=lambda clickwrap, self: ClickwrapAgreement.adopt(
+                       clickwrap, ClickwrapAgreement.DRAFT_UUID))
     def get_draft(self):
         return ClickwrapAgreement.get(ClickwrapAgreement.DRAFT_UUID, 'entity_id')
 
     def get_or_create_draft(self):
         return self.get_draft() or ClickwrapAgreement(entity_id=ClickwrapAgreement.DRAFT_UUID)
 
+    @single_flight(flight=ClickwrapAgreement.__single_flight__, tables=(ClickwrapAgreement.__tablename__,),
+                   key=lambda self: 'published',
+                   on_share=lambda clickwrap, self: ClickwrapAgreement.adopt(
+                       clickwrap, ClickwrapAgreement.PUBLISHED_UUID))
     def get_published(self):
         return ClickwrapAgreement.get(ClickwrapAgreement.PUBLISHED_UUID, 'entity_id')
 
@@ -302,6 +363,7 @@ class ClickwrapRepository(Repository):
 
     def accept_clickwrap(self, acceptance: ClickwrapAcceptance):
         acceptance = acceptance.save()
+        UserClickwrapStatus.store(acceptance)
         return acceptance
 
     def has_user_accepted(self, acceptance: ClickwrapAcceptance):
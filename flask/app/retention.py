@@ -0,0 +1,123 @@
+import logging
+import time
+
+# days superseded versions are kept per table; clickwrap and clickwrap_acceptance are records of what users
+# agreed to and are never pruned
+DEFAULT_RETENTION = {
+    'person': 90,
+    'login_method': 90,
+    'otp_method': 90,
+    'recovery_code': 30,
+}
+NEVER_PRUNED = ('clickwrap', 'clickwrap_acceptance')
+
+
+def parse_retention(value):
+    """
+    Parses `person=90,recovery_code=30` into {'person': 90, 'recovery_code': 30}.
+    Raises ValueError for the tables in NEVER_PRUNED.
+    """
+    if not value:
+        return dict(DEFAULT_RETENTION)
+    if isinstance(value, dict):
+        retention = {table: int(days) for table, days in value.items()}
+    else:
+        retention = {}
+        for item in str(value).split(','):
+            if item.strip():
+                table, days = item.split('=', 1)
+                retention[table.strip()] = int(days)
+    never_pruned = sorted(set(retention) & set(NEVER_PRUNED))
+    if never_pruned:
+        raise ValueError(f"{', '.join(never_pruned)} must not be pruned")
+    return retention
+
+
+class VersionPruner:
+    """
+    Removes superseded versions (latest = 0) of versioned tables once they are older than the table's retention,
+    measured from `changed_on`, i.e. from when they were superseded. Current versions are never touched.
+    With `archive` the versions are moved to `<table>_history` instead of deleted. With the history storage
+    the superseded versions already live in `<table>_history` and are deleted from there.
+
+    Tables are walked in primary key order `batch_size` rows at a time. Every batch is its own short
+    transaction and is followed by `sleep` seconds so that locks are held briefly and replicas keep up.
+    """
+
+    def __init__(self, retention=None, batch_size=1000, sleep=0.1, archive=False, storage='single',
+                 dry_run=False):
+        self.retention = parse_retention(retention)
+        self.batch_size = batch_size
+        self.sleep = sleep
+        self.archive = archive and storage != 'history'
+        self.storage = storage
+        self.dry_run = dry_run
+
+    def run(self, tables=None):
+        """
+        Prunes `tables`, all tables with a retention by default.
+        :return: list of per table reports, see prune_table
+        """
+        reports = []
+        for table in tables or self.retention:
+            if table not in self.retention:
+                raise ValueError(f'No retention configured for {table}')
+            reports.append(self.prune_table(table, self.retention[table]))
+        return reports
+
+    def prune_table(self, table, days):
+        """
+        :return: dict with the table, rows scanned, rows reclaimed and seconds taken
+        """
+        from app.models import ConnectionContext
+        source = f'{table}_history' if self.storage == 'history' else table
+        started_at = time.perf_counter()
+        scanned = reclaimed = 0
+        last_key = None
+        with ConnectionContext() as connection:
+            while True:
+                with connection.cursor() as cursor:
+                    keys = self._expired_keys(cursor, source, days, last_key)
+                    if keys is None:
+                        break
+                    last_key, batch_scanned, expired = keys
+                    scanned += batch_scanned
+                    if expired and not self.dry_run:
+                        reclaimed += self._remove(cursor, source, table, expired)
+                    elif expired:
+                        reclaimed += len(expired)
+                connection.commit()
+                if expired and self.sleep:
+                    time.sleep(self.sleep)
+        report = {
+            'table': source,
+            'scanned': scanned,
+            'reclaimed': reclaimed,
+            'seconds': time.perf_counter() - started_at,
+        }
+        logging.info(f"Pruned {report['reclaimed']} of {report['scanned']} rows of {source} "
+                     f"in {report['seconds']:.1f}s")
+        return report
+
+    def _expired_keys(self, cursor, source, days, last_key):
+        """
+        Reads the next batch of primary keys after `last_key` with a non-locking read.
+        :return: (last key read, rows read, keys of expired superseded versions) or None at the end of the table
+        """
+        after = "WHERE entity_id > %s OR (entity_id = %s AND version > %s)" if last_key else ""
+        args = (last_key[0], last_key[0], last_key[1]) if last_key else ()
+        cursor.execute(
+            f"SELECT entity_id, version, latest = 0 AND changed_on < NOW() - INTERVAL %s DAY "
+            f"FROM {source} {after} ORDER BY entity_id, version LIMIT %s",
+            (days,) + args + (self.batch_size,)
+        )
+        rows = cursor.fetchall()
+        if not rows:
+            return None
+        return rows[-1][:2], len(rows), [(entity_id, version) for entity_id, version, expired in rows if expired]
+
+    def _remove(self, cursor, source, table, keys):
+        condition = "(entity_id, version) IN %s AND latest = 0"
+        if self.archive:
+            cursor.execute(f"INSERT INTO {table}_history SELECT * FROM {source} WHERE {condition}", (tuple(keys),))
+        return cursor.execute(f"DELETE FROM {source} WHERE {condition}", (tuple(keys),))
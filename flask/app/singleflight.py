@@ -0,0 +1,99 @@
+import copy
+import functools
+import threading
+
+from app.transaction import has_pending_writes
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls within the process: the first caller of a key runs the function,
+    callers arriving while it runs wait for it and get the same result or exception.
+    Nothing is kept once the call completes, the next caller runs the function again.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.calls = 0
+        self.shared = 0
+
+    def do(self, key, func, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.calls += 1
+            else:
+                self.shared += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = func(*args, **kwargs)
+        except BaseException as ex:
+            call.error = ex
+            raise
+        finally:
+            with self._lock:
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def forget(self):
+        """Makes callers arriving from now on start new calls, e.g. after a write the running calls may not see."""
+        with self._lock:
+            self._calls = {}
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._calls),
+                'calls': self.calls,
+                'shared': self.shared,
+            }
+
+
+def single_flight(flight=None, tables=(), key=None, on_share=None):
+    """
+    Decorates a function, e.g. a repository method, so that concurrent calls with the same key share one call.
+    `key` builds the key from the arguments, by default all of them; methods pass e.g. `lambda self, *args: args`.
+    Callers waiting on another call get a deep copy of its result so they share no state with it,
+    passed through `on_share(result, *args, **kwargs)` when set, e.g. to register it in their identity map.
+    Calls made in a transaction with uncommitted writes to one of `tables` are not shared.
+    """
+    flight = flight or SingleFlight()
+    key = key or (lambda *args, **kwargs: (args, tuple(sorted(kwargs.items()))))
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if any(has_pending_writes(table) for table in tables):
+                return func(*args, **kwargs)
+            leader = []
+
+            def call():
+                leader.append(True)
+                return func(*args, **kwargs)
+
+            result = flight.do(key(*args, **kwargs), call)
+            if leader:
+                return result
+            result = copy.deepcopy(result)
+            return on_share(result, *args, **kwargs) if on_share else result
+
+        wrapper.flight = flight
+        return wrapper
+
+    return decorator
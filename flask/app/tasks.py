@@ -1,4 +1,6 @@
 import json
+import logging
+import threading
 import pika
 import uuid
 
@@ -28,9 +30,29 @@ def send_verification_email(person):
     send_task('email', 'send_email', data)
 
 
-def send_task(queue_name, task_name, message, args=[], exchange_name=None, routing_key=None, exchange_type='direct'):
+CACHE_INVALIDATION_EXCHANGE = 'cache-invalidation'
+# identifies this process in invalidation messages so it can skip its own
+PROCESS_ID = uuid.uuid4().hex
+
+_cache_invalidation_subscriber = None
+
+
+def get_connection_parameters(config=None):
+    config = config or current_app.config
+    return pika.ConnectionParameters(
+        host=config['BROKER_PATH'].split(':')[0],
+        port=config['BROKER_PATH'].split(':')[1],
+        virtual_host=config['RABBITMQ_VHOST'],
+        credentials=pika.credentials.PlainCredentials(
+            username=config['RABBITMQ_USER'],
+            password=config['RABBITMQ_PASSWORD']
+        )
+    )
+
+
+def build_task(queue_name, task_name, message, args=[], exchange_name=None, routing_key=None, exchange_type='direct'):
     """
-    Send task to Celery using the following parameters. You can get parameters from Celery logs:
+    Builds a task for Celery using the following parameters. You can get parameters from Celery logs:
      [queues]
     .> email            exchange=email(direct) key=email
     [tasks]
@@ -43,7 +65,7 @@ def send_task(queue_name, task_name, message, args=[], exchange_name=None, routi
     :param exchange_name: Celery exchange name, defaults to queue_name if not specified
     :param routing_key: The routing key which routes message to a queue from exchange, defaults to queue_name if not specified
     :param exchange_type: Type of exchange. (direct, etc.)
-    :return:
+    :return: `Publisher.publish` kwargs of the task message
     """
 
     if not exchange_name:
@@ -51,18 +73,6 @@ def send_task(queue_name, task_name, message, args=[], exchange_name=None, routi
     if not routing_key:
         routing_key = queue_name
 
-    parameters = pika.ConnectionParameters(
-        host=current_app.config['BROKER_PATH'].split(':')[0],
-        port=current_app.config['BROKER_PATH'].split(':')[1],
-        virtual_host=current_app.config['RABBITMQ_VHOST'],
-        credentials=pika.credentials.PlainCredentials(
-            username=current_app.config['RABBITMQ_USER'],
-            password=current_app.config['RABBITMQ_PASSWORD']
-        )
-    )
-    connection = pika.BlockingConnection(parameters=parameters)
-    channel = connection.channel()
-    channel.exchange_declare(exchange=exchange_name, exchange_type=exchange_type, durable=True)
     message = {
         'task': task_name,
         'id': uuid.uuid4().hex,
@@ -78,33 +88,298 @@ def send_task(queue_name, task_name, message, args=[], exchange_name=None, routi
         content_type="application/json",
         content_encoding='utf-8'
     )
-    channel.basic_publish(
+    return dict(
         exchange=exchange_name,
         routing_key=routing_key,
         body=json.dumps(message).encode(),
-        properties=properties)
-    connection.close()
+        properties=properties,
+        exchange_type=exchange_type)
+
+
+def send_task(queue_name, task_name, message, args=[], exchange_name=None, routing_key=None, exchange_type='direct'):
+    """Send task to Celery, see build_task for the parameters."""
+    get_publisher().publish(**build_task(queue_name, task_name, message, args=args, exchange_name=exchange_name,
+                                         routing_key=routing_key, exchange_type=exchange_type))
+
+
+def send_tasks(tasks):
+    """
+    Sends several tasks built with build_task in one batch, on one channel checkout.
+    """
+    if tasks:
+        get_publisher().publish_batch(tasks)
 
 
 def send_message(queue_name, data):
-    parameters = pika.ConnectionParameters(
-        host=current_app.config['BROKER_PATH'].split(':')[0],
-        port=current_app.config['BROKER_PATH'].split(':')[1],
-        virtual_host=current_app.config['RABBITMQ_VHOST'],
-        credentials=pika.credentials.PlainCredentials(
-            username=current_app.config['RABBITMQ_USER'],
-            password=current_app.config['RABBITMQ_PASSWORD']
-        )
-    )
-    connection = pika.BlockingConnection(parameters=parameters)
-    channel = connection.channel()
-    channel.queue_declare(queue=queue_name, durable=True)
-    channel.basic_publish(
+    get_publisher().publish(
         exchange="",
         routing_key=queue_name,
         body=json.dumps(data),
         properties=pika.BasicProperties(
             delivery_mode=2,  # make message persistent
         ),
+        queue=queue_name,
     )
     print(" [x] Sent message")
+
+
+def build_cache_invalidation(table_name, entity_ids):
+    """Returns the `Publisher.publish` kwargs of the invalidation of `entity_ids` of `table_name`."""
+    return dict(
+        exchange=CACHE_INVALIDATION_EXCHANGE,
+        routing_key='',
+        body=json.dumps({'origin': PROCESS_ID, 'table': table_name, 'entity_ids': list(entity_ids)}),
+        exchange_type='fanout',
+    )
+
+
+def publish_cache_invalidation(table_name, entity_ids):
+    """
+    Tells the other app processes to evict `entity_ids` of `table_name` from their local caches.
+    """
+    get_publisher().publish(**build_cache_invalidation(table_name, entity_ids))
+
+
+class PublisherTimeout(Exception):
+    def __init__(self, message, *errors):
+        Exception.__init__(self, message)
+        self.errors = errors
+
+
+class _Channel:
+    """One broker connection with one channel, used by a single thread at a time."""
+
+    def __init__(self, parameters, confirm_mode, connect):
+        self.connection = connect(parameters)
+        self.channel = self.connection.channel()
+        if confirm_mode == 'message':
+            self.channel.confirm_delivery()
+        # exchanges and queues declared on this connection
+        self.declared = set()
+
+    @property
+    def is_open(self):
+        return self.connection.is_open and self.channel.is_open
+
+    def close(self):
+        try:
+            if self.connection.is_open:
+                self.connection.close()
+        except Exception as ex:
+            logging.warning(f"Failed to close RabbitMQ connection: {ex}")
+
+
+class Publisher:
+    """
+    Long-lived, thread-safe RabbitMQ publisher shared by the whole process.
+    Keeps a pool of up to `max_channels` open channels; pika's BlockingConnection is not thread-safe,
+    so every pooled channel has its own connection and is checked out by one thread at a time.
+    Exchange and queue declarations are made once per connection.
+
+    `confirm_mode`:
+     - 'message': publisher confirms, every publish waits for the broker ack
+     - 'off': fire and forget
+    pika's BlockingChannel waits for the ack of every confirmed message, there is no wait per batch.
+
+    A publish that fails because the connection or channel was closed is retried once on a new connection.
+    """
+
+    CONFIRM_MODES = ('message', 'off')
+
+    def __init__(self, parameters, max_channels=4, confirm_mode='message', timeout=10, connect=None):
+        if confirm_mode not in self.CONFIRM_MODES:
+            raise ValueError(f'confirm_mode should be one of {self.CONFIRM_MODES}')
+        self.parameters = parameters
+        self.max_channels = max_channels
+        self.confirm_mode = confirm_mode
+        self.timeout = timeout
+        self._connect = connect or (lambda parameters: pika.BlockingConnection(parameters=parameters))
+        self._cond = threading.Condition()
+        self._idle = []
+        self._size = 0
+        self.published = 0
+        self.connects = 0
+        self.reconnects = 0
+
+    def publish(self, exchange, routing_key, body, properties=None, exchange_type=None, queue=None):
+        """
+        Publishes one message.
+        :param exchange_type: declares `exchange` (durable) with this type when set
+        :param queue: declares this durable queue when set
+        """
+        self.publish_batch([dict(exchange=exchange, routing_key=routing_key, body=body, properties=properties,
+                                 exchange_type=exchange_type, queue=queue)])
+
+    def publish_batch(self, messages):
+        """Publishes `messages` (dicts of `publish` kwargs) on one channel."""
+        for attempt in range(2):
+            channel = self._acquire()
+            try:
+                for message in messages:
+                    self._publish(channel, **message)
+            except (pika.exceptions.AMQPConnectionError, pika.exceptions.AMQPChannelError) as ex:
+                self._release(channel, discard=True)
+                if attempt:
+                    raise
+                logging.warning(f"RabbitMQ publish failed, reconnecting: {ex}")
+                with self._cond:
+                    self.reconnects += 1
+                continue
+            except Exception:
+                self._release(channel, discard=True)
+                raise
+            self._release(channel)
+            with self._cond:
+                self.published += len(messages)
+            return
+
+    def close(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for channel in idle:
+            channel.close()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'size': self._size,
+                'idle': len(self._idle),
+                'max_channels': self.max_channels,
+                'published': self.published,
+                'connects': self.connects,
+                'reconnects': self.reconnects,
+            }
+
+    @staticmethod
+    def _publish(channel, exchange, routing_key, body, properties=None, exchange_type=None, queue=None):
+        if exchange_type and ('exchange', exchange) not in channel.declared:
+            channel.channel.exchange_declare(exchange=exchange, exchange_type=exchange_type, durable=True)
+            channel.declared.add(('exchange', exchange))
+        if queue and ('queue', queue) not in channel.declared:
+            channel.channel.queue_declare(queue=queue, durable=True)
+            channel.declared.add(('queue', queue))
+        channel.channel.basic_publish(exchange=exchange, routing_key=routing_key, body=body, properties=properties)
+
+    def _acquire(self):
+        with self._cond:
+            if not self._idle and self._size >= self.max_channels:
+                if not self._cond.wait_for(lambda: self._idle or self._size < self.max_channels, self.timeout):
+                    raise PublisherTimeout(f'No RabbitMQ channel available within {self.timeout} seconds')
+            channel = self._idle.pop() if self._idle else None
+            if channel is None:
+                self._size += 1
+        if channel is not None:
+            try:
+                # services heartbeats missed while the connection was idle
+                channel.connection.process_data_events(0)
+                if channel.is_open:
+                    return channel
+            except pika.exceptions.AMQPError:
+                pass
+            channel.close()
+            with self._cond:
+                self.reconnects += 1
+        try:
+            channel = _Channel(self.parameters, self.confirm_mode, self._connect)
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self.connects += 1
+        return channel
+
+    def _release(self, channel, discard=False):
+        if discard or not channel.is_open:
+            channel.close()
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            return
+        with self._cond:
+            self._idle.append(channel)
+            self._cond.notify()
+
+
+_publisher = None
+_publisher_key = None
+_publisher_lock = threading.Lock()
+
+
+def get_publisher(config=None):
+    """Returns the process-wide Publisher for the broker of `config` (the current app's by default)."""
+    global _publisher, _publisher_key
+    config = config or current_app.config
+    key = (config['BROKER_PATH'], config['RABBITMQ_VHOST'], config['RABBITMQ_USER'], config['RABBITMQ_PASSWORD'])
+    with _publisher_lock:
+        if _publisher is None or _publisher_key != key:
+            if _publisher is not None:
+                _publisher.close()
+            _publisher = Publisher(
+                get_connection_parameters(config),
+                max_channels=int(config.get('RABBITMQ_PUBLISHER_CHANNELS', 4)),
+                confirm_mode=config.get('RABBITMQ_PUBLISHER_CONFIRMS', 'message'),
+            )
+            _publisher_key = key
+        return _publisher
+
+
+class CacheInvalidationSubscriber(threading.Thread):
+    """
+    Background consumer of the cache invalidation fanout exchange.
+    Every process binds its own exclusive queue and evicts the received (table, entity_id) keys
+    from its local caches. Local caches are cleared on every (re)connect because invalidations
+    sent while disconnected are lost.
+    """
+
+    def __init__(self, parameters, on_invalidate, on_reset, retry_interval=5):
+        super().__init__(name='cache-invalidation-subscriber', daemon=True)
+        self.parameters = parameters
+        self.on_invalidate = on_invalidate
+        self.on_reset = on_reset
+        self.retry_interval = retry_interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                connection = pika.BlockingConnection(parameters=self.parameters)
+                channel = connection.channel()
+                channel.exchange_declare(exchange=CACHE_INVALIDATION_EXCHANGE, exchange_type='fanout', durable=True)
+                queue_name = channel.queue_declare(queue='', exclusive=True, auto_delete=True).method.queue
+                channel.queue_bind(exchange=CACHE_INVALIDATION_EXCHANGE, queue=queue_name)
+                channel.basic_consume(queue=queue_name, on_message_callback=self._on_message, auto_ack=True)
+                self.on_reset()
+                channel.start_consuming()
+            except pika.exceptions.AMQPError as ex:
+                logging.warning(f"Cache invalidation subscriber disconnected: {ex}")
+                self._stopped.wait(self.retry_interval)
+
+    def stop(self):
+        self._stopped.set()
+
+    def _on_message(self, channel, method, properties, body):
+        try:
+            message = json.loads(body)
+            if message.get('origin') != PROCESS_ID:
+                self.on_invalidate(message['table'], message['entity_ids'])
+        except (ValueError, KeyError) as ex:
+            logging.error(f"Invalid cache invalidation message {body}: {ex}")
+
+
+def start_cache_invalidation_subscriber(app):
+    """Starts the process-wide cache invalidation subscriber once."""
+    global _cache_invalidation_subscriber
+    if _cache_invalidation_subscriber is not None:
+        return _cache_invalidation_subscriber
+    from app.models import invalidate_cached_entities, clear_model_caches
+    _cache_invalidation_subscriber = CacheInvalidationSubscriber(
+        get_connection_parameters(app.config),
+        on_invalidate=invalidate_cached_entities,
+        on_reset=clear_model_caches
+    )
+    _cache_invalidation_subscriber.start()
+    return _cache_invalidation_subscriber
@@ -2,54 +2,157 @@ import logging
 import time
 from uuid import uuid4
 
-from flask import current_app as app
-from itsdangerous import URLSafeTimedSerializer
+from itsdangerous import URLSafeTimedSerializer, TimestampSigner
 
 
-def generate_confirmation_token(email):
-    with app.app_context():
-        serializer = URLSafeTimedSerializer(app.config['SECRET_KEY'])
-        return serializer.dumps(email, salt=app.config['SECURITY_PASSWORD_SALT'])
+class _Signer(TimestampSigner):
+    """TimestampSigner that derives the key of every secret once instead of on every sign and verify."""
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._derived_keys = {}
 
-def confirm_token(token, expiration=3600):
-    with app.app_context():
-        serializer = URLSafeTimedSerializer(app.config['SECRET_KEY'])
+    def derive_key(self, secret_key=None):
+        key = self.secret_keys[-1] if secret_key is None else secret_key
+        derived_key = self._derived_keys.get(key)
+        if derived_key is None:
+            derived_key = self._derived_keys[key] = super().derive_key(secret_key)
+        return derived_key
+
+
+class _Serializer(URLSafeTimedSerializer):
+    """URLSafeTimedSerializer that builds its signer once per salt."""
+
+    default_signer = _Signer
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._signers = {}
+
+    def make_signer(self, salt=None):
+        signer = self._signers.get(salt)
+        if signer is None:
+            signer = self._signers[salt] = super().make_signer(salt)
+        return signer
+
+
+class TokenService:
+    """
+    Signs and verifies tokens with serializers built once per salt, without an app context.
+    Tokens are signed with SECRET_KEY and accepted if signed with SECRET_KEY
+    or one of SECRET_KEY_FALLBACKS (comma separated, oldest first), so keys can be rotated.
+    With ACCESS_TOKEN_MODE=claims access tokens carry signed person claims instead of only the entity_id,
+    claims tokens of another ACCESS_TOKEN_VERSION are rejected.
+    """
+
+    def __init__(self, app=None, **options):
+        self.secret_keys = None
+        self.salt = None
+        self.access_token_expire = None
+        self.claims = False
+        self.token_version = 1
+        self._serializers = {}
+        if app is not None:
+            self.init_app(app, **options)
+
+    def init_app(self, app, **options):
+        sd = options.setdefault
+        conf = app.config
+
+        fallbacks = conf.get('SECRET_KEY_FALLBACKS') or []
+        if isinstance(fallbacks, str):
+            fallbacks = [key.strip() for key in fallbacks.split(',') if key.strip()]
+        sd('secret_keys', list(fallbacks) + [conf['SECRET_KEY']])
+        sd('salt', conf['SECURITY_PASSWORD_SALT'])
+        sd('access_token_expire', conf.get('ACCESS_TOKEN_EXPIRE'))
+        sd('claims', str(conf.get('ACCESS_TOKEN_MODE', 'opaque')).lower() == 'claims')
+        sd('token_version', conf.get('ACCESS_TOKEN_VERSION', 1))
+
+        self.configure(**options)
+
+        if not hasattr(app, 'extensions'):
+            app.extensions = {}
+        app.extensions['token_service'] = self
+
+    def configure(self, secret_keys, salt, access_token_expire=None, claims=False, token_version=1):
+        """
+        :param secret_keys: accepted secrets, oldest first, the last one signs new tokens
+        :param claims: issue claims access tokens
+        """
+        self.secret_keys = list(secret_keys)
+        self.salt = salt
+        self.access_token_expire = int(access_token_expire) if access_token_expire is not None else None
+        self.claims = claims
+        self.token_version = int(token_version)
+        self._serializers = {}
+
+    def serializer(self, salt=None):
+        salt = self.salt if salt is None else salt
+        serializer = self._serializers.get(salt)
+        if serializer is None:
+            if self.secret_keys is None:
+                raise RuntimeError('TokenService is not initialised, call init_app first')
+            serializer = self._serializers[salt] = _Serializer(self.secret_keys, salt=salt)
+        return serializer
+
+    def dumps(self, obj, salt=None):
+        salt = self.salt if salt is None else salt
+        return self.serializer(salt).dumps(obj, salt=salt)
+
+    def verify(self, token, max_age=None, salt=None):
+        """
+        Returns the value signed in `token`, or False if the token is invalid or older than `max_age` seconds.
+        """
+        salt = self.salt if salt is None else salt
         try:
-            email = serializer.loads(
-                token,
-                salt=app.config['SECURITY_PASSWORD_SALT'],
-                max_age=expiration
-            )
+            return self.serializer(salt).loads(token, salt=salt, max_age=max_age)
         except BaseException as ex:
             logging.error(ex)
             return False
-        return email
+
+    def generate_access_token(self, entity_id):
+        expires_in = int(time.time()) + int(self.access_token_expire)
+        return self.dumps(entity_id), expires_in
+
+    def generate_claims_token(self, claims):
+        expires_in = int(time.time()) + int(self.access_token_expire)
+        return self.dumps(claims), expires_in
+
+    def verify_access_token(self, token, expiration=None):
+        """
+        Returns the entity_id of an entity_id token, the claims dict of a valid claims token, or False.
+        """
+        if expiration is None:
+            expiration = int(self.access_token_expire)
+        value = self.verify(token, max_age=expiration)
+        if isinstance(value, dict) and (value.get('tv') != self.token_version or not value.get('sub')):
+            return False
+        return value
+
+    def confirm_access_token(self, token, expiration=None):
+        value = self.verify_access_token(token, expiration=expiration)
+        if isinstance(value, dict):
+            return value['sub']
+        return value
+
+
+token_service = TokenService()
+
+
+def generate_confirmation_token(email):
+    return token_service.dumps(email)
+
+
+def confirm_token(token, expiration=3600):
+    return token_service.verify(token, max_age=expiration)
 
 
 def generate_access_token(entity_id):
-    with app.app_context():
-        serializer = URLSafeTimedSerializer(app.config['SECRET_KEY'])
-        current_ux_ts = time.time()
-        expires_in = int(current_ux_ts) + int(app.config['ACCESS_TOKEN_EXPIRE'])
-        return serializer.dumps(entity_id, salt=app.config['SECURITY_PASSWORD_SALT']), expires_in
+    return token_service.generate_access_token(entity_id)
 
 
 def confirm_access_token(token, expiration=None):
-    with app.app_context():
-        if expiration is None:
-            expiration = int(app.config['ACCESS_TOKEN_EXPIRE'])
-        serializer = URLSafeTimedSerializer(app.config['SECRET_KEY'])
-        try:
-            entity_id = serializer.loads(
-                token,
-                salt=app.config['SECURITY_PASSWORD_SALT'],
-                max_age=expiration
-            )
-        except BaseException as ex:
-            logging.error(ex)
-            return False
-        return entity_id
+    return token_service.confirm_access_token(token, expiration=expiration)
 
 
 def generate_recovery_codes(number_of_tokens):
@@ -0,0 +1,127 @@
+from contextvars import ContextVar
+
+import pymysql
+
+from app import db_pool
+from app.identity_map import current_identity_map
+
+_current_transaction = ContextVar('current_transaction', default=None)
+
+
+class Transaction:
+    """
+    Owns one pooled connection and one database transaction for the duration of a `with` block.
+    Every model call made inside the block reuses the connection; commits and the callbacks
+    registered with `on_commit` (e.g. save notifications) are deferred until the block completes.
+    A transaction entered while another one is active joins it, only the outermost commits.
+    """
+
+    def __init__(self):
+        self._connection = None
+        self._outer = None
+        self._token = None
+        self._callbacks = []
+        # used as the identity map outside of a Flask request
+        self.identity_map = None
+        # tables with uncommitted writes, reads of them bypass process-wide caches
+        self.written_tables = set()
+
+    def __enter__(self):
+        self._outer = _current_transaction.get()
+        if self._outer is None:
+            self._token = _current_transaction.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if self._outer is not None:
+            return
+        try:
+            if exc_type is None:
+                self.commit()
+            else:
+                self.rollback()
+        finally:
+            _current_transaction.reset(self._token)
+            self._token = None
+            if self._connection is not None:
+                db_pool.release(self._connection, discard=isinstance(exc_value, pymysql.OperationalError))
+                self._connection = None
+
+    @property
+    def connection(self):
+        """The shared connection, checked out of the pool on first use."""
+        if self._outer is not None:
+            return self._outer.connection
+        if self._connection is None:
+            self._connection = db_pool.acquire()
+        return self._connection
+
+    @property
+    def is_owner(self):
+        return self._outer is None
+
+    def commit(self):
+        """Commits the work done so far and runs the deferred callbacks. No-op for a joined transaction."""
+        if not self.is_owner:
+            return
+        if self._connection is not None:
+            self._connection.commit()
+        self.written_tables = set()
+        callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def rollback(self):
+        """Rolls back the work done so far and drops the deferred callbacks. No-op for a joined transaction."""
+        if not self.is_owner:
+            return
+        self._callbacks = []
+        self.written_tables = set()
+        # objects loaded inside the transaction may reflect rolled back writes
+        identity_map = current_identity_map()
+        if identity_map is not None:
+            identity_map.clear()
+        if self._connection is not None:
+            self._connection.rollback()
+
+    def owns(self, connection):
+        if not self.is_owner:
+            return self._outer.owns(connection)
+        return connection is not None and self._connection is connection
+
+    def on_commit(self, callback):
+        if not self.is_owner:
+            return self._outer.on_commit(callback)
+        self._callbacks.append(callback)
+
+
+def current_transaction():
+    """Returns the outermost active Transaction or None."""
+    return _current_transaction.get()
+
+
+def commit(connection, callback=None):
+    """
+    Commits `connection` and runs `callback`.
+    If `connection` belongs to the active transaction both are deferred until that transaction commits.
+    """
+    transaction = current_transaction()
+    if transaction is not None and transaction.owns(connection):
+        if callback is not None:
+            transaction.on_commit(callback)
+        return
+    connection.commit()
+    if callback is not None:
+        callback()
+
+
+def track_write(connection, table):
+    """Records an uncommitted write to `table` if `connection` belongs to the active transaction."""
+    transaction = current_transaction()
+    if transaction is not None and transaction.owns(connection):
+        transaction.written_tables.add(table)
+
+
+def has_pending_writes(table):
+    transaction = current_transaction()
+    return transaction is not None and table in transaction.written_tables
@@ -493,14 +493,15 @@ def verify_recovery_code():
     email = request.json['email']
 
     with PersonRepository() as repo:
-        person = repo.get_by_email(email, with_clickwrap_acceptance=True)
-        if not person:
+        context = repo.get_login_context(email)
+        if not context:
             return app.response_class(
                 response=json.dumps(dict(success=False, message='User associated with email not found.')),
                 status=200,
                 mimetype=app.config['MIME_TYPE']
             )
-        if not repo.is_otp_method_enabled(person):
+        person = context.person
+        if not context.mfa_enabled:
             return app.response_class(
                 response=json.dumps(
                     dict(success=False, message='OTP method is not enabled.')),
@@ -508,7 +509,7 @@ def verify_recovery_code():
                 mimetype=app.config['MIME_TYPE']
             )
         with OtpMethodRepository() as otp_repo:
-            otp_method = otp_repo.get_by_person_id(person.entity_id)
+            otp_method = context.otp_method
 
             if not otp_repo.verify_recovery_code(recovery_code, otp_method):
                 return app.response_class(
@@ -548,37 +549,36 @@ def login_mfa():
         )
     email = request.json['email']
     with PersonRepository() as repo:
-        person = repo.get_by_email(email, with_clickwrap_acceptance=True)
-        if not person:
+        context = repo.get_login_context(email)
+        if not context:
             return app.response_class(
                 response=json.dumps(dict(success=False, message='User associated with email not found.')),
                 status=200,
                 mimetype=app.config['MIME_TYPE']
             )
-        otp_method = OtpMethod(person_id=person.entity_id)
-        with OtpMethodRepository() as otp_repo:
-            if not otp_repo.is_exist(otp_method):
-                return app.response_class(
-                    response=json.dumps(
-                        dict(success=False, message='OTP method associated with the person not found.')),
-                    status=200,
-                    mimetype=app.config['MIME_TYPE']
-                )
-            otp_method = otp_repo.get_by_person_id(person.entity_id)
-            otp = str(request.json['otp'])
-            if pyotp.TOTP(otp_method.secret).verify(otp):
-                data = repo.login(person)
-                return app.response_class(
-                    response=json.dumps(
-                        dict(success=True, message='The TOTP MFA token is valid', user=data)),
-                    status=200,
-                    mimetype=app.config['MIME_TYPE']
-                )
+        person = context.person
+        otp_method = context.otp_method
+        if otp_method is None:
             return app.response_class(
-                response=json.dumps(dict(success=False, message='You have supplied an invalid MFA token!')),
+                response=json.dumps(
+                    dict(success=False, message='OTP method associated with the person not found.')),
+                status=200,
+                mimetype=app.config['MIME_TYPE']
+            )
+        otp = str(request.json['otp'])
+        if pyotp.TOTP(otp_method.secret).verify(otp):
+            data = repo.login(person)
+            return app.response_class(
+                response=json.dumps(
+                    dict(success=True, message='The TOTP MFA token is valid', user=data)),
                 status=200,
                 mimetype=app.config['MIME_TYPE']
             )
+        return app.response_class(
+            response=json.dumps(dict(success=False, message='You have supplied an invalid MFA token!')),
+            status=200,
+            mimetype=app.config['MIME_TYPE']
+        )
 
 
 @auth.route('/login', methods=['POST'])
@@ -603,10 +603,12 @@ def login():
         )
     email = request.json['email']
     with PersonRepository() as repo:
-        person = repo.get_by_email(email, with_clickwrap_acceptance=True)
-        if person:
+        context = repo.get_login_context(email)
+        if context:
+            person = context.person
             if person.is_password_valid(request.json['password']):
-                if repo.is_otp_method_enabled(person):
+                repo.rehash_password_if_needed(person, request.json['password'])
+                if context.mfa_enabled:
                     return app.response_class(
                         response=json.dumps(
                             dict(success=True, user=dict(mfa_enabled=True, email=email, verified=person.verified))
@@ -756,7 +758,7 @@ def social_github():
             return app.response_class(
                 response=json.dumps(dict(
                     success=True,
-                    user=current_user.get_for_api(),
+                    user=current_user.load_full().get_for_api(),
                     auth=login_method_dict
                 )),
                 status=200,
@@ -872,7 +874,7 @@ def social_linkedin():
             return app.response_class(
                 response=json.dumps(dict(
                     success=True,
-                    user=current_user.get_for_api(),
+                    user=current_user.load_full().get_for_api(),
                     auth=login_method_dict
                 )),
                 status=200,
@@ -952,7 +954,7 @@ def social_google():
                     return app.response_class(
                         response=json.dumps(dict(
                             success=True,
-                            user=current_user.get_for_api(),
+                            user=current_user.load_full().get_for_api(),
                             auth=login_method_dict
                         )),
                         status=200,
@@ -1064,7 +1066,7 @@ def social_facebook():
             return app.response_class(
                 response=json.dumps(dict(
                     success=True,
-                    user=current_user.get_for_api(),
+                    user=current_user.load_full().get_for_api(),
                     auth=login_method_dict
                 )),
                 status=200,
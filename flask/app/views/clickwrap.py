@@ -1,5 +1,8 @@
+import gzip
 import json
+import zlib
 
+from app.cache import LRUCache
 from app.tasks import send_task
 from app.models import ClickwrapAcceptance
 from app.repositories import ClickwrapRepository
@@ -8,23 +11,65 @@ from flask_login import login_required, current_user
 
 clickwrap_blueprint = Blueprint('clickwrap', __name__)
 
+# response bodies by (entity_id, version, content coding), a version of an agreement never changes
+_bodies = LRUCache(maxsize=32, ttl=0)
+_compressors = {
+    'gzip': lambda body: gzip.compress(body, mtime=0),
+    'deflate': zlib.compress,
+}
 
-@clickwrap_blueprint.route('/clickwrap', methods=['GET'])
-@login_required
-def get_clickwrap():
-    with ClickwrapRepository() as repo:
-        clickwrap = repo.get_published()
 
+def _get_body(clickwrap, coding):
+    key = (clickwrap.entity_id, clickwrap.version, coding)
+    body = _bodies.get(key)
+    if body is None:
+        if coding == 'identity':
+            body = json.dumps(dict(success=True, clickwrap=clickwrap.get_for_api())).encode()
+        else:
+            body = _compressors[coding](_get_body(clickwrap, 'identity'))
+        _bodies.set(key, body)
+    return body
+
+
+def clickwrap_response(clickwrap):
+    """
+    Returns the agreement with a weak ETag made of its content_md5 and version, weak because the same tag
+    is sent for every content coding. A request whose If-None-Match has that tag gets a 304 without a body,
+    otherwise the body is served from the per-version cache, gzip or deflate compressed if the client accepts it.
+    The published agreement comes from the model cache, so with claims access tokens a 304 needs no query;
+    with opaque tokens `login_required` still loads the person.
+    """
+    if not clickwrap:
         return app.response_class(
-            response=json.dumps(
-                dict(
-                    success=True,
-                    clickwrap=clickwrap.get_for_api() if clickwrap else clickwrap
-                )
-            ),
+            response=json.dumps(dict(success=True, clickwrap=None)),
+            status=200,
+            mimetype=app.config['MIME_TYPE']
+        )
+
+    etag = f'{clickwrap.content_md5}-{clickwrap.version}'
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+    else:
+        coding = request.accept_encodings.best_match(list(_compressors)) or 'identity'
+        response = app.response_class(
+            response=_get_body(clickwrap, coding),
             status=200,
             mimetype=app.config['MIME_TYPE']
         )
+        if coding != 'identity':
+            response.headers['Content-Encoding'] = coding
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = app.config.get('CLICKWRAP_CACHE_CONTROL', 'private, no-cache')
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+@clickwrap_blueprint.route('/clickwrap', methods=['GET'])
+@login_required
+def get_clickwrap():
+    with ClickwrapRepository() as repo:
+        clickwrap = repo.get_published()
+        return clickwrap_response(clickwrap)
 
 
 @clickwrap_blueprint.route('/clickwrap/draft', methods=['GET'])
@@ -34,17 +79,7 @@ def get_clickwrap():
 def get_draft():
     with ClickwrapRepository() as repo:
         clickwrap = repo.get_draft()
-
-        return app.response_class(
-            response=json.dumps(
-                dict(
-                    success=True,
-                    clickwrap=clickwrap.get_for_api() if clickwrap else clickwrap
-                )
-            ),
-            status=200,
-            mimetype=app.config['MIME_TYPE']
-        )
+        return clickwrap_response(clickwrap)
 
 
 @clickwrap_blueprint.route('/clickwrap/draft', methods=['POST'])
@@ -210,7 +245,7 @@ def accept():
 
         if not repo.has_user_accepted(acceptance):
             acceptance = repo.accept_clickwrap(acceptance)
-            user_dict = current_user.get_as_dict()
+            user_dict = current_user.load_full().get_as_dict()
             user_dict.pop("password", None)
             user_dict.pop("raw_password", None)
             user_dict.pop("password_hash", None)
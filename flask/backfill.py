@@ -0,0 +1,64 @@
+import argparse
+import time
+
+from app import create_app
+from app.models import (
+    Person, LoginMethod, OtpMethod, RecoveryCode, ClickwrapAgreement, ClickwrapAcceptance, UserClickwrapStatus,
+)
+
+VERSIONED_MODELS = (Person, LoginMethod, OtpMethod, RecoveryCode, ClickwrapAgreement, ClickwrapAcceptance)
+
+
+def backfill_clickwrap_status(parsed):
+    """Rebuilds user_clickwrap_status from clickwrap_acceptance."""
+    return UserClickwrapStatus.backfill(batch_size=parsed.batch_size)
+
+
+def backfill_version_history(parsed):
+    """Moves the superseded versions of every versioned table to its history table, after switching to history."""
+    return sum(model.move_to_history(batch_size=parsed.batch_size) for model in VERSIONED_MODELS)
+
+
+BACKFILLS = {
+    'clickwrap-status': backfill_clickwrap_status,
+    'version-history': backfill_version_history,
+}
+
+
+def get_arg_parser():
+    example_text = '''example:
+    %(prog)s clickwrap-status
+    %(prog)s clickwrap-status -b 500
+    %(prog)s version-history
+    '''
+    parser = argparse.ArgumentParser(
+        prog='python backfill.py',
+        epilog=example_text,
+        description='Fill derived tables from existing data',
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "backfill",
+        help="table to fill",
+        choices=sorted(BACKFILLS)
+    )
+    parser.add_argument(
+        "-b", "--batch_size",
+        help="number of rows written per transaction",
+        type=int,
+        default=1000
+    )
+    return parser
+
+
+def main():
+    parsed = get_arg_parser().parse_args()
+    app = create_app()
+    with app.app_context():
+        started_at = time.perf_counter()
+        rows = BACKFILLS[parsed.backfill](parsed)
+        print(f'{parsed.backfill}: {rows} rows in {time.perf_counter() - started_at:.1f}s')
+
+
+if __name__ == "__main__":
+    main()
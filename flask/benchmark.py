@@ -0,0 +1,191 @@
+import argparse
+import os
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
+
+import pyotp
+
+from app import create_app, db_pool
+from app.hashing import PasswordHasher
+from app.ids import uuid7_hex, encode_id
+from app.models import OtpMethod, RecoveryCode
+from app.repositories import OtpMethodRepository
+
+
+def benchmark_hashing(parsed):
+    """Hashes passwords through PasswordHasher with 1..N worker processes and reports hashes per second per core."""
+    max_workers = parsed.workers or os.cpu_count() or 1
+    print(f"method={parsed.method}:{parsed.iterations} hashes={parsed.number}")
+    print(f"{'workers':>8} {'seconds':>9} {'hashes/s':>10} {'hashes/s/core':>14}")
+    workers = 1
+    while True:
+        hasher = PasswordHasher()
+        hasher.configure(method=parsed.method, iterations=parsed.iterations, workers=workers,
+                         max_pending=parsed.number)
+        # starts the worker processes before timing
+        hasher.hash('warm up')
+        started_at = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers * 2) as threads:
+            list(threads.map(hasher.hash, ['password'] * parsed.number))
+        elapsed = time.perf_counter() - started_at
+        hasher.shutdown()
+        rate = parsed.number / elapsed
+        print(f"{workers:>8} {elapsed:>9.3f} {rate:>10.1f} {rate / workers:>14.1f}")
+        if workers >= max_workers:
+            break
+        workers = min(workers * 2, max_workers)
+
+
+def _delete_recovery_codes_per_code(otp_method):
+    # the deletion used before codes were soft deleted in one batch: a lookup and a save per code
+    for code in RecoveryCode.get_active(otp_method.entity_id):
+        RecoveryCode().get(code.entity_id, key='entity_id').delete()
+
+
+def _milliseconds(timings):
+    timings = sorted(timings)
+    return statistics.median(timings) * 1000, timings[int(len(timings) * 0.95) - 1] * 1000
+
+
+def benchmark_mfa(parsed):
+    """
+    Times enabling MFA (storing the OTP method and its recovery codes) and regenerating the recovery codes
+    against the configured database, with per-code and batched deletion of the previous codes.
+    """
+    app = create_app()
+    print(f"otp methods={parsed.number} codes={RecoveryCode.__number_of_tokens__}")
+    print(f"{'deletion':>9} {'enable p50':>11} {'enable p95':>11} {'regenerate p50':>15} {'regenerate p95':>15}")
+    with app.app_context():
+        for mode in ('per-code', 'batch'):
+            enable, regenerate = [], []
+            for _ in range(parsed.number):
+                started_at = time.perf_counter()
+                with OtpMethodRepository() as repo:
+                    otp_method = OtpMethod(person_id=uuid4().hex, secret=pyotp.random_base32(), enabled=True).save()
+                    repo.create_recovery_codes(otp_method)
+                enable.append(time.perf_counter() - started_at)
+
+                started_at = time.perf_counter()
+                with OtpMethodRepository() as repo:
+                    if mode == 'per-code':
+                        _delete_recovery_codes_per_code(otp_method)
+                    repo.create_recovery_codes(otp_method)
+                regenerate.append(time.perf_counter() - started_at)
+            enable_p50, enable_p95 = _milliseconds(enable)
+            regenerate_p50, regenerate_p95 = _milliseconds(regenerate)
+            print(f"{mode:>9} {enable_p50:>9.1f}ms {enable_p95:>9.1f}ms {regenerate_p50:>13.1f}ms {regenerate_p95:>13.1f}ms")
+
+
+_ID_LAYOUTS = {
+    # name: (id column type, id factory)
+    'varchar uuid4': ('varchar(32)', lambda: uuid4().hex),
+    'binary uuid7': ('binary(16)', lambda: encode_id(uuid7_hex())),
+}
+
+
+def benchmark_ids(parsed):
+    """
+    Inserts rows shaped like recovery codes into temporary tables with random hex varchar(32) ids and
+    time-ordered BINARY(16) ids and reports inserts per second.
+    """
+    app = create_app()
+    batch_size = 100
+    print(f"rows={parsed.number} batch={batch_size}")
+    print(f"{'layout':>14} {'seconds':>9} {'rows/s':>10}")
+    with app.app_context():
+        connection = db_pool.acquire()
+        try:
+            for layout, (id_type, new_id) in _ID_LAYOUTS.items():
+                with connection.cursor() as cursor:
+                    cursor.execute("DROP TEMPORARY TABLE IF EXISTS benchmark_ids;")
+                    cursor.execute(
+                        f"""
+                        CREATE TEMPORARY TABLE benchmark_ids (
+                            `entity_id` {id_type} NOT NULL,
+                            `version` {id_type} NOT NULL,
+                            `latest` tinyint(1) DEFAULT '1',
+                            `active` tinyint(1) DEFAULT '1',
+                            `otp_method_id` varchar(32) NOT NULL,
+                            `token` varchar(32) NOT NULL,
+                            PRIMARY KEY (`entity_id`, `version`),
+                            INDEX otp_method_latest_ind (`otp_method_id`, `latest`, `active`)
+                        ) ENGINE=InnoDB;
+                        """
+                    )
+                    started_at = time.perf_counter()
+                    for offset in range(0, parsed.number, batch_size):
+                        rows = [(new_id(), new_id(), uuid4().hex, uuid4().hex.upper())
+                                for _ in range(min(batch_size, parsed.number - offset))]
+                        cursor.executemany(
+                            "INSERT INTO benchmark_ids (entity_id, version, otp_method_id, token) "
+                            "VALUES (%s, %s, %s, %s)",
+                            rows
+                        )
+                        connection.commit()
+                    elapsed = time.perf_counter() - started_at
+                    cursor.execute("DROP TEMPORARY TABLE benchmark_ids;")
+                print(f"{layout:>14} {elapsed:>9.3f} {parsed.number / elapsed:>10.1f}")
+        finally:
+            db_pool.release(connection)
+
+
+BENCHMARKS = {
+    'hashing': benchmark_hashing,
+    'mfa': benchmark_mfa,
+    'ids': benchmark_ids,
+}
+
+
+def get_arg_parser():
+    example_text = '''example:
+    %(prog)s hashing
+    %(prog)s hashing -n 200 -i 600000
+    %(prog)s mfa -n 50
+    %(prog)s ids -n 100000
+    '''
+    parser = argparse.ArgumentParser(
+        prog='python benchmark.py',
+        epilog=example_text,
+        description='Run performance benchmarks',
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "benchmark",
+        help="benchmark to run",
+        choices=sorted(BENCHMARKS)
+    )
+    parser.add_argument(
+        "-n", "--number",
+        help="number of operations",
+        type=int,
+        default=100
+    )
+    parser.add_argument(
+        "-w", "--workers",
+        help="maximum number of worker processes, defaults to the number of CPUs",
+        type=int,
+        default=0
+    )
+    parser.add_argument(
+        "-m", "--method",
+        help="password hash method",
+        default=os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256')
+    )
+    parser.add_argument(
+        "-i", "--iterations",
+        help="password hash cost",
+        type=int,
+        default=int(os.environ.get('PASSWORD_HASH_ITERATIONS', 260000))
+    )
+    return parser
+
+
+def main():
+    parsed = get_arg_parser().parse_args()
+    BENCHMARKS[parsed.benchmark](parsed)
+
+
+if __name__ == "__main__":
+    main()
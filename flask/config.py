@@ -7,7 +7,22 @@ class Config(object):
     DEBUG = False
     TESTING = False
     ACCESS_TOKEN_EXPIRE = os.environ.get('ACCESS_TOKEN_EXPIRE')
+    # opaque: the token carries the entity_id, claims: the token carries the person fields views need
+    ACCESS_TOKEN_MODE = os.environ.get('ACCESS_TOKEN_MODE', 'opaque')
+    # bump to reject every claims token issued before
+    ACCESS_TOKEN_VERSION = os.environ.get('ACCESS_TOKEN_VERSION', 1)
+    # seconds a claims token is trusted before the stored access token is checked again
+    ACCESS_TOKEN_REVALIDATE = os.environ.get('ACCESS_TOKEN_REVALIDATE', 60)
     MIME_TYPE = 'application/json'
+    # clients revalidate the clickwrap agreement with its ETag, see app.views.clickwrap.clickwrap_response
+    CLICKWRAP_CACHE_CONTROL = os.environ.get('CLICKWRAP_CACHE_CONTROL', 'private, no-cache')
+    # werkzeug hash method and cost, stored hashes made with other values are rehashed on login
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256')
+    PASSWORD_HASH_ITERATIONS = os.environ.get('PASSWORD_HASH_ITERATIONS', 260000)
+    # worker processes hashing passwords, 0 hashes in the request thread
+    PASSWORD_HASH_WORKERS = os.environ.get('PASSWORD_HASH_WORKERS', os.cpu_count() or 1)
+    # hashes queued at once, 0 for 4 per worker
+    PASSWORD_HASH_MAX_PENDING = os.environ.get('PASSWORD_HASH_MAX_PENDING', 0)
 
     FRONTEND_URL = os.environ.get("VUE_APP_URI")
     SOCIAL_AUTH_REDIRECT_URI = os.environ.get("VUE_APP_SOCIAL_AUTH_REDIRECT_URI")
@@ -18,6 +33,23 @@ class Config(object):
     MYSQL_PASSWORD = os.environ.get("MYSQL_PASSWORD")
     MYSQL_PORT = os.environ.get("MYSQL_PORT")
     MYSQL_DATABASE = os.environ.get("MYSQL_DATABASE")
+    MYSQL_POOL_MIN_SIZE = os.environ.get("MYSQL_POOL_MIN_SIZE", 1)
+    MYSQL_POOL_MAX_SIZE = os.environ.get("MYSQL_POOL_MAX_SIZE", 10)
+    MYSQL_POOL_TIMEOUT = os.environ.get("MYSQL_POOL_TIMEOUT", 30)
+    MYSQL_POOL_RECYCLE = os.environ.get("MYSQL_POOL_RECYCLE", 3600)
+    MYSQL_POOL_PRE_PING = os.environ.get("MYSQL_POOL_PRE_PING", True)
+    # default: a save marks every version of the entity as not latest,
+    # optimistic: a save replaces only the version it was loaded from and raises VersionConflict otherwise
+    # (the conditional UPDATE and the INSERT take separate round trips, multi-statements stay off)
+    VERSIONED_SAVE_MODE = os.environ.get("VERSIONED_SAVE_MODE", 'default')
+    # single: every version in one table, history: superseded versions in `<table>_history`,
+    # existing ones are moved by `python backfill.py version-history`
+    VERSIONED_STORAGE = os.environ.get("VERSIONED_STORAGE", 'single')
+    # ids of models with binary id columns stored as BINARY(16) as created by migration 0000000006,
+    # turn it off only for databases migrated no further than 0000000005
+    BINARY_IDS = os.environ.get("BINARY_IDS", 'True').lower() in ('1', 'true', 'yes')
+    # days superseded versions are kept per table before prune.py removes them, see app.retention
+    VERSION_RETENTION = os.environ.get("VERSION_RETENTION", 'person=90,login_method=90,otp_method=90,recovery_code=30')
 
     # RabbitMQ CONFIGS
     BROKER_PATH = os.environ.get('BROKER_PATH', 'rabbitmq:5672')
@@ -26,6 +58,13 @@ class Config(object):
     RABBITMQ_VHOST = os.environ.get('RABBITMQ_VHOST')
     MQ_URL = f'amqp://{RABBITMQ_USER}:{RABBITMQ_PASSWORD}@{BROKER_PATH}/{RABBITMQ_VHOST}'
     MQ_EXCHANGE = os.environ.get('MQ_EXCHANGE')
+    # open channels kept by the process-wide publisher
+    RABBITMQ_PUBLISHER_CHANNELS = os.environ.get('RABBITMQ_PUBLISHER_CHANNELS', 4)
+    # message or off
+    RABBITMQ_PUBLISHER_CONFIRMS = os.environ.get('RABBITMQ_PUBLISHER_CONFIRMS', 'message')
+    CACHE_INVALIDATION_BUS = os.environ.get('CACHE_INVALIDATION_BUS', True)
+    # write save notifications to the outbox table, sent by relay.py
+    SAVE_NOTIFICATION_OUTBOX = os.environ.get('SAVE_NOTIFICATION_OUTBOX', True)
 
     # SOCIAL AUTH
     GITHUB_OAUTH_CLIENT_ID = os.environ.get('GITHUB_CLIENT_ID')
@@ -49,11 +88,16 @@ class Config(object):
     PUSHER_API_KEY = os.environ.get('PUSHER_API_KEY')
     PUSHER_API_SECRET = os.environ.get('PUSHER_API_SECRET')
     PUSHER_CLUSTER = os.environ.get('PUSHER_CLUSTER')
+    PUSHER_DISPATCHER_FLUSH_SIZE = os.environ.get('PUSHER_DISPATCHER_FLUSH_SIZE', 10)
+    PUSHER_DISPATCHER_FLUSH_INTERVAL = os.environ.get('PUSHER_DISPATCHER_FLUSH_INTERVAL', 0.05)
+    PUSHER_DISPATCHER_MAX_QUEUE = os.environ.get('PUSHER_DISPATCHER_MAX_QUEUE', 10000)
 
 
 class ProductionConfig(Config):
     DEBUG = False
     SECRET_KEY = os.environ.get("SECRET_KEY")
+    # previous secret keys, comma separated, still accepted when verifying tokens
+    SECRET_KEY_FALLBACKS = os.environ.get("SECRET_KEY_FALLBACKS")
     SECURITY_PASSWORD_SALT = os.environ.get("SECURITY_PASSWORD_SALT")
     OAUTHLIB_INSECURE_TRANSPORT = False
 
@@ -73,6 +117,7 @@ class TestConfig(Config):
     TESTING = True
     SECRET_KEY = "secret_for_test_environment"
     SECURITY_PASSWORD_SALT = "password_salt_for_test"
+    PASSWORD_HASH_WORKERS = 0
     OAUTHLIB_INSECURE_TRANSPORT = True  # do not use in prod
     # MYSQL CONFIGS
     MYSQL_HOST = os.environ.get("MYSQL_TEST_HOST", 'localhost')
@@ -80,3 +125,5 @@ class TestConfig(Config):
     MYSQL_PASSWORD = os.environ.get("MYSQL_PASSWORD")
     MYSQL_PORT = os.environ.get("MYSQL_TEST_PORT", 3307)
     MYSQL_DATABASE = os.environ.get("MYSQL_TEST_DATABASE", 'test_core')
+    CACHE_INVALIDATION_BUS = False
+    SAVE_NOTIFICATION_OUTBOX = False
@@ -0,0 +1,71 @@
+import argparse
+
+from app import create_app
+from app.retention import VersionPruner
+
+
+def get_arg_parser():
+    example_text = '''example:
+    %(prog)s
+    %(prog)s -t recovery_code -b 500 -s 0.5
+    %(prog)s --archive --dry_run
+    '''
+    parser = argparse.ArgumentParser(
+        prog='python prune.py',
+        epilog=example_text,
+        description='Delete or archive superseded versions older than the retention of their table (VERSION_RETENTION)',
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "-t", "--tables",
+        help="tables to prune, defaults to every table with a retention",
+        nargs='*'
+    )
+    parser.add_argument(
+        "-b", "--batch_size",
+        help="number of rows read and pruned per transaction",
+        type=int,
+        default=1000
+    )
+    parser.add_argument(
+        "-s", "--sleep",
+        help="seconds to pause after every batch that removed rows",
+        type=float,
+        default=0.1
+    )
+    parser.add_argument(
+        "-a", "--archive",
+        help="move the versions to <table>_history instead of deleting them",
+        action='store_true'
+    )
+    parser.add_argument(
+        "--dry_run",
+        help="count the versions that would be removed",
+        action='store_true'
+    )
+    return parser
+
+
+def main():
+    parsed = get_arg_parser().parse_args()
+    app = create_app()
+    with app.app_context():
+        pruner = VersionPruner(
+            retention=app.config.get('VERSION_RETENTION'),
+            batch_size=parsed.batch_size,
+            sleep=parsed.sleep,
+            archive=parsed.archive,
+            storage=app.config.get('VERSIONED_STORAGE', 'single'),
+            dry_run=parsed.dry_run
+        )
+        reports = pruner.run(parsed.tables)
+    action = 'would reclaim' if parsed.dry_run else 'reclaimed'
+    for report in reports:
+        print(f"{report['table']}: {action} {report['reclaimed']} of {report['scanned']} rows "
+              f"in {report['seconds']:.1f}s")
+    print(f"total: {action} {sum(report['reclaimed'] for report in reports)} rows "
+          f"in {sum(report['seconds'] for report in reports):.1f}s")
+
+
+if __name__ == "__main__":
+    main()
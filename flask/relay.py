@@ -0,0 +1,58 @@
+import argparse
+
+from app import create_app
+from app.outbox import OutboxRelay
+
+
+def get_arg_parser():
+    example_text = '''example:
+    %(prog)s
+    %(prog)s -b 200 -a 5
+    '''
+    parser = argparse.ArgumentParser(
+        prog='python relay.py',
+        epilog=example_text,
+        description='Send save notifications stored in the outbox to RabbitMQ and Pusher',
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "-b", "--batch_size",
+        help="number of outbox rows sent per batch",
+        type=int,
+        default=100
+    )
+    parser.add_argument(
+        "-a", "--max_attempts",
+        help="number of attempts before a row is given up",
+        type=int,
+        default=10
+    )
+    parser.add_argument(
+        "-r", "--retry_interval",
+        help="seconds before the first retry, doubled on every attempt",
+        type=int,
+        default=5
+    )
+    parser.add_argument(
+        "-p", "--poll_interval",
+        help="seconds to wait when the outbox is drained",
+        type=float,
+        default=1
+    )
+    return parser
+
+
+def main():
+    parsed = get_arg_parser().parse_args()
+    app = create_app()
+    with app.app_context():
+        OutboxRelay(
+            batch_size=parsed.batch_size,
+            max_attempts=parsed.max_attempts,
+            retry_interval=parsed.retry_interval,
+            poll_interval=parsed.poll_interval
+        ).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,8 @@
 DELETE FROM person WHERE 1=1;
 DELETE FROM login_method WHERE 1=1;
 DELETE FROM otp_method WHERE 1=1;
+DELETE FROM session WHERE 1=1;
+DELETE FROM user_clickwrap_status WHERE 1=1;
+DELETE FROM person_history WHERE 1=1;
+DELETE FROM login_method_history WHERE 1=1;
+DELETE FROM otp_method_history WHERE 1=1;
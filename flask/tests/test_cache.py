@@ -0,0 +1,72 @@
+from app.cache import LRUCache, ModelCache
+from app.models import OtpMethod
+
+
+class FakeTimer:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2, ttl=None)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    stats = cache.stats()
+    assert stats['evictions'] == 1
+    assert stats['hits'] == 3
+    assert stats['misses'] == 1
+
+
+def test_lru_cache_expires_entries():
+    timer = FakeTimer()
+    cache = LRUCache(maxsize=2, ttl=10, timer=timer)
+    cache.set('a', 1)
+    timer.now = 9
+    assert cache.get('a') == 1
+    timer.now = 10
+    assert cache.get('a') is None
+    assert cache.stats()['expirations'] == 1
+
+
+def test_model_cache_invalidates_every_lookup_of_entity():
+    cache = ModelCache(maxsize=10, ttl=None)
+    row = {'entity_id': 'otp_id', 'person_id': 'person_id'}
+    cache.set_row('person_id', 'person_id', row)
+    cache.set_row('entity_id', 'otp_id', row)
+    cache.set_row('entity_id', 'other_id', {'entity_id': 'other_id'})
+    assert cache.get_row('person_id', 'person_id') == row
+    cache.invalidate('otp_id')
+    assert cache.get_row('person_id', 'person_id') is None
+    assert cache.get_row('entity_id', 'otp_id') is None
+    assert cache.get_row('entity_id', 'other_id') == {'entity_id': 'other_id'}
+
+
+def test_model_cache_does_not_cache_misses():
+    cache = ModelCache(maxsize=10, ttl=None)
+    cache.set_row('entity_id', 'missing', None)
+    assert len(cache) == 0
+
+
+def test_otp_method_get_is_read_through(mocker):
+    mocker.patch('app.models.current_identity_map', return_value=None)
+    OtpMethod.__cache__.clear()
+    row = {'entity_id': 'otp_id', 'version': 'v1', 'person_id': 'person_id', 'enabled': True}
+    spy = mocker.patch.object(OtpMethod, 'fetchone_dict', return_value=row)
+    first = OtpMethod.get('person_id', key='person_id')
+    second = OtpMethod.get('person_id', key='person_id')
+    assert spy.call_count == 1
+    assert first is not second
+    assert second.entity_id == 'otp_id'
+
+    OtpMethod.invalidate_cache('otp_id')
+    OtpMethod.get('person_id', key='person_id')
+    assert spy.call_count == 2
+    OtpMethod.__cache__.clear()
@@ -0,0 +1,58 @@
+import gzip
+import json
+
+from flask import Flask
+
+from app.models import ClickwrapAgreement
+from app.views.clickwrap import clickwrap_response
+
+
+def make_clickwrap(version='v1'):
+    return ClickwrapAgreement(entity_id=ClickwrapAgreement.PUBLISHED_UUID, version=version, content='Terms',
+                              content_version='1.0', content_md5='md5', status='published')
+
+
+def get_response(clickwrap, headers=None):
+    app = Flask(__name__)
+    app.config['MIME_TYPE'] = 'application/json'
+    with app.test_request_context(headers=headers or {}):
+        return clickwrap_response(clickwrap)
+
+
+def test_clickwrap_response_has_etag_and_cache_control():
+    response = get_response(make_clickwrap())
+    assert response.status_code == 200
+    assert response.headers['ETag'] == 'W/"md5-v1"'
+    assert response.headers['Cache-Control'] == 'private, no-cache'
+    assert json.loads(response.get_data())['clickwrap']['content'] == 'Terms'
+
+
+def test_clickwrap_response_not_modified(mocker):
+    get_for_api = mocker.spy(ClickwrapAgreement, 'get_for_api')
+    response = get_response(make_clickwrap('v2'), {'If-None-Match': '"md5-v2"'})
+    assert response.status_code == 304
+    assert response.get_data() == b''
+    assert response.headers['ETag'] == 'W/"md5-v2"'
+    assert get_for_api.call_count == 0
+
+    response = get_response(make_clickwrap('v2'), {'If-None-Match': 'W/"md5-v2"', 'Accept-Encoding': 'gzip'})
+    assert response.status_code == 304
+
+    response = get_response(make_clickwrap('v3'), {'If-None-Match': '"md5-v2"'})
+    assert response.status_code == 200
+
+
+def test_clickwrap_response_compressed_body_is_cached_per_version(mocker):
+    get_for_api = mocker.spy(ClickwrapAgreement, 'get_for_api')
+    for _ in range(2):
+        response = get_response(make_clickwrap('v4'), {'Accept-Encoding': 'gzip, deflate'})
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert json.loads(gzip.decompress(response.get_data()))['clickwrap']['version'] == 'v4'
+    assert get_for_api.call_count == 1
+    assert 'Accept-Encoding' in response.headers['Vary']
+
+
+def test_clickwrap_response_without_agreement():
+    response = get_response(None)
+    assert json.loads(response.get_data()) == {'success': True, 'clickwrap': None}
+    assert 'ETag' not in response.headers
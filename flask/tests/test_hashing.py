@@ -0,0 +1,83 @@
+import threading
+
+import pytest
+
+from app.hashing import PasswordHasher, HashingBusy
+
+
+@pytest.fixture
+def hasher():
+    h = PasswordHasher()
+    h.configure(iterations=1000)
+    yield h
+    h.shutdown()
+
+
+def test_hasher_hashes_and_checks(hasher):
+    password_hash = hasher.hash('1234')
+    assert password_hash.startswith('pbkdf2:sha256:1000$')
+    assert hasher.check(password_hash, '1234') is True
+    assert hasher.check(password_hash, '4321') is False
+    assert hasher.check(None, '1234') is False
+
+
+def test_hasher_needs_rehash_when_parameters_change(hasher):
+    password_hash = hasher.hash('1234')
+    assert hasher.needs_rehash(password_hash) is False
+    hasher.configure(iterations=2000)
+    assert hasher.needs_rehash(password_hash) is True
+    assert hasher.check(password_hash, '1234') is True
+
+
+@pytest.mark.parametrize('method', ['scrypt', 'sha256', 'pbkdf2', 'pbkdf2:sha256:1000', 'pbkdf2:unknown'])
+def test_hasher_rejects_methods_without_cost(hasher, method):
+    with pytest.raises(ValueError):
+        hasher.configure(method=method)
+
+
+def test_hasher_uses_worker_processes():
+    hasher = PasswordHasher()
+    hasher.configure(iterations=1000, workers=1)
+    try:
+        assert hasher.check(hasher.hash('1234'), '1234') is True
+        assert hasher._executor is not None
+    finally:
+        hasher.shutdown()
+
+
+def test_hasher_raises_when_queue_is_full(hasher):
+    hasher.configure(iterations=1000, max_pending=1, timeout=0.01)
+    hasher._slots.acquire()
+    with pytest.raises(HashingBusy):
+        hasher.hash('1234')
+    hasher._slots.release()
+    assert hasher.hash('1234')
+
+
+def test_hasher_releases_the_slot_it_acquired_after_configure(hasher):
+    hasher.configure(iterations=1000, max_pending=1)
+    started, release = threading.Event(), threading.Event()
+
+    def slow_hash(*args):
+        started.set()
+        release.wait(5)
+        return 'hash'
+
+    errors = []
+
+    def run():
+        try:
+            hasher._run(slow_hash)
+        except ValueError as ex:
+            errors.append(ex)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    started.wait(5)
+    hasher.configure(iterations=1000, max_pending=1)
+    release.set()
+    thread.join()
+    # the slot is given back to the semaphore it was taken from, not to the new full one
+    assert errors == []
+    assert hasher._run(lambda: 'ok') == 'ok'
+    assert hasher._slots.acquire(blocking=False) is True
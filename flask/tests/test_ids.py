@@ -0,0 +1,33 @@
+import time
+from uuid import UUID
+
+from app.ids import uuid7_hex, encode_id, decode_id
+
+
+def test_uuid7_hex_is_a_version_7_uuid():
+    value = uuid7_hex()
+    assert len(value) == 32
+    assert UUID(value).version == 7
+    assert value[16] in '89ab'
+
+
+def test_uuid7_hex_is_time_ordered():
+    first = uuid7_hex()
+    time.sleep(0.002)
+    second = uuid7_hex()
+    assert first < second
+    assert encode_id(first) < encode_id(second)
+
+
+def test_id_codec_round_trip():
+    value = uuid7_hex()
+    encoded = encode_id(value)
+    assert isinstance(encoded, bytes) and len(encoded) == 16
+    assert decode_id(encoded) == value
+
+
+def test_id_codec_leaves_other_values():
+    assert encode_id('not an id') == 'not an id'
+    assert encode_id('z' * 32) == 'z' * 32
+    assert encode_id(None) is None
+    assert decode_id('abc') == 'abc'
@@ -0,0 +1,57 @@
+import pytest
+
+from app.loaders import load_user_from_claims
+from app.models import Person
+
+
+@pytest.fixture
+def claims():
+    Person.clear_cache()
+    yield {'sub': 'person_id', 'tv': 1, 'email': 'ann.black@mail.c', 'first_name': 'Ann', 'last_name': 'Black',
+           'verified': True}
+    Person.clear_cache()
+
+
+def test_load_user_from_claims_checks_stored_token_once(mocker, claims):
+    stored = Person(entity_id='person_id', email='ann.black@mail.c', access_token='token')
+    stored.set_authenticated('token', True)
+    get = mocker.patch.object(Person, 'get', return_value=stored)
+
+    assert load_user_from_claims(claims, 'token') is stored
+    user = load_user_from_claims(claims, 'token')
+    assert get.call_count == 1
+    assert user.email == 'ann.black@mail.c'
+    assert user.is_authenticated is True
+    assert user.load_full() is stored
+
+    # a new version of the person is checked again
+    Person.invalidate_cache('person_id')
+    load_user_from_claims(claims, 'token')
+    assert get.call_count == 3
+
+
+def test_load_user_from_claims_rejects_replaced_token(mocker, claims):
+    stored = Person(entity_id='person_id', access_token='new_token')
+    stored.set_authenticated('new_token', False)
+    mocker.patch.object(Person, 'get', return_value=stored)
+    assert load_user_from_claims(claims, 'token') is None
+    assert Person.is_session_checked('person_id', 'token') is False
+
+
+def test_load_user_from_claims_rejects_token_other_than_stored(mocker, claims):
+    stored = Person(entity_id='person_id', access_token='new_token')
+    stored.set_authenticated('new_token', True)
+    mocker.patch.object(Person, 'get', return_value=stored)
+    assert load_user_from_claims(claims, 'token') is None
+    assert Person.is_session_checked('person_id', 'token') is False
+
+
+def test_load_user_from_claims_rejects_replaced_token_while_cache_is_warm(mocker, claims):
+    stored = Person(entity_id='person_id', access_token='NEW')
+    stored.set_authenticated('NEW', True)
+    get = mocker.patch.object(Person, 'get', return_value=stored)
+    assert load_user_from_claims(claims, 'NEW') is stored
+    assert load_user_from_claims(claims, 'OLD_REPLACED') is None
+    assert get.call_count == 2
+    assert load_user_from_claims(claims, 'NEW').access_token == 'NEW'
+    assert get.call_count == 2
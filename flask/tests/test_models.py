@@ -1,12 +1,16 @@
+import importlib
 import os
 from datetime import datetime, timedelta
 
 import pytest
+from flask import Flask
 
 from app import db
 from app.models import (
-    Person, LoginMethod, OtpMethod, RecoveryCode, get_class_from_string,
+    Person, LoginMethod, OtpMethod, RecoveryCode, Session, ClickwrapAgreement, ClickwrapAcceptance,
+    UserClickwrapStatus, VersionConflict, get_class_from_string,
 )
+from app.transaction import Transaction
 
 with open(os.path.join(os.path.dirname(__file__), 'clear_db.sql'), 'rb') as f:
     _data_sql = f.read().decode('utf8')
@@ -162,6 +166,71 @@ def test_person_is_authenticated_false(app, user_test_1):
         assert user_test_1.is_authenticated is False
 
 
+def test_person_is_authenticated_is_cached_per_token(mocker):
+    confirm = mocker.patch('app.models.confirm_access_token', return_value='person_id')
+    person = Person(entity_id='person_id', access_token='token')
+    saved = Person.verifications_saved
+    assert person.is_authenticated is True
+    assert person.is_authenticated is True
+    assert confirm.call_count == 1
+    assert Person.verifications_saved == saved + 1
+    person.access_token = 'new_token'
+    assert person.is_authenticated is True
+    assert confirm.call_count == 2
+    person.set_authenticated('new_token', False)
+    assert person.is_authenticated is False
+    assert confirm.call_count == 2
+
+
+def test_person_hashes_password_only_when_stored(mocker):
+    hash_password = mocker.patch('app.models.hash_password', return_value='hash')
+    person = Person(email='ann.black@mail.c', raw_password='1234')
+    assert hash_password.call_count == 0
+    assert person.password is None
+    cursor = RecordingCursor()
+    person.get_new_from_scratch().create_in_database(cursor)
+    hash_password.assert_called_once_with('1234')
+    assert person.password == 'hash'
+    assert person.raw_password is None
+    assert 'hash' in cursor.executed[0][1]
+
+
+def test_person_get_login_context_loads_otp_method_in_one_query(mocker):
+    row = {'entity_id': 'person_id', 'version': 'v1', 'email': 'ann.black@mail.c', 'latest_clickwrap_accepted': 1,
+           'otp_method.entity_id': 'otp_id', 'otp_method.person_id': 'person_id', 'otp_method.enabled': 1,
+           'otp_method.secret': 'SECRET'}
+    mocker.patch.object(ClickwrapAgreement, 'get_published_terms', return_value=None)
+    fetch = mocker.patch.object(Person, 'fetchone_dict', return_value=row)
+    with Flask(__name__).test_request_context():
+        person, otp_method = Person.get_login_context('ann.black@mail.c')
+        assert fetch.call_args.kwargs['args'] == ('ann.black@mail.c',)
+        assert person.entity_id == 'person_id'
+        assert not hasattr(person, 'otp_method.secret')
+        assert otp_method.secret == 'SECRET'
+        assert OtpMethod.get('person_id', key='person_id') is otp_method
+        assert Person.get('ann.black@mail.c', key='email', with_clickwrap_acceptance=True) is person
+    assert fetch.call_count == 1
+
+
+def test_person_get_binds_published_clickwrap_terms(mocker):
+    ClickwrapAgreement.clear_cache()
+    published = ClickwrapAgreement(content_version='1.0', version='v2', content_md5='md5')
+    get = mocker.patch.object(ClickwrapAgreement, 'get', return_value=published)
+    fetch = mocker.patch.object(Person, 'fetchone_dict', return_value=None)
+    Person.get('person_id', key='entity_id', with_clickwrap_acceptance=True)
+    Person.get('person_id_2', key='entity_id', with_clickwrap_acceptance=True)
+    assert fetch.call_args.kwargs['args'] == ('1.0', 'v2', 'md5', 'person_id_2')
+    assert 'FROM clickwrap ' not in fetch.call_args.args[0]
+    assert get.call_count == 1
+
+    ClickwrapAgreement.invalidate_cache(ClickwrapAgreement.PUBLISHED_UUID)
+    get.return_value = None
+    Person.get('person_id_3', key='entity_id', with_clickwrap_acceptance=True)
+    assert fetch.call_args.kwargs['args'] == ('person_id_3',)
+    assert get.call_count == 2
+    ClickwrapAgreement.clear_cache()
+
+
 def test_person_is_active(user_test_1):
     assert user_test_1.is_active is True
 
@@ -180,3 +249,370 @@ def test_person_is_anonymous_false(app, user_test_1):
 def test_person_get_id(user_test_1):
     entity_id = user_test_1.entity_id
     assert entity_id == user_test_1.get_id()
+
+
+###
+# BATCHED SAVES
+# #
+
+
+class RecordingCursor:
+    def __init__(self):
+        self.executed = []
+        self.executed_many = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, sql, args=None):
+        self.executed.append((sql, args))
+
+    def executemany(self, sql, args):
+        self.executed_many.append((sql, args))
+
+
+class RecordingConnection:
+    def __init__(self):
+        self.cursor_ = RecordingCursor()
+        self.commits = 0
+
+    def cursor(self):
+        return self.cursor_
+
+    def commit(self):
+        self.commits += 1
+
+
+def test_recovery_code_get_insert_sql():
+    assert RecoveryCode.get_insert_sql() == (
+        "INSERT INTO recovery_code (entity_id, version, previous_version, active, latest, changed_by_id, token, "
+        "otp_method_id) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)"
+    )
+
+
+def test_save_many_uses_one_insert_and_one_notification(app, mocker):
+    notify = mocker.patch.object(RecoveryCode, '_notify_objects_save')
+    connection = RecordingConnection()
+    existing = RecoveryCode(entity_id='existing', version='v1', token='OLD', otp_method_id='otp')
+    codes = [RecoveryCode(otp_method_id='otp', token=str(i)) for i in range(5)] + [existing]
+
+    with app.app_context():
+        saved = RecoveryCode.save_many(codes, connection=connection)
+
+    assert len(saved) == 6
+    assert connection.cursor_.executed == [
+        ("UPDATE recovery_code SET latest = false WHERE entity_id IN %s;", (('existing',),))
+    ]
+    sql, rows = connection.cursor_.executed_many[0]
+    assert len(connection.cursor_.executed_many) == 1
+    assert sql == RecoveryCode.get_insert_sql()
+    assert len(rows) == 6
+    assert connection.commits == 1
+    notify.assert_called_once_with('recovery_code', {'create': saved[:5], 'update': saved[5:]})
+
+
+def test_session_store_upserts_token_without_new_person_version():
+    connection = RecordingConnection()
+    person = Person(entity_id='person_id', version='v1', access_token='token', expires_in=100)
+    Session.store(person, connection=connection)
+    assert len(connection.cursor_.executed) == 1
+    sql, args = connection.cursor_.executed[0]
+    assert sql.startswith('INSERT INTO session (person_id, access_token, expires_in)')
+    assert 'ON DUPLICATE KEY UPDATE' in sql
+    assert args == ('person_id', 'token', 100)
+    assert connection.commits == 1
+
+
+def test_user_clickwrap_status_store_upserts_latest_acceptance():
+    connection = RecordingConnection()
+    acceptance = ClickwrapAcceptance(user_id='person_id', clickwrap_content_version='1.0', clickwrap_version='v2',
+                                     clickwrap_content_md5='md5')
+    UserClickwrapStatus.store(acceptance, connection=connection)
+    assert len(connection.cursor_.executed) == 1
+    sql, args = connection.cursor_.executed[0]
+    assert sql.startswith('INSERT INTO user_clickwrap_status ')
+    assert 'ON DUPLICATE KEY UPDATE' in sql
+    assert args == ('person_id', '1.0', 'v2', 'md5')
+    assert connection.commits == 1
+
+
+def test_clickwrap_acceptance_has_user_accepted_reads_status(mocker):
+    fetch = mocker.patch.object(ClickwrapAcceptance, 'fetchone_dict', return_value={'accepted': 1})
+    assert ClickwrapAcceptance.has_user_accepted('person_id', '1.0', 'v2', 'md5') is True
+    assert 'FROM user_clickwrap_status' in fetch.call_args.args[0]
+    assert fetch.call_args.kwargs['args'] == ('person_id', '1.0', 'v2', 'md5')
+
+
+class ConditionalCursor(RecordingCursor):
+    def __init__(self, rowcount):
+        super().__init__()
+        self.rowcount = rowcount
+
+    def execute(self, sql, args=None):
+        super().execute(sql, args)
+        return self.rowcount
+
+
+class ConsumeCursor(ConditionalCursor):
+    description = [(name,) for name in RecoveryCode.__insert_columns__]
+
+    def fetchall(self):
+        return [('code', self.executed[1][1][0], 'v1', 0, 1, 'person', 'CODE', 'otp')]
+
+
+def test_recovery_code_consume_is_one_conditional_update(mocker):
+    notify = mocker.patch.object(RecoveryCode, '_notify_objects_save')
+    connection = RecordingConnection()
+    connection.cursor_ = ConsumeCursor(rowcount=1)
+    with Flask(__name__).app_context():
+        assert RecoveryCode.consume('CODE', 'otp', connection=connection) is True
+    sql, args = connection.cursor_.executed[0]
+    assert sql.startswith('UPDATE recovery_code SET latest = false WHERE otp_method_id = %s AND token = %s')
+    assert args == ('otp', 'CODE')
+    assert 'INSERT INTO recovery_code' in connection.cursor_.executed[1][0]
+    assert connection.commits == 1
+    (table_name, saves), _ = notify.call_args
+    assert table_name == 'recovery_code'
+    consumed, = saves['update']
+    assert (consumed.entity_id, consumed.previous_version, consumed.active) == ('code', 'v1', 0)
+
+    connection.cursor_ = ConditionalCursor(rowcount=0)
+    notify.reset_mock()
+    with Flask(__name__).app_context():
+        assert RecoveryCode.consume('USED', 'otp', connection=connection) is False
+    assert len(connection.cursor_.executed) == 1
+    notify.assert_not_called()
+
+
+def test_recovery_code_consume_writes_outbox_row(mocker):
+    notify = mocker.patch.object(RecoveryCode, '_notify_objects_save')
+    connection = RecordingConnection()
+    connection.cursor_ = ConsumeCursor(rowcount=1)
+    app = Flask(__name__)
+    app.config['SAVE_NOTIFICATION_OUTBOX'] = True
+    with app.app_context():
+        assert RecoveryCode.consume('CODE', 'otp', connection=connection) is True
+    sql, rows = connection.cursor_.executed_many[0]
+    assert sql.startswith('INSERT INTO outbox')
+    assert rows[0][:2] == ('recovery_code', 'update')
+    assert connection.commits == 1
+    notify.assert_not_called()
+
+
+def test_recovery_code_delete_for_otp_method_uses_one_batch(mocker):
+    codes = [RecoveryCode(entity_id=str(i), version='v1', token=str(i), otp_method_id='otp') for i in range(5)]
+    mocker.patch.object(RecoveryCode, 'get_active', return_value=codes)
+    mocker.patch.object(RecoveryCode, '_notify_objects_save')
+    connection = RecordingConnection()
+    with Flask(__name__).app_context():
+        deleted = RecoveryCode.delete_for_otp_method('otp', connection=connection)
+    assert len(deleted) == 5
+    assert all(code.active is False for code in deleted)
+    assert len(connection.cursor_.executed) == 1
+    assert len(connection.cursor_.executed_many) == 1
+
+
+def save_optimistic(mocker, connection, code):
+    mocker.patch.object(RecoveryCode, '__save_mode__', 'optimistic')
+    mocker.patch.object(RecoveryCode, '_notify_object_save')
+    with Flask(__name__).app_context():
+        return code.save(connection=connection)
+
+
+def test_optimistic_save_replaces_loaded_version(mocker):
+    connection = RecordingConnection()
+    connection.cursor_ = ConditionalCursor(rowcount=1)
+    code = RecoveryCode(entity_id='code', version='v1', token='CODE', otp_method_id='otp')
+    saved = save_optimistic(mocker, connection, code)
+    sql, args = connection.cursor_.executed[0]
+    assert sql == "UPDATE recovery_code SET latest = false WHERE entity_id = %s AND version = %s AND latest = true"
+    assert args == ('code', 'v1')
+    assert connection.cursor_.executed[1] == (RecoveryCode.get_insert_sql(), saved.get_insert_values())
+    assert connection.commits == 1
+
+
+def test_optimistic_save_raises_conflict_when_version_was_replaced(mocker):
+    connection = RecordingConnection()
+    connection.rollback = mocker.Mock()
+    connection.cursor_ = ConditionalCursor(rowcount=0)
+    code = RecoveryCode(entity_id='code', version='v1', token='CODE', otp_method_id='otp')
+    with pytest.raises(VersionConflict) as error:
+        save_optimistic(mocker, connection, code)
+    assert error.value.retryable is True
+    assert len(connection.cursor_.executed) == 1
+    assert connection.rollback.call_count == 1
+    assert connection.commits == 0
+
+
+def test_optimistic_save_rolls_back_to_savepoint_in_transaction(mocker):
+    connection = RecordingConnection()
+    connection.rollback = mocker.Mock()
+    connection.cursor_ = ConditionalCursor(rowcount=0)
+    code = RecoveryCode(entity_id='code', version='v1', token='CODE', otp_method_id='otp')
+    with Transaction() as transaction:
+        transaction._connection = connection
+        with pytest.raises(VersionConflict):
+            save_optimistic(mocker, connection, code)
+        statements = [sql for sql, _ in connection.cursor_.executed]
+        assert connection.rollback.call_count == 0
+        transaction._connection = None
+    assert statements[0].startswith('SAVEPOINT save_')
+    assert statements[1].startswith('UPDATE recovery_code SET latest = false')
+    assert statements[2] == statements[0].replace('SAVEPOINT', 'ROLLBACK TO SAVEPOINT')
+    assert not any(sql.startswith('INSERT') for sql in statements)
+
+
+def test_history_storage_moves_superseded_version(mocker):
+    mocker.patch.object(RecoveryCode, '__storage__', 'history')
+    connection = RecordingConnection()
+    connection.cursor_ = ConditionalCursor(rowcount=1)
+    code = RecoveryCode(entity_id='code', version='v1', token='CODE', otp_method_id='otp')
+    saved = save_optimistic(mocker, connection, code)
+    statements = [sql for sql, _ in connection.cursor_.executed]
+    assert statements[0].startswith('UPDATE recovery_code SET latest = false')
+    assert statements[1] == ("INSERT INTO recovery_code_history SELECT * FROM recovery_code "
+                             "WHERE entity_id = %s AND latest = false;")
+    assert statements[2] == "DELETE FROM recovery_code WHERE entity_id = %s AND latest = false;"
+    assert connection.cursor_.executed[3] == (RecoveryCode.get_insert_sql(), saved.get_insert_values())
+
+
+def test_single_storage_keeps_versions_in_one_table():
+    assert RecoveryCode.get_archive_statements('entity_id = %s', ('code',)) == []
+
+
+class BatchCursor(RecordingCursor):
+    def __init__(self, batches):
+        super().__init__()
+        self.batches = list(batches)
+
+    def fetchall(self):
+        return self.batches.pop(0) if self.batches else []
+
+
+def test_move_to_history_moves_superseded_versions_in_batches(mocker):
+    mocker.patch.object(RecoveryCode, '__storage__', 'history')
+    connection = RecordingConnection()
+    connection.cursor_ = BatchCursor([[('a', 'v1'), ('b', 'v1')], [('c', 'v1')]])
+    assert RecoveryCode.move_to_history(batch_size=2, connection=connection) == 3
+    statements = connection.cursor_.executed
+    assert statements[1][0].startswith('INSERT INTO recovery_code_history SELECT * FROM recovery_code')
+    assert statements[1][1] == ((('a', 'v1'), ('b', 'v1')),)
+    assert statements[0][1] == (2,)
+    assert statements[3][1] == ('b', 'b', 'v1', 2)
+    assert connection.commits == 2
+
+
+def test_move_to_history_requires_history_storage():
+    with pytest.raises(ValueError):
+        RecoveryCode.move_to_history(connection=RecordingConnection())
+
+
+def test_published_version_lookup_binds_arguments_and_reads_history(mocker):
+    fetch = mocker.patch.object(ClickwrapAgreement, 'fetchone_dict', return_value=None)
+    with Flask(__name__).app_context():
+        ClickwrapAgreement.get_content_version_published('1.0"; DROP TABLE person; --', content_md5='md5')
+    query, = fetch.call_args.args
+    assert 'DROP TABLE' not in query
+    assert 'FROM clickwrap_history' in query
+    assert fetch.call_args.kwargs['args'] == ('1.0"; DROP TABLE person; --', ClickwrapAgreement.PUBLISHED_UUID,
+                                              'md5') * 2
+
+
+def binary_ids_app():
+    app = Flask(__name__)
+    app.config['BINARY_IDS'] = True
+    return app
+
+
+def test_binary_ids_are_encoded_on_write_and_decoded_on_read(mocker):
+    code = RecoveryCode(token='CODE', otp_method_id='otp').get_new_from_scratch()
+    row = {'entity_id': bytes.fromhex(code.entity_id), 'version': bytes.fromhex(code.version), 'token': 'CODE'}
+    fetch = mocker.patch.object(RecoveryCode, 'fetchone_dict', return_value=row)
+    with binary_ids_app().app_context():
+        values = code.get_insert_values()
+        found = RecoveryCode.get(code.entity_id, key='entity_id')
+    assert values[:3] == (bytes.fromhex(code.entity_id), bytes.fromhex(code.version), bytes(16))
+    assert values[-2:] == ('CODE', 'otp')
+    assert fetch.call_args.kwargs['args'] == (bytes.fromhex(code.entity_id),)
+    assert found.entity_id == code.entity_id and found.version == code.version
+
+
+def test_decode_row_does_not_modify_the_fetched_row():
+    row = {'entity_id': bytes(16), 'token': 'CODE'}
+    with binary_ids_app().app_context():
+        decoded = RecoveryCode.decode_row(row)
+    assert decoded['entity_id'] == '0' * 32
+    assert row['entity_id'] == bytes(16)
+
+
+def test_binary_ids_off_keeps_hex_ids():
+    code = RecoveryCode(token='CODE', otp_method_id='otp').get_new_from_scratch()
+    with Flask(__name__).app_context():
+        assert code.get_insert_values()[:2] == (code.entity_id, code.version)
+    with binary_ids_app().app_context():
+        assert Person.sql_id(code.entity_id) == code.entity_id
+
+
+def test_binary_ids_config_matches_migrated_schema(monkeypatch):
+    import config
+    monkeypatch.delenv('BINARY_IDS', raising=False)
+    assert importlib.reload(config).Config.BINARY_IDS is True
+    monkeypatch.setenv('BINARY_IDS', 'False')
+    assert importlib.reload(config).Config.BINARY_IDS is False
+    monkeypatch.delenv('BINARY_IDS')
+    importlib.reload(config)
+
+
+def test_save_many_not_supported_without_insert_columns():
+    with pytest.raises(NotImplementedError):
+        Person.save_many([Person()])
+
+
+###
+# IDENTITY MAP
+# #
+
+
+def test_get_reuses_object_within_request(app, mocker):
+    row = {'entity_id': 'lm_id', 'version': 'v1', 'person_id': 'person_id', 'name': 'github'}
+    spy = mocker.patch.object(LoginMethod, 'fetchone_dict', return_value=row)
+    with app.test_request_context():
+        login_method = LoginMethod.get('person_id', key='person_id')
+        assert LoginMethod.get('person_id', key='person_id') is login_method
+        assert LoginMethod.get('lm_id', key='entity_id') is login_method
+        assert spy.call_count == 1
+    with app.test_request_context():
+        LoginMethod.get('person_id', key='person_id')
+        assert spy.call_count == 2
+
+
+def test_save_invalidates_identity_map(app, mocker):
+    spy = mocker.patch.object(RecoveryCode, 'fetchone_dict', return_value=None)
+    mocker.patch.object(RecoveryCode, '_notify_objects_save')
+    with app.test_request_context():
+        assert RecoveryCode.get('TOKEN', key='token') is None
+        assert RecoveryCode.get('TOKEN', key='token') is None
+        assert spy.call_count == 1
+        RecoveryCode.save_many([RecoveryCode(token='TOKEN', otp_method_id='otp')], connection=RecordingConnection())
+        RecoveryCode.get('TOKEN', key='token')
+        assert spy.call_count == 2
+
+
+def test_person_insert_failure_is_raised(mocker):
+    cursor = RecordingCursor()
+    cursor.execute = mocker.Mock(side_effect=Exception('Data too long for column access_token'))
+    person = Person(entity_id='person', version='v2', previous_version='v1', access_token='x' * 300)
+    with pytest.raises(Exception, match='Data too long'):
+        person.create_in_database(cursor)
+
+
+def test_disabling_otp_method_deletes_codes_in_one_batch(mocker):
+    delete = mocker.patch.object(RecoveryCode, 'delete_for_otp_method')
+    get_all = mocker.patch.object(RecoveryCode, 'get_all')
+    otp_method = OtpMethod(entity_id='otp', version='v2', previous_version='v1', enabled=False)
+    otp_method.create_in_database(RecordingCursor())
+    delete.assert_called_once_with('otp')
+    get_all.assert_not_called()
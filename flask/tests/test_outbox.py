@@ -0,0 +1,119 @@
+import json
+
+from flask import Flask
+
+from app.models import OtpMethod, RecoveryCode
+from app.outbox import OutboxRelay, enqueue
+from tests.test_models import RecordingConnection, RecordingCursor
+from tests.test_retention import FakeConnectionContext
+
+
+def test_enqueue_writes_one_row_per_entity():
+    cursor = RecordingCursor()
+    codes = [RecoveryCode(entity_id=str(i), version='v1', token=str(i), otp_method_id='otp') for i in range(3)]
+    enqueue(cursor, 'recovery_code', 'create', codes)
+    sql, rows = cursor.executed_many[0]
+    assert sql.startswith('INSERT INTO outbox')
+    assert len(rows) == 3
+    assert rows[0][:2] == ('recovery_code', 'create')
+    assert json.loads(rows[0][2])['token'] == '0'
+
+
+def test_save_many_writes_outbox_instead_of_notifying(app, mocker):
+    app.config['SAVE_NOTIFICATION_OUTBOX'] = True
+    notify = mocker.patch.object(RecoveryCode, '_notify_objects_save')
+    connection = RecordingConnection()
+    with app.app_context():
+        RecoveryCode.save_many([RecoveryCode(token='TOKEN', otp_method_id='otp')], connection=connection)
+    statements = [sql for sql, _ in connection.cursor_.executed_many]
+    assert statements[1].startswith('INSERT INTO outbox')
+    assert connection.commits == 1
+    notify.assert_not_called()
+
+
+def test_relay_groups_tasks_and_keeps_failed_pusher_rows(mocker):
+    send_tasks = mocker.patch('app.tasks.send_tasks')
+    trigger_batch = mocker.patch('app.outbox.pusher_client.trigger_batch', side_effect=Exception('down'))
+    rows = [
+        {'id': i, 'table_name': 'recovery_code', 'operation': 'create', 'entity': '{}', 'api_entity': '{}',
+         'task_sent': False, 'pusher_sent': False}
+        for i in range(12)
+    ]
+    errors = {}
+    OutboxRelay._send_tasks(rows, errors)
+    OutboxRelay._trigger_pusher(rows, errors)
+    send_tasks.assert_called_once()
+    tasks, = send_tasks.call_args[0]
+    assert [json.loads(task['body'])['task'] for task in tasks] == ['handle_objects_save']
+    assert trigger_batch.call_count == 2
+    assert all(row['task_sent'] and not row['pusher_sent'] for row in rows)
+    assert set(errors) == set(range(12))
+
+
+def test_relay_publishes_all_groups_in_one_batch(mocker):
+    publish_batch = mocker.patch('app.tasks.get_publisher').return_value.publish_batch
+    rows = [
+        {'id': i, 'table_name': table_name, 'operation': 'update', 'entity': '{}', 'task_sent': False}
+        for i, table_name in enumerate(['person', 'person', 'otp_method'])
+    ]
+    OutboxRelay._send_tasks(rows, {})
+    tasks, = publish_batch.call_args[0]
+    assert [json.loads(task['body'])['task'] for task in tasks] == ['handle_objects_save', 'handle_object_save']
+    assert all(row['task_sent'] for row in rows)
+
+
+class OutboxCursor(RecordingCursor):
+    description = [(name,) for name in ('id', 'table_name', 'operation', 'entity', 'api_entity', 'task_sent',
+                                        'pusher_sent', 'attempts')]
+
+    def __init__(self, rows):
+        super().__init__()
+        self.rows = rows
+
+    def fetchall(self):
+        return self.rows
+
+
+def test_relay_moves_row_to_dead_letter_after_last_attempt(mocker):
+    mocker.patch('app.tasks.send_tasks', side_effect=Exception('down'))
+    mocker.patch('app.outbox.pusher_client.trigger_batch')
+    log = mocker.patch('app.outbox.logging.error')
+    connection = RecordingConnection()
+    connection.cursor_ = OutboxCursor([(1, 'person', 'update', '{}', '{}', False, False, 2),
+                                       (2, 'person', 'update', '{}', '{}', False, False, 0)])
+    mocker.patch('app.models.ConnectionContext', FakeConnectionContext(connection))
+    assert OutboxRelay(max_attempts=3).drain_once() == 0
+    statements = connection.cursor_.executed
+    assert statements[-2] == ("INSERT INTO outbox_dead_letter SELECT * FROM outbox WHERE id IN %s", ((1,),))
+    assert statements[-1] == ("DELETE FROM outbox WHERE id IN %s", ((1,),))
+    assert log.call_count == 1
+    assert connection.commits == 1
+
+
+def test_save_writes_cache_invalidation_to_outbox(mocker):
+    app = Flask(__name__)
+    app.config['SAVE_NOTIFICATION_OUTBOX'] = True
+    publish = mocker.patch('app.tasks.publish_cache_invalidation')
+    mocker.patch.object(OtpMethod, 'create_in_database')
+    connection = RecordingConnection()
+    with app.app_context():
+        OtpMethod(entity_id='otp', version='v1', enabled=True).save(connection=connection)
+    sql, args = connection.cursor_.executed[-1]
+    assert sql.startswith('INSERT INTO outbox (table_name, operation, entity, api_entity, pusher_sent)')
+    assert args == ('otp_method', 'invalidate', '["otp"]')
+    assert connection.commits == 1
+    publish.assert_not_called()
+
+
+def test_relay_publishes_cache_invalidations(mocker):
+    publish_batch = mocker.patch('app.tasks.get_publisher').return_value.publish_batch
+    rows = [
+        {'id': 1, 'table_name': 'otp_method', 'operation': 'update', 'entity': '{}', 'task_sent': False},
+        {'id': 2, 'table_name': 'otp_method', 'operation': 'invalidate', 'entity': '["otp"]', 'task_sent': False},
+    ]
+    OutboxRelay._send_tasks(rows, {})
+    invalidation, task = publish_batch.call_args[0][0]
+    assert invalidation['exchange'] == 'cache-invalidation'
+    assert json.loads(invalidation['body'])['entity_ids'] == ['otp']
+    assert json.loads(task['body'])['task'] == 'handle_object_save'
+    assert all(row['task_sent'] for row in rows)
@@ -0,0 +1,101 @@
+import threading
+
+import pymysql
+import pytest
+from pymysql.constants import SERVER_STATUS
+
+from app.pool import ConnectionPool, PoolTimeout
+
+
+class FakeConnection:
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.open = True
+        self.server_status = 0
+        self.pings = 0
+        self.rollbacks = 0
+        self.alive = True
+
+    def ping(self, reconnect=True):
+        self.pings += 1
+        if not self.alive:
+            raise pymysql.err.OperationalError(2006, 'MySQL server has gone away')
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.server_status &= ~SERVER_STATUS.SERVER_STATUS_IN_TRANS
+
+    def close(self):
+        self.open = False
+
+
+@pytest.fixture
+def pool():
+    p = ConnectionPool()
+    p.configure(connect_kwargs={'database': 'test'}, min_size=0, max_size=2, timeout=0.1, connect=FakeConnection)
+    return p
+
+
+def test_pool_reuses_released_connection(pool):
+    connection = pool.acquire()
+    assert connection.kwargs == {'database': 'test'}
+    pool.release(connection)
+    assert pool.acquire() is connection
+    assert connection.pings == 1
+    assert pool.stats()['connects'] == 1
+
+
+def test_pool_timeout_when_exhausted(pool):
+    pool.acquire()
+    pool.acquire()
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+    stats = pool.stats()
+    assert stats['in_use'] == 2
+    assert stats['idle'] == 0
+    assert stats['timeouts'] == 1
+
+
+def test_pool_waiter_gets_released_connection(pool):
+    first = pool.acquire()
+    pool.acquire()
+    timer = threading.Timer(0.02, pool.release, args=(first,))
+    timer.start()
+    assert pool.acquire(timeout=1) is first
+    assert pool.stats()['wait_time_max'] > 0
+
+
+def test_pool_replaces_dead_connection(pool):
+    connection = pool.acquire()
+    pool.release(connection)
+    connection.alive = False
+    new_connection = pool.acquire()
+    assert new_connection is not connection
+    assert connection.open is False
+    assert pool.stats()['discarded'] == 1
+
+
+def test_pool_recycles_old_connection(pool):
+    pool.recycle = 0.01
+    connection = pool.acquire()
+    pool.release(connection)
+    threading.Event().wait(0.02)
+    assert pool.acquire() is not connection
+    assert connection.open is False
+
+
+def test_pool_rolls_back_open_transaction_on_release(pool):
+    connection = pool.acquire()
+    connection.server_status |= SERVER_STATUS.SERVER_STATUS_IN_TRANS
+    pool.release(connection)
+    assert connection.rollbacks == 1
+    assert pool.stats()['idle'] == 1
+
+
+def test_pool_fills_min_size():
+    p = ConnectionPool()
+    p.configure(min_size=2, max_size=3, connect=FakeConnection)
+    p.acquire()
+    stats = p.stats()
+    assert stats['size'] == 2
+    assert stats['idle'] == 1
@@ -0,0 +1,64 @@
+import threading
+
+from app.pusher import PusherDispatcher
+
+
+class FakePusher:
+    def __init__(self, fail=False):
+        self.batches = []
+        self.fail = fail
+        self.called = threading.Event()
+
+    def trigger_batch(self, batch):
+        self.batches.append(batch)
+        self.called.set()
+        if self.fail:
+            raise Exception('Pusher is down')
+
+
+def test_dispatcher_coalesces_and_groups_per_channel():
+    client = FakePusher()
+    dispatcher = PusherDispatcher(client)
+    dispatcher.flush_interval = 60
+    dispatcher.dispatch('recovery_code', 'create', {'entity_id': 'a', 'version': 1})
+    dispatcher.dispatch('person', 'update', {'entity_id': 'p'})
+    dispatcher.dispatch('recovery_code', 'create', {'entity_id': 'b'})
+    dispatcher.dispatch('recovery_code', 'create', {'entity_id': 'a', 'version': 2})
+    assert dispatcher.queue_depth == 3
+    dispatcher.flush()
+    assert client.batches == [[
+        {'channel': 'person', 'name': 'update', 'data': {'entity_id': 'p'}},
+        {'channel': 'recovery_code', 'name': 'create', 'data': {'entity_id': 'a', 'version': 2}},
+        {'channel': 'recovery_code', 'name': 'create', 'data': {'entity_id': 'b'}},
+    ]]
+    stats = dispatcher.stats()
+    assert stats['queue_depth'] == 0
+    assert stats['coalesced'] == 1
+    assert stats['sent'] == 3
+
+
+def test_dispatcher_flushes_in_batches_of_ten_from_background():
+    client = FakePusher()
+    dispatcher = PusherDispatcher(client)
+    dispatcher.flush_interval = 60
+    dispatcher.flush_size = 25
+    dispatcher.dispatch_batch([
+        {'channel': 'recovery_code', 'name': 'create', 'data': {'entity_id': i}} for i in range(25)
+    ])
+    assert client.called.wait(1)
+    dispatcher._thread.join(0.1)
+    assert [len(batch) for batch in client.batches] == [10, 10, 5]
+    assert dispatcher.stats()['flushes'] == 1
+
+
+def test_dispatcher_never_raises_and_drops_when_full():
+    client = FakePusher(fail=True)
+    dispatcher = PusherDispatcher(client)
+    dispatcher.flush_interval = 60
+    dispatcher.max_queue = 1
+    assert dispatcher.dispatch('person', 'update', {'entity_id': 'p1'}) is True
+    assert dispatcher.dispatch('person', 'update', {'entity_id': 'p2'}) is False
+    dispatcher.flush()
+    stats = dispatcher.stats()
+    assert stats['dropped'] == 1
+    assert stats['failed'] == 1
@@ -0,0 +1,92 @@
+import pytest
+
+from app.retention import VersionPruner, parse_retention, DEFAULT_RETENTION
+from tests.test_models import RecordingConnection, RecordingCursor
+
+
+class PruneCursor(RecordingCursor):
+    """Returns the queued batches to the key reads and the number of keys to deletes."""
+
+    def __init__(self, batches):
+        super().__init__()
+        self.batches = list(batches)
+
+    def execute(self, sql, args=None):
+        super().execute(sql, args)
+        if sql.startswith('DELETE'):
+            return len(args[0])
+        return 0
+
+    def fetchall(self):
+        return self.batches.pop(0) if self.batches else []
+
+
+class FakeConnectionContext:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __call__(self, *args, **kwargs):
+        return self
+
+    def __enter__(self):
+        return self.connection
+
+    def __exit__(self, *args):
+        pass
+
+
+def prune(mocker, batches, **options):
+    connection = RecordingConnection()
+    connection.cursor_ = PruneCursor(batches)
+    mocker.patch('app.models.ConnectionContext', FakeConnectionContext(connection))
+    pruner = VersionPruner(batch_size=2, sleep=0, **options)
+    return pruner.prune_table('recovery_code', 30), connection
+
+
+def test_parse_retention():
+    assert parse_retention(None) == DEFAULT_RETENTION
+    assert parse_retention('person=90, recovery_code=7') == {'person': 90, 'recovery_code': 7}
+
+
+def test_parse_retention_rejects_clickwrap_tables():
+    with pytest.raises(ValueError):
+        parse_retention('person=90,clickwrap_acceptance=30')
+    with pytest.raises(ValueError):
+        VersionPruner(retention={'clickwrap': 30})
+
+
+def test_pruner_deletes_expired_versions_in_batches(mocker):
+    batches = [[('a', 'v1', 1), ('a', 'v2', 0)], [('b', 'v1', 1)]]
+    report, connection = prune(mocker, batches)
+    assert report['table'] == 'recovery_code'
+    assert report['scanned'] == 3
+    assert report['reclaimed'] == 2
+    statements = connection.cursor_.executed
+    deletes = [(sql, args) for sql, args in statements if sql.startswith('DELETE')]
+    assert deletes == [
+        ("DELETE FROM recovery_code WHERE (entity_id, version) IN %s AND latest = 0", ((('a', 'v1'),),)),
+        ("DELETE FROM recovery_code WHERE (entity_id, version) IN %s AND latest = 0", ((('b', 'v1'),),)),
+    ]
+    # the second read continues after the last key of the first batch
+    reads = [args for sql, args in statements if sql.startswith('SELECT')]
+    assert reads[1] == (30, 'a', 'a', 'v2', 2)
+    assert connection.commits == 2
+
+
+def test_pruner_archives_and_dry_runs(mocker):
+    _, connection = prune(mocker, [[('a', 'v1', 1)]], archive=True)
+    assert connection.cursor_.executed[1][0].startswith('INSERT INTO recovery_code_history SELECT * FROM recovery_code')
+
+    report, connection = prune(mocker, [[('a', 'v1', 1)]], dry_run=True)
+    assert report['reclaimed'] == 1
+    assert not any(sql.startswith('DELETE') for sql, _ in connection.cursor_.executed)
+
+
+def test_pruner_prunes_history_table_with_history_storage(mocker):
+    report, _ = prune(mocker, [[('a', 'v1', 1)]], storage='history', archive=True)
+    assert report['table'] == 'recovery_code_history'
+
+
+def test_pruner_rejects_table_without_retention():
+    with pytest.raises(ValueError):
+        VersionPruner(retention='person=90').run(['clickwrap'])
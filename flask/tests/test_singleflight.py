@@ -0,0 +1,173 @@
+import threading
+
+import pytest
+
+from app.identity_map import current_identity_map
+from app.models import ClickwrapAgreement, Person
+from app.repositories import ClickwrapRepository, PersonRepository
+from app.singleflight import SingleFlight, single_flight
+from app.transaction import Transaction
+
+
+def run_concurrently(func, number=5):
+    results = [None] * number
+    errors = [None] * number
+
+    def run(i):
+        try:
+            results[i] = func()
+        except Exception as ex:
+            errors[i] = ex
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(number)]
+    for thread in threads:
+        thread.start()
+    return threads, results, errors
+
+
+def blocking(result=None, error=None):
+    """A function that blocks until released and counts its calls."""
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def func(*args, **kwargs):
+        calls.append(args)
+        started.set()
+        release.wait(5)
+        if error:
+            raise error
+        return result
+
+    return func, started, release, calls
+
+
+def wait_for_waiters(flight, number):
+    for _ in range(500):
+        if flight.stats()['shared'] >= number:
+            return
+        threading.Event().wait(0.01)
+
+
+def test_single_flight_shares_one_call():
+    flight = SingleFlight()
+    func, started, release, calls = blocking(result={'entity_id': 'a'})
+    threads, results, _ = run_concurrently(lambda: flight.do('key', func))
+    started.wait(5)
+    wait_for_waiters(flight, 4)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert all(result == {'entity_id': 'a'} for result in results)
+    assert flight.stats() == {'in_flight': 0, 'calls': 1, 'shared': 4}
+
+
+def test_single_flight_shares_exception():
+    flight = SingleFlight()
+    func, started, release, calls = blocking(error=ValueError('failed'))
+    threads, _, errors = run_concurrently(lambda: flight.do('key', func), number=3)
+    started.wait(5)
+    wait_for_waiters(flight, 2)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert all(isinstance(error, ValueError) for error in errors)
+    with pytest.raises(KeyError):
+        flight.do('key', lambda: {}['missing'])
+
+
+def test_single_flight_forget_starts_new_call():
+    flight = SingleFlight()
+    func, started, release, calls = blocking(result=1)
+    thread = threading.Thread(target=flight.do, args=('key', func))
+    thread.start()
+    started.wait(5)
+    flight.forget()
+    assert flight.do('key', lambda: 2) == 2
+    release.set()
+    thread.join()
+
+
+def test_single_flight_decorator_copies_result_for_waiters():
+    class Repository:
+        def __init__(self):
+            self.loaded = []
+
+    func, started, release, calls = blocking(result=Repository())
+
+    @single_flight(key=lambda self, name: name)
+    def get(self, name):
+        return func(name)
+
+    threads, results, _ = run_concurrently(lambda: get(object(), 'published'), number=3)
+    started.wait(5)
+    wait_for_waiters(get.flight, 2)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert len({id(result) for result in results}) == 3
+    assert len({id(result.loaded) for result in results}) == 3
+
+
+def test_versioned_model_get_shares_query(mocker):
+    func, started, release, calls = blocking(
+        result={'entity_id': ClickwrapAgreement.PUBLISHED_UUID, 'version': 'v1', 'content': 'Terms'}
+    )
+    mocker.patch.object(ClickwrapAgreement, 'fetchone_dict', side_effect=func)
+    ClickwrapAgreement.clear_cache()
+    shared = ClickwrapAgreement.__single_flight__.stats()['shared']
+    threads, results, _ = run_concurrently(
+        lambda: ClickwrapAgreement.get(ClickwrapAgreement.PUBLISHED_UUID, 'entity_id'), number=4
+    )
+    started.wait(5)
+    wait_for_waiters(ClickwrapAgreement.__single_flight__, shared + 3)
+    release.set()
+    for thread in threads:
+        thread.join()
+    ClickwrapAgreement.clear_cache()
+    assert len(calls) == 1
+    assert len({id(result) for result in results}) == 4
+    assert all(result.content == 'Terms' for result in results)
+
+
+def test_repository_get_published_shares_one_call(mocker):
+    func, started, release, calls = blocking(
+        result={'entity_id': ClickwrapAgreement.PUBLISHED_UUID, 'version': 'v1', 'content': 'Terms'}
+    )
+    mocker.patch.object(ClickwrapAgreement, 'fetchone_dict', side_effect=func)
+    ClickwrapAgreement.clear_cache()
+    flight = ClickwrapRepository.get_published.flight
+    shared = flight.stats()['shared']
+
+    def get_published():
+        # every caller has its own transaction and identity map
+        with Transaction():
+            clickwrap = ClickwrapRepository().get_published()
+            found, mapped = current_identity_map().get(ClickwrapAgreement.__tablename__, 'entity_id',
+                                                       ClickwrapAgreement.PUBLISHED_UUID)
+            assert found and mapped is clickwrap
+            return clickwrap
+
+    threads, results, errors = run_concurrently(get_published, number=4)
+    started.wait(5)
+    wait_for_waiters(flight, shared + 3)
+    release.set()
+    for thread in threads:
+        thread.join()
+    ClickwrapAgreement.clear_cache()
+    assert errors == [None] * 4
+    assert len(calls) == 1
+    assert len({id(result) for result in results}) == 4
+    assert all(result.content == 'Terms' for result in results)
+
+
+def test_person_lookup_by_id_is_not_shared_with_pending_writes(mocker):
+    get = mocker.patch.object(Person, 'get', return_value=Person(entity_id='person_id'))
+    mocker.patch('app.singleflight.has_pending_writes', return_value=True)
+    do = mocker.spy(Person.__single_flight__, 'do')
+    assert PersonRepository.get_by_id('person_id').entity_id == 'person_id'
+    get.assert_called_once_with('person_id', key='entity_id')
+    do.assert_not_called()
@@ -0,0 +1,128 @@
+import json
+import threading
+
+import pika
+import pytest
+
+from app.models import OtpMethod, invalidate_cached_entities
+from app.tasks import CacheInvalidationSubscriber, PROCESS_ID, Publisher, PublisherTimeout
+
+
+class FakeChannel:
+    def __init__(self, connection):
+        self.connection = connection
+        self.is_open = True
+        self.declared = []
+        self.published = []
+        self.confirms = False
+
+    def confirm_delivery(self):
+        self.confirms = True
+
+    def exchange_declare(self, exchange, exchange_type, durable):
+        self.declared.append(('exchange', exchange))
+
+    def queue_declare(self, queue, durable):
+        self.declared.append(('queue', queue))
+
+    def basic_publish(self, exchange, routing_key, body, properties=None):
+        if not self.connection.is_open:
+            raise pika.exceptions.StreamLostError('Stream connection lost')
+        self.published.append((exchange, routing_key, body))
+
+
+class FakeBlockingConnection:
+    def __init__(self, parameters):
+        self.is_open = True
+        self._channel = FakeChannel(self)
+
+    def channel(self):
+        return self._channel
+
+    def process_data_events(self, time_limit=0):
+        pass
+
+    def close(self):
+        self.is_open = False
+
+
+@pytest.fixture
+def publisher():
+    return Publisher(None, max_channels=2, timeout=0.05, connect=FakeBlockingConnection)
+
+
+def test_cache_invalidation_subscriber_skips_own_messages():
+    invalidated = []
+    subscriber = CacheInvalidationSubscriber(None, on_invalidate=lambda *args: invalidated.append(args),
+                                             on_reset=lambda: None)
+    body = json.dumps({'origin': 'other', 'table': 'otp_method', 'entity_ids': ['otp_id']})
+    subscriber._on_message(None, None, None, body)
+    body = json.dumps({'origin': PROCESS_ID, 'table': 'otp_method', 'entity_ids': ['own_id']})
+    subscriber._on_message(None, None, None, body)
+    subscriber._on_message(None, None, None, b'not json')
+    assert invalidated == [('otp_method', ['otp_id'])]
+
+
+def test_invalidate_cached_entities():
+    OtpMethod.__cache__.clear()
+    OtpMethod.__cache__.set_row('person_id', 'person_id', {'entity_id': 'otp_id'})
+    invalidate_cached_entities('person', ['otp_id'])
+    assert OtpMethod.__cache__.get_row('person_id', 'person_id') is not None
+    invalidate_cached_entities('otp_method', ['otp_id'])
+    assert OtpMethod.__cache__.get_row('person_id', 'person_id') is None
+
+
+def test_publisher_reuses_channel_and_declarations(publisher):
+    publisher.publish('email', 'email', b'1', exchange_type='direct')
+    publisher.publish('email', 'email', b'2', exchange_type='direct')
+    channel = publisher._idle[0].channel
+    assert channel.confirms is True
+    assert channel.declared == [('exchange', 'email')]
+    assert [body for _, _, body in channel.published] == [b'1', b'2']
+    assert publisher.stats()['connects'] == 1
+
+
+def test_publisher_reconnects_after_connection_loss(publisher):
+    publisher.publish('', 'queue', b'1', queue='queue')
+    lost = publisher._idle[0]
+    # the broker dropped the connection without pika noticing yet
+    lost.connection.is_open = True
+    lost.channel.connection = type('Closed', (), {'is_open': False})()
+    publisher.publish('', 'queue', b'2', queue='queue')
+    channel = publisher._idle[0].channel
+    assert channel is not lost.channel
+    assert channel.declared == [('queue', 'queue')]
+    assert channel.published == [('', 'queue', b'2')]
+    assert publisher.stats()['reconnects'] == 1
+
+
+def test_publisher_batch_uses_one_channel_with_confirms():
+    publisher = Publisher(None, connect=FakeBlockingConnection)
+    publisher.publish_batch([dict(exchange='', routing_key='queue', body=str(i)) for i in range(5)])
+    channel = publisher._idle[0].channel
+    assert len(channel.published) == 5
+    assert channel.confirms is True
+    assert publisher.stats()['connects'] == 1
+
+
+def test_publisher_rejects_transaction_batch_mode():
+    with pytest.raises(ValueError):
+        Publisher(None, confirm_mode='batch', connect=FakeBlockingConnection)
+
+
+def test_publisher_timeout_when_all_channels_in_use(publisher):
+    publisher._acquire()
+    publisher._acquire()
+    with pytest.raises(PublisherTimeout):
+        publisher._acquire()
+
+
+def test_publisher_is_thread_safe(publisher):
+    threads = [threading.Thread(target=publisher.publish, args=('', 'queue', b'x')) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats = publisher.stats()
+    assert stats['published'] == 20
+    assert stats['size'] <= 2
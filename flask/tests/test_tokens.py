@@ -5,7 +5,7 @@ from itsdangerous import URLSafeTimedSerializer
 
 from app.tokens import (
     generate_access_token, generate_confirmation_token, confirm_token,
-    confirm_access_token,
+    confirm_access_token, TokenService,
 )
 
 
@@ -51,3 +51,37 @@ def test_confirm_token(app, user_test_1):
 
         email = confirm_token(token, expiration=1)
         assert email is False
+
+
+def test_token_service_accepts_rotated_keys():
+    old = TokenService()
+    old.configure(['old_secret'], 'salt', access_token_expire=60)
+    token, _ = old.generate_access_token('entity_id')
+    rotated = TokenService()
+    rotated.configure(['old_secret', 'new_secret'], 'salt', access_token_expire=60)
+    assert rotated.confirm_access_token(token) == 'entity_id'
+    new_token, _ = rotated.generate_access_token('entity_id')
+    assert old.confirm_access_token(new_token) is False
+    new = TokenService()
+    new.configure(['new_secret'], 'salt')
+    assert new.verify(new_token) == 'entity_id'
+
+
+def test_token_service_reuses_serializers_without_app_context():
+    service = TokenService()
+    service.configure(['secret'], 'salt')
+    token = service.dumps('value')
+    assert service.serializer() is service.serializer('salt')
+    assert service.verify(token, salt='other_salt') is False
+    assert service.verify(token, max_age=60) == 'value'
+
+
+def test_token_service_claims_tokens():
+    service = TokenService()
+    service.configure(['secret'], 'salt', access_token_expire=60, claims=True, token_version=2)
+    token, _ = service.generate_claims_token({'sub': 'entity_id', 'tv': 2, 'email': 'ann.black@mail.c'})
+    assert service.verify_access_token(token)['email'] == 'ann.black@mail.c'
+    assert service.confirm_access_token(token) == 'entity_id'
+    service.token_version = 3
+    assert service.verify_access_token(token) is False
+    assert service.confirm_access_token(service.dumps('entity_id')) == 'entity_id'
@@ -0,0 +1,66 @@
+import pytest
+
+from app import db_pool
+from app.transaction import Transaction, current_transaction, commit
+from tests.test_pool import FakeConnection
+
+
+class TransactionalConnection(FakeConnection):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.commits = 0
+
+    def commit(self):
+        self.commits += 1
+
+
+@pytest.fixture
+def pool():
+    db_pool.configure(min_size=0, max_size=2, timeout=0.1, connect=TransactionalConnection)
+    yield db_pool
+    db_pool.configure()
+
+
+def test_transaction_defers_commit_and_callbacks(pool):
+    calls = []
+    with Transaction() as transaction:
+        connection = transaction.connection
+        commit(connection, lambda: calls.append('notified'))
+        commit(connection, lambda: calls.append('notified again'))
+        assert connection.commits == 0
+        assert calls == []
+    assert connection.commits == 1
+    assert calls == ['notified', 'notified again']
+    assert current_transaction() is None
+    assert pool.stats()['in_use'] == 0
+
+
+def test_nested_transaction_joins_outer(pool):
+    checkouts = pool.stats()['checkouts']
+    with Transaction() as outer:
+        with Transaction() as inner:
+            assert inner.connection is outer.connection
+            inner.commit()
+            assert outer.connection.commits == 0
+        assert current_transaction() is outer
+    assert outer.is_owner
+    assert pool.stats()['checkouts'] == checkouts + 1
+
+
+def test_transaction_rolls_back_on_exception(pool):
+    calls = []
+    with pytest.raises(ValueError):
+        with Transaction() as transaction:
+            connection = transaction.connection
+            commit(connection, lambda: calls.append('notified'))
+            raise ValueError
+    assert connection.commits == 0
+    assert connection.rollbacks == 1
+    assert calls == []
+
+
+def test_transaction_without_queries_does_not_checkout(pool):
+    checkouts = pool.stats()['checkouts']
+    with Transaction():
+        pass
+    assert pool.stats()['checkouts'] == checkouts
@@ -12,3 +12,12 @@ def handle_object_save(table_name, operation, **message):
     logging.debug(table_name)
     logging.debug(operation)
     logging.debug(message)
+
+
+@celery_app.task(name='handle_objects_save')
+def handle_objects_save(table_name, operation, objects=()):
+    """
+    Batched variant of handle_object_save sent by VersionedModel.save_many.
+    """
+    for message in objects:
+        handle_object_save(table_name, operation, **message)